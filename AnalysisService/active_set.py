@@ -0,0 +1,41 @@
+from typing import Any, Dict, Optional, Tuple
+import json
+import os
+
+class ActiveDescriptorSet:
+    """Pointer to the descriptor set the service reads and writes, shared by every worker through a file.
+
+    The file holds the set name together with the embeddings config that
+    produced its vectors, so switching sets also switches models. It is
+    replaced atomically, and readers compare its inode and mtime to notice
+    a switch without parsing it on every request. Without the file the
+    defaults from config.yaml apply.
+    """
+
+    def __init__(self, path: str, default_set: str, default_embeddings: Dict[str, Any]):
+        self.path = path
+        self.default = {"descriptor_set": default_set, "embeddings": default_embeddings}
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def version(self) -> Optional[Tuple[int, int]]:
+        """Cheap token that changes whenever the pointer is switched."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def read(self) -> Dict[str, Any]:
+        """Return the active {"descriptor_set", "embeddings"}."""
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return self.default
+
+    def switch(self, descriptor_set: str, embeddings: Dict[str, Any]):
+        """Atomically point every worker at another descriptor set."""
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"descriptor_set": descriptor_set, "embeddings": embeddings}, f)
+        os.replace(tmp_path, self.path)
@@ -1,11 +1,16 @@
 from typing import Annotated, Literal, Sequence, TypedDict, List, Dict, Any, Optional, Union
-from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage, ToolMessage, message_to_dict, messages_from_dict
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import PromptTemplate
+from langchain_core.utils.json import parse_json_markdown
 from langchain_together import ChatTogether
 from langchain.output_parsers import PydanticOutputParser
 from langgraph.graph import END, StateGraph, START
+import asyncio
 import logging
+import math
+import time
+import numpy as np
 import traceback
 import yaml
 import os
@@ -18,6 +23,11 @@ from models import (
     IntermediateStep,
     IntermediateResults
 )
+from tools import active_descriptor_set, aget_aperture_tools, embedding_model_id, get_active_embeddings, get_config_tools
+from trend_registry import TrendRegistry, expand_trends, format_known_trends, get_trend_registry, trend_text
+from cassette import get_cassette
+from ranking import rank_trends
+from usage import record_llm_call, start_request_usage, start_step_usage, total_usage
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -35,6 +45,8 @@ class AnalysisState(TypedDict):
     k: int
     intermediate_results: IntermediateResults
     final_result: Optional[StartupAnalysisResponse]
+    context_task: Optional[asyncio.Task]
+    retrieved_context: Optional[str]
 
 def create_chat_model() -> ChatTogether:
     """Create a ChatTogether model instance with error handling."""
@@ -52,16 +64,172 @@ def create_chat_model() -> ChatTogether:
         logger.error(f"Failed to initialize ChatTogether model: {e}")
         raise RuntimeError("Failed to initialize language model") from e
 
+async def invoke_model(model: Any, messages: List[BaseMessage]) -> AIMessage:
+    """Invoke a chat model, recording or replaying the call when a cassette is active."""
+    cassette = get_cassette()
+    started = time.perf_counter()
+    if not cassette.enabled:
+        response = await model.ainvoke(messages)
+        record_llm_call(response, started, time.perf_counter() - started)
+        return response
+    payload = {
+        "model": config["model"]["name"],
+        "messages": [
+            {
+                "type": m.type,
+                "content": m.content,
+                "tool_calls": getattr(m, "tool_calls", None),
+                "tool_call_id": getattr(m, "tool_call_id", None)
+            }
+            for m in messages
+        ],
+        "tools": getattr(model, "kwargs", {}).get("tools", [])
+    }
+
+    async def call() -> Dict[str, Any]:
+        return message_to_dict(await model.ainvoke(messages))
+
+    response = messages_from_dict([await cassette.acall("chat", payload, call)])[0]
+    record_llm_call(response, started, time.perf_counter() - started, replayed=cassette.mode == "replay")
+    return response
+
+NO_CONTEXT = "No relevant documents found."
+
+def format_context(documents: List[Any]) -> str:
+    """Format retrieved documents as a numbered list for prompt injection."""
+    if not documents:
+        return NO_CONTEXT
+    max_chars = config["retrieval"]["max_chars_per_document"]
+    sections = []
+    for i, doc in enumerate(documents, start=1):
+        source = doc.metadata.get("filename", "unknown source")
+        sections.append(f"[{i}] ({source}) {doc.page_content[:max_chars].strip()}")
+    return "\n\n".join(sections)
+
+async def retrieve_context(user_input: str) -> str:
+    """Retrieve relevant documents from ApertureDB and format them as prompt context."""
+    async def fetch() -> str:
+        tools = await aget_aperture_tools()
+        documents = await tools.retrieve(user_input)
+        documents = documents[:config["retrieval"]["k"]]
+        logger.info(f"Retrieved {len(documents)} documents for context")
+        return format_context(documents)
+
+    try:
+        return await get_cassette().acall("retrieval", {"query": user_input, "k": config["retrieval"]["k"]}, fetch)
+    except Exception as e:
+        logger.warning(f"Context retrieval failed, continuing without context: {e}")
+        return NO_CONTEXT
+
+def start_context_prefetch(user_input: str) -> Optional[asyncio.Task]:
+    """Start the retrieval in the background so it overlaps with graph setup and model warm-up."""
+    if not config["retrieval"]["enabled"]:
+        return None
+    return asyncio.create_task(retrieve_context(user_input))
+
+async def await_context(state: AnalysisState) -> str:
+    """Wait for the prefetched context, falling back to no context on timeout."""
+    if state.get("retrieved_context") is not None:
+        return state["retrieved_context"]
+    task = state.get("context_task")
+    if task is None:
+        return NO_CONTEXT
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), timeout=config["retrieval"]["timeout_seconds"])
+    except asyncio.TimeoutError:
+        logger.warning("Context retrieval timed out, continuing without context")
+        task.cancel()
+        return NO_CONTEXT
+
+def get_registry() -> Optional[TrendRegistry]:
+    """Get the trend registry for the active embedding model, or None if it is disabled.
+
+    Only the active embeddings config is read, so the registry works
+    without an ApertureDB connection.
+    """
+    if not config["trend_registry"]["enabled"]:
+        return None
+    settings = active_descriptor_set.read()["embeddings"]
+    return get_trend_registry(settings["dimensions"], embedding_model_id(settings))
+
+async def known_trends_context(user_input: str) -> str:
+    """List the canonical trends most similar to the request for the trend prompt."""
+    async def lookup() -> str:
+        registry = get_registry()
+        if registry is None or not await asyncio.to_thread(len, registry):
+            return format_known_trends([])
+        _, embeddings = get_active_embeddings()
+        embedding = await embeddings.aembed_query(user_input)
+        registry_config = config["trend_registry"]
+        return format_known_trends(await asyncio.to_thread(
+            registry.relevant, embedding, registry_config["prompt_trends"], registry_config["min_count"]
+        ))
+
+    try:
+        # Through the cassette, since the registry's contents differ between recording and replay
+        return await asyncio.wait_for(
+            get_cassette().acall("known_trends", {"query": user_input}, lookup),
+            timeout=config["trend_registry"]["timeout_seconds"]
+        )
+    except asyncio.TimeoutError:
+        logger.warning("Known trend lookup timed out, continuing without known trends")
+        return format_known_trends([])
+    except Exception as e:
+        logger.warning(f"Known trend lookup failed, continuing without known trends: {e}")
+        return format_known_trends([])
+
+async def run_tool_call(tools_by_name: Dict[str, Any], tool_call: Dict[str, Any]) -> ToolMessage:
+    """Execute a single tool call requested by the model."""
+    try:
+        tool = tools_by_name[tool_call["name"]]
+        content = await get_cassette().acall(
+            "tool",
+            {"name": tool_call["name"], "args": tool_call["args"]},
+            lambda: tool.ainvoke(tool_call["args"])
+        )
+    except Exception as e:
+        logger.warning(f"Tool call {tool_call['name']} failed: {e}")
+        content = f"Tool call failed: {e}"
+    return ToolMessage(content=str(content), tool_call_id=tool_call["id"], name=tool_call["name"])
+
+async def invoke_with_tools(chat_model: ChatTogether, messages: List[BaseMessage]) -> AIMessage:
+    """Invoke the model with the ApertureDB tools bound, running requested tool calls concurrently."""
+    if not config["aperturedb"]["tools_enabled"]:
+        return await invoke_model(chat_model, messages)
+
+    tools = get_config_tools()
+    tools_by_name = {tool.name: tool for tool in tools}
+    tool_model = chat_model.bind_tools(tools)
+    messages = list(messages)
+    for _ in range(config["aperturedb"]["max_tool_rounds"]):
+        response = await invoke_model(tool_model, messages)
+        if not response.tool_calls:
+            return response
+        logger.info(f"Running {len(response.tool_calls)} tool calls concurrently")
+        tool_messages = await asyncio.gather(
+            *(run_tool_call(tools_by_name, tool_call) for tool_call in response.tool_calls)
+        )
+        messages.extend([response, *tool_messages])
+
+    # Out of tool rounds, so ask for an answer without tools
+    return await invoke_model(chat_model, messages)
+
 async def trend_analysis(state: AnalysisState) -> Dict[str, Any]:
     """Analyze trends based on user input."""
     try:
-        chat_model = create_chat_model()
+        recorder = start_step_usage()
+        # Warm up the model client while the prefetched retrieval finishes
+        chat_model, retrieved_context, known_trends = await asyncio.gather(
+            asyncio.to_thread(create_chat_model),
+            await_context(state),
+            known_trends_context(state["user_input"])
+        )
         trend_parser = PydanticOutputParser(pydantic_object=KTrendOps)
         format_instructions = trend_parser.get_format_instructions()
         
         prompt = PromptTemplate(
             template=config["prompts"]["trend_analysis"],
-            input_variables=["format_instructions", "user_input", "k"]
+            input_variables=["format_instructions", "user_input", "k", "retrieved_context", "known_trends"]
         )
         
         messages = [
@@ -69,11 +237,13 @@ async def trend_analysis(state: AnalysisState) -> Dict[str, Any]:
             HumanMessage(content=prompt.format(
                 format_instructions=format_instructions,
                 user_input=state["user_input"],
-                k=state["k"]
+                k=math.ceil(state["k"] * config["ranking"]["candidate_factor"]),
+                retrieved_context=retrieved_context,
+                known_trends=known_trends
             ))
         ]
         
-        response = await chat_model.ainvoke(messages)
+        response = await invoke_model(chat_model, messages)
         
         # Create intermediate step
         is_refined = state["intermediate_results"].trend_analysis is not None
@@ -84,7 +254,8 @@ async def trend_analysis(state: AnalysisState) -> Dict[str, Any]:
             output=response.content,
             timestamp=datetime.now().isoformat(),
             is_refined=is_refined,
-            refinement_count=refinement_count
+            refinement_count=refinement_count,
+            usage=recorder.usage
         )
         
         # Update state
@@ -92,7 +263,11 @@ async def trend_analysis(state: AnalysisState) -> Dict[str, Any]:
         if is_refined:
             state["intermediate_results"].refinement_steps.append(step)
             
-        return {"messages": messages + [response], "intermediate_results": state["intermediate_results"]}
+        return {
+            "messages": messages + [response],
+            "intermediate_results": state["intermediate_results"],
+            "retrieved_context": retrieved_context
+        }
         
     except Exception as e:
         logger.error(f"Error in trend analysis: {e}")
@@ -102,6 +277,7 @@ async def trend_analysis(state: AnalysisState) -> Dict[str, Any]:
 async def opportunity_analysis(state: AnalysisState) -> Dict[str, Any]:
     """Analyze opportunities based on trends."""
     try:
+        recorder = start_step_usage()
         chat_model = create_chat_model()
         messages = state["messages"]
         trend_analysis = state["intermediate_results"].trend_analysis
@@ -118,7 +294,7 @@ async def opportunity_analysis(state: AnalysisState) -> Dict[str, Any]:
             user_input=state["user_input"]
         ))
         
-        response = await chat_model.ainvoke([SystemMessage(content=config["prompts"]["system"]), new_message])
+        response = await invoke_with_tools(chat_model, [SystemMessage(content=config["prompts"]["system"]), new_message])
         
         # Create intermediate step
         is_refined = state["intermediate_results"].opportunity_analysis is not None
@@ -129,7 +305,8 @@ async def opportunity_analysis(state: AnalysisState) -> Dict[str, Any]:
             output=response.content,
             timestamp=datetime.now().isoformat(),
             is_refined=is_refined,
-            refinement_count=refinement_count
+            refinement_count=refinement_count,
+            usage=recorder.usage
         )
         
         # Update state
@@ -147,6 +324,7 @@ async def opportunity_analysis(state: AnalysisState) -> Dict[str, Any]:
 async def competitor_analysis(state: AnalysisState) -> Dict[str, Any]:
     """Analyze competitors based on opportunities."""
     try:
+        recorder = start_step_usage()
         chat_model = create_chat_model()
         messages = state["messages"]
         opportunity_analysis = state["intermediate_results"].opportunity_analysis
@@ -155,15 +333,16 @@ async def competitor_analysis(state: AnalysisState) -> Dict[str, Any]:
             
         prompt = PromptTemplate(
             template=config["prompts"]["competitor_analysis"],
-            input_variables=["opportunity_analysis", "user_input"]
+            input_variables=["opportunity_analysis", "user_input", "retrieved_context"]
         )
         
         new_message = HumanMessage(content=prompt.format(
             opportunity_analysis=opportunity_analysis.output,
-            user_input=state["user_input"]
+            user_input=state["user_input"],
+            retrieved_context=state.get("retrieved_context") or NO_CONTEXT
         ))
         
-        response = await chat_model.ainvoke([SystemMessage(content=config["prompts"]["system"]), new_message])
+        response = await invoke_with_tools(chat_model, [SystemMessage(content=config["prompts"]["system"]), new_message])
         
         # Create intermediate step
         is_refined = state["intermediate_results"].competitor_analysis is not None
@@ -174,7 +353,8 @@ async def competitor_analysis(state: AnalysisState) -> Dict[str, Any]:
             output=response.content,
             timestamp=datetime.now().isoformat(),
             is_refined=is_refined,
-            refinement_count=refinement_count
+            refinement_count=refinement_count,
+            usage=recorder.usage
         )
         
         # Update state
@@ -198,8 +378,21 @@ async def generate_final_result(state: AnalysisState) -> Dict[str, Any]:
             raise ValueError("No trend analysis results found")
             
         # Parse the trend analysis into StartupAnalysisResponse
-        parser = PydanticOutputParser(pydantic_object=StartupAnalysisResponse)
-        final_result = parser.parse(trend_analysis_step.output)
+        final_result = None
+        try:
+            registry = get_registry()
+            if registry is not None:
+                # Trends given only by Trend_id get their description and growth series from the registry
+                async def expand() -> Dict[str, Any]:
+                    return await asyncio.to_thread(expand_trends, parse_json_markdown(trend_analysis_step.output), registry)
+
+                parsed = await get_cassette().acall("expand_trends", {"output": trend_analysis_step.output}, expand)
+                final_result = StartupAnalysisResponse.model_validate(parsed)
+        except Exception as e:
+            logger.warning(f"Could not expand trends from the registry, parsing the output as is: {e}")
+        if final_result is None:
+            parser = PydanticOutputParser(pydantic_object=StartupAnalysisResponse)
+            final_result = parser.parse(trend_analysis_step.output)
         
         state["final_result"] = final_result
         return {
@@ -213,6 +406,91 @@ async def generate_final_result(state: AnalysisState) -> Dict[str, Any]:
         logger.error(f"Traceback: {traceback.format_exc()}")
         raise
 
+async def uniqueness_check(state: AnalysisState) -> Dict[str, Any]:
+    """Score each startup opportunity against the corpus and the other opportunities, flagging or dropping near duplicates."""
+    final_result = state.get("final_result")
+    uniqueness_config = config["uniqueness"]
+    if not uniqueness_config["enabled"] or final_result is None or not final_result.trends:
+        return {}
+    texts = [trend.Startup_Opportunity for trend in final_result.trends]
+
+    async def score() -> Dict[str, Any]:
+        tools = await aget_aperture_tools()
+        corpus_similarity, idea_similarity = await tools.score_uniqueness(texts)
+        return {"corpus_similarity": corpus_similarity, "idea_similarity": idea_similarity.tolist()}
+
+    try:
+        scores = await get_cassette().acall("uniqueness", {"texts": texts}, score)
+        corpus_similarity = scores["corpus_similarity"]
+        idea_similarity = np.asarray(scores["idea_similarity"], dtype=np.float64)
+    except Exception as e:
+        logger.warning(f"Uniqueness scoring failed, returning unscored trends: {e}")
+        return {}
+
+    threshold = uniqueness_config["threshold"]
+    kept: List[int] = []
+    # Visit trends in the server's ranking order, so of two near-duplicate ideas the one the
+    # rank stage puts first is kept, whatever order the model listed them in
+    order, _, _ = rank_trends(final_result.trends, config["ranking"]["weights"])
+    for i in order:
+        trend = final_result.trends[i]
+        others = idea_similarity[i][np.isfinite(idea_similarity[i])]
+        trend.Corpus_similarity = corpus_similarity[i]
+        trend.Idea_similarity = float(others.max()) if len(others) else None
+        trend.Is_unique = (
+            (corpus_similarity[i] is None or corpus_similarity[i] < threshold)
+            and all(idea_similarity[i][j] < threshold for j in kept)
+        )
+        if trend.Is_unique:
+            kept.append(i)
+    if uniqueness_config["action"] == "drop":
+        final_result.trends = [trend for trend in final_result.trends if trend.Is_unique]
+    logger.info(f"{len(kept)} of {len(idea_similarity)} opportunities are below the {threshold} similarity threshold")
+    return {"final_result": final_result}
+
+def apply_ranking(trends: List[TrendOp], weights: Dict[str, float], k: Optional[int]) -> List[TrendOp]:
+    """Attach composite scores to trends and return the top k, best first."""
+    if not trends:
+        return []
+    order, scores, features = rank_trends(trends, weights, k)
+    for trend, score, compounded_growth in zip(trends, scores, features["compounded_growth"]):
+        trend.Score = float(score)
+        trend.Compounded_growth = float(compounded_growth)
+    return [trends[i] for i in order]
+
+async def rank_results(state: AnalysisState) -> Dict[str, Any]:
+    """Rank the final trends deterministically and cut them down to the k requested."""
+    final_result = state.get("final_result")
+    if final_result is None:
+        return {}
+    final_result.trends = apply_ranking(final_result.trends, config["ranking"]["weights"], state["k"])
+    return {"final_result": final_result}
+
+async def register_trends(state: AnalysisState) -> Dict[str, Any]:
+    """Cluster the final trends into the trend registry and tag each with its canonical trend id."""
+    final_result = state.get("final_result")
+    if final_result is None or not final_result.trends:
+        return {}
+    try:
+        registry = get_registry()
+        if registry is None:
+            return {}
+        texts = [trend_text(trend) for trend in final_result.trends]
+
+        async def register() -> List[str]:
+            _, embeddings = get_active_embeddings()
+            vectors = await embeddings.aembed_documents(texts)
+            return await asyncio.to_thread(registry.add, final_result.trends, vectors)
+
+        # Replay returns the recorded ids and leaves the registry file alone
+        ids = await get_cassette().acall("register_trends", {"trends": texts}, register)
+    except Exception as e:
+        logger.warning(f"Trend registration failed: {e}")
+        return {}
+    for trend, trend_id in zip(final_result.trends, ids):
+        trend.Trend_id = trend_id
+    return {"final_result": final_result}
+
 def check_quality(state: AnalysisState) -> Literal["refine", "continue"]:
     """Check quality of current analysis step."""
     try:
@@ -235,6 +513,10 @@ async def run_analysis(query: AnalysisInput) -> IntermediateResults:
     try:
         start_time = datetime.now()
         
+        # Kick off retrieval as soon as the request arrives
+        context_task = start_context_prefetch(query.user_input)
+        usage_recorders = start_request_usage()
+        
         # Initialize state and results
         intermediate_results = IntermediateResults(
             trend_analysis=None,
@@ -250,7 +532,9 @@ async def run_analysis(query: AnalysisInput) -> IntermediateResults:
             user_input=query.user_input,
             k=query.k,
             intermediate_results=intermediate_results,
-            final_result=None
+            final_result=None,
+            context_task=context_task,
+            retrieved_context=None
         )
         
         # Define workflow
@@ -261,6 +545,9 @@ async def run_analysis(query: AnalysisInput) -> IntermediateResults:
         workflow.add_node("opportunities", opportunity_analysis)
         workflow.add_node("competitors", competitor_analysis)
         workflow.add_node("generate", generate_final_result)
+        workflow.add_node("uniqueness", uniqueness_check)
+        workflow.add_node("rank", rank_results)
+        workflow.add_node("register", register_trends)
         
         # Add edges with quality checks
         workflow.add_edge(START, "trends")
@@ -281,7 +568,10 @@ async def run_analysis(query: AnalysisInput) -> IntermediateResults:
             }
         )
         workflow.add_edge("competitors", "generate")
-        workflow.add_edge("generate", END)
+        workflow.add_edge("generate", "uniqueness")
+        workflow.add_edge("uniqueness", "rank")
+        workflow.add_edge("rank", "register")
+        workflow.add_edge("register", END)
         
         # Compile and run
         graph = workflow.compile()
@@ -298,7 +588,8 @@ async def run_analysis(query: AnalysisInput) -> IntermediateResults:
             competitor_analysis=final_state["intermediate_results"].competitor_analysis,
             final_result=final_state.get("final_result"),
             execution_time=execution_time,
-            refinement_steps=final_state["intermediate_results"].refinement_steps
+            refinement_steps=final_state["intermediate_results"].refinement_steps,
+            usage=total_usage(usage_recorders)
         )
         
         return final_results
@@ -0,0 +1,244 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+import logging
+import os
+import threading
+import numpy as np
+from vectors import VectorCodec, normalize
+
+logger = logging.getLogger(__name__)
+
+def spherical_kmeans(vectors: np.ndarray, k: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """Cluster unit vectors by cosine similarity and return unit-length centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        counts = np.bincount(assignments, minlength=k)
+        empty = counts == 0
+        # Reseed empty clusters from random points so every list stays useful
+        sums[empty] = vectors[rng.choice(len(vectors), size=int(empty.sum()))]
+        centroids = normalize(sums)
+    return centroids
+
+class LocalANNIndex:
+    """In-process IVF-flat index over unit-normalized vectors.
+
+    Below ``min_train_size`` vectors every search is an exact matrix
+    multiply. Above it the vectors are clustered into ``nlist`` inverted
+    lists with spherical k-means and a search scans only the ``n_probe``
+    lists whose centroids are closest to the query. The index is retrained
+    whenever it has doubled in size since the last training.
+
+    Vectors are held as ``precision`` codes (see VectorCodec), so scores
+    from a float16 or int8 index are approximate; callers that need exact
+    ordering re-rank the top candidates at full precision.
+    """
+
+    def __init__(self, dimensions: int, n_probe: int = 8, nlist: int = 0, min_train_size: int = 2048,
+                 precision: str = "float32"):
+        self.dimensions = dimensions
+        self.codec = VectorCodec(dimensions, precision)
+        self.n_probe = n_probe
+        self.nlist = nlist
+        self.min_train_size = min_train_size
+        self.ids: List[str] = []
+        self.rows: Dict[str, int] = {}
+        self.vectors = np.empty((0, dimensions), dtype=self.codec.dtype)
+        self.alive = np.empty(0, dtype=bool)
+        self.centroids: Optional[np.ndarray] = None
+        self.assignments = np.empty(0, dtype=np.int32)
+        self.trained_size = 0
+        self.fitted_size = 0
+        # Change log position the contents are synced up to, persisted with them (see ChangeLog)
+        self.watermark: Optional[Tuple[int, int]] = None
+        self._size = 0
+        self._lists: Optional[List[np.ndarray]] = None
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __contains__(self, unique_id: str) -> bool:
+        return unique_id in self.rows
+
+    def snapshot_ids(self) -> List[str]:
+        """The indexed ids, copied under the lock so concurrent writers cannot change them mid-iteration."""
+        with self._lock:
+            return list(self.rows)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the stored vectors and their assignments."""
+        return self.vectors.nbytes + self.assignments.nbytes + self.alive.nbytes
+
+    def _grow(self, extra: int):
+        needed = self._size + extra
+        if needed <= len(self.vectors):
+            return
+        capacity = max(needed, 2 * len(self.vectors), 1024)
+        vectors = np.empty((capacity, self.dimensions), dtype=self.codec.dtype)
+        vectors[:self._size] = self.vectors[:self._size]
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:self._size] = self.alive[:self._size]
+        assignments = np.zeros(capacity, dtype=np.int32)
+        assignments[:self._size] = self.assignments[:self._size]
+        self.vectors, self.alive, self.assignments = vectors, alive, assignments
+
+    def add(self, ids: Sequence[str], vectors: Sequence[Sequence[float]]):
+        """Add or replace vectors by id."""
+        if not ids:
+            return
+        with self._lock:
+            self.remove([unique_id for unique_id in ids if unique_id in self.rows])
+            batch = normalize(np.asarray(vectors, dtype=np.float32).reshape(len(ids), self.dimensions))
+            if self.codec.precision == "int8" and len(self.rows) + len(ids) >= 2 * self.fitted_size:
+                self._refit(batch)
+            self._grow(len(ids))
+            start, end = self._size, self._size + len(ids)
+            self.vectors[start:end] = self.codec.encode(batch)
+            self.alive[start:end] = True
+            if self.centroids is not None:
+                self.assignments[start:end] = np.argmax(batch @ self.centroids.T, axis=1)
+            for offset, unique_id in enumerate(ids):
+                self.rows[unique_id] = start + offset
+            self.ids.extend(ids)
+            self._size = end
+            self._lists = None
+            if len(self.rows) >= self.min_train_size and len(self.rows) >= 2 * self.trained_size:
+                self.train()
+
+    def remove(self, ids: Sequence[str]):
+        """Remove vectors by id. Rows are tombstoned and dropped on the next compaction."""
+        with self._lock:
+            for unique_id in ids:
+                row = self.rows.pop(unique_id, None)
+                if row is not None:
+                    self.alive[row] = False
+            self._lists = None
+
+    def compact(self):
+        """Drop tombstoned rows."""
+        with self._lock:
+            keep = np.flatnonzero(self.alive[:self._size])
+            self.vectors = self.vectors[keep].copy()
+            self.assignments = self.assignments[keep].copy()
+            self.alive = np.ones(len(keep), dtype=bool)
+            self.ids = [self.ids[row] for row in keep]
+            self.rows = {unique_id: row for row, unique_id in enumerate(self.ids)}
+            self._size = len(keep)
+            self._lists = None
+
+    def train(self):
+        """Cluster the live vectors into inverted lists."""
+        with self._lock:
+            if self._size - len(self.rows) > 0:
+                self.compact()
+            n = len(self.rows)
+            nlist = self.nlist or max(1, int(np.sqrt(n)))
+            if n < self.min_train_size or nlist >= n:
+                return
+            sample = self.vectors[:n]
+            if n > 50000:
+                sample = sample[np.random.default_rng(0).choice(n, size=50000, replace=False)]
+            self.centroids = spherical_kmeans(self.codec.decode(sample), nlist)
+            for start in range(0, n, 65536):
+                vectors = self.codec.decode(self.vectors[start:min(start + 65536, n)])
+                self.assignments[start:start + len(vectors)] = np.argmax(vectors @ self.centroids.T, axis=1)
+            self.trained_size = n
+            self._lists = None
+            logger.info(f"Trained local ANN index with {nlist} lists over {n} vectors")
+
+    def _refit(self, batch: np.ndarray):
+        """Refit int8 scales to the stored vectors plus a new batch and re-encode the stored vectors."""
+        rows = np.flatnonzero(self.alive[:self._size])
+        if len(rows) > 50000:
+            rows = np.random.default_rng(0).choice(rows, size=50000, replace=False)
+        old_codec = VectorCodec(self.dimensions, "int8", self.codec.scale)
+        self.codec.fit(np.concatenate([old_codec.decode(self.vectors[rows]), batch]))
+        self.fitted_size = len(self.rows) + len(batch)
+        for start in range(0, self._size, 65536):
+            chunk = self.vectors[start:start + 65536]
+            self.vectors[start:start + 65536] = self.codec.encode(old_codec.decode(chunk))
+
+    def _inverted_lists(self) -> List[np.ndarray]:
+        if self._lists is None:
+            rows = np.flatnonzero(self.alive[:self._size])
+            order = rows[np.argsort(self.assignments[rows], kind="stable")]
+            boundaries = np.searchsorted(self.assignments[order], np.arange(len(self.centroids) + 1))
+            self._lists = [order[boundaries[i]:boundaries[i + 1]] for i in range(len(self.centroids))]
+        return self._lists
+
+    def get_vectors(self, ids: Sequence[str]) -> np.ndarray:
+        """Return the unit-normalized (decoded) vectors for ids that are in the index."""
+        with self._lock:
+            return self.codec.decode(self.vectors[[self.rows[unique_id] for unique_id in ids]])
+
+    def search(self, query: Sequence[float], k: int) -> List[Tuple[str, float]]:
+        """Return up to k (id, cosine similarity) pairs, most similar first."""
+        with self._lock:
+            if not self.rows:
+                return []
+            q = normalize(np.asarray(query, dtype=np.float32).reshape(1, -1))[0]
+            if self.centroids is None:
+                candidates = np.flatnonzero(self.alive[:self._size])
+            else:
+                probes = np.argsort(-(self.centroids @ q))[:self.n_probe]
+                lists = self._inverted_lists()
+                candidates = np.concatenate([lists[p] for p in probes])
+            scores = self.codec.scores(self.vectors[candidates], q)
+            k = min(k, len(candidates))
+            if k == 0:
+                return []
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top], kind="stable")]
+            return [(self.ids[candidates[i]], float(scores[i])) for i in top]
+
+    def save(self, path: str):
+        """Persist the index atomically so workers start without a full pull."""
+        with self._lock:
+            self.compact()
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Every worker saves after a sync, so each writes its own temporary file
+            tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+            np.savez(
+                tmp_path,
+                ids=np.array(self.ids, dtype=str),
+                vectors=self.vectors[:self._size],
+                assignments=self.assignments[:self._size],
+                centroids=self.centroids if self.centroids is not None else np.empty((0, self.dimensions), dtype=np.float32),
+                trained_size=np.array(self.trained_size),
+                precision=np.array(self.codec.precision),
+                scale=self.codec.scale,
+                watermark=np.array(self.watermark if self.watermark is not None else [], dtype=np.int64)
+            )
+            os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, dimensions: int, **kwargs) -> "LocalANNIndex":
+        """Load a persisted index, or return an empty one if there is none."""
+        index = cls(dimensions, **kwargs)
+        if not os.path.exists(path):
+            return index
+        with np.load(path) as data:
+            index.ids = data["ids"].tolist()
+            stored = VectorCodec(dimensions, str(data["precision"]), data["scale"]) if "precision" in data else VectorCodec(dimensions)
+            if stored.precision == index.codec.precision:
+                index.codec.scale = stored.scale
+                index.vectors = data["vectors"]
+            else:
+                vectors = stored.decode(data["vectors"])
+                index.codec.fit(vectors)
+                index.vectors = index.codec.encode(vectors)
+            index.assignments = data["assignments"].astype(np.int32)
+            index.centroids = data["centroids"] if len(data["centroids"]) else None
+            index.trained_size = int(data["trained_size"])
+            if "watermark" in data and len(data["watermark"]):
+                index.watermark = tuple(int(value) for value in data["watermark"])
+        index._size = len(index.ids)
+        index.fitted_size = index._size
+        index.alive = np.ones(index._size, dtype=bool)
+        index.rows = {unique_id: row for row, unique_id in enumerate(index.ids)}
+        logger.info(f"Loaded local ANN index with {len(index)} vectors from {path}")
+        return index
@@ -0,0 +1,139 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import asyncio
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+HEALTH_CHECK_QUERY = [{"GetStatus": {}}]
+
+class ConnectionPoolTimeout(Exception):
+    """Raised when no ApertureDB connector becomes free in time."""
+
+class ApertureConnectionPool:
+    """Fixed-size pool of ApertureDB connectors with a matching thread pool.
+
+    A connector is not thread safe, so each one is checked out by a single
+    thread at a time. Connectors are created on demand up to ``size``;
+    one that has sat idle longer than ``health_check_interval`` is pinged
+    before reuse, and one that fails a query or a health check is closed
+    and replaced by a fresh connection on the next checkout. Blocking calls
+    run on a dedicated executor of ``size`` threads, so concurrent requests
+    proceed in parallel up to the pool size without tying up the default
+    executor.
+    """
+
+    def __init__(self, factory: Callable[[], Any], size: int = 4, query_timeout: float = 30.0,
+                 health_check_interval: float = 30.0, acquire_timeout: float = 30.0):
+        self.factory = factory
+        self.size = size
+        self.query_timeout = query_timeout
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+        self.executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="aperturedb")
+        self._idle: "queue.LifoQueue[Tuple[Any, float]]" = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self.reconnects = 0
+
+    def _new_connector(self) -> Any:
+        try:
+            return self.factory()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def _discard(self, connector: Any):
+        """Close a broken connector and free its slot."""
+        sock = getattr(connector, "conn", None)
+        if sock is not None:
+            try:
+                sock.close()
+            except Exception:
+                pass
+        with self._lock:
+            self._created -= 1
+
+    def _healthy(self, connector: Any) -> bool:
+        try:
+            connector.query(HEALTH_CHECK_QUERY)
+            return connector.last_query_ok()
+        except Exception as e:
+            logger.warning(f"ApertureDB connector failed its health check: {e}")
+            return False
+
+    def _acquire(self) -> Any:
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            try:
+                connector, idle_since = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_create = self._created < self.size
+                    if can_create:
+                        self._created += 1
+                if can_create:
+                    return self._new_connector()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise ConnectionPoolTimeout(f"No ApertureDB connection free after {self.acquire_timeout}s")
+                try:
+                    connector, idle_since = self._idle.get(timeout=remaining)
+                except queue.Empty:
+                    continue
+            if time.monotonic() - idle_since < self.health_check_interval or self._healthy(connector):
+                return connector
+            self._discard(connector)
+            self.reconnects += 1
+
+    @contextmanager
+    def connection(self):
+        """Check out a connector for the duration of the block, replacing it if the block fails."""
+        connector = self._acquire()
+        try:
+            yield connector
+        except BaseException:
+            self._discard(connector)
+            self.reconnects += 1
+            raise
+        self._idle.put((connector, time.monotonic()))
+
+    def query(self, query: List[Dict[str, Any]], blobs: Optional[List[bytes]] = None) -> Tuple[List[Dict[str, Any]], List[bytes]]:
+        """Run a blocking query on a pooled connector and check it succeeded."""
+        with self.connection() as connector:
+            sock = getattr(connector, "conn", None)
+            if sock is not None:
+                # Bounds how long a worker thread can block on a dead socket
+                sock.settimeout(self.query_timeout)
+            response, response_blobs = connector.query(query, blobs or [])
+            failed = not connector.last_query_ok()
+        if failed:
+            raise Exception(f"ApertureDB query failed: {response}")
+        return response, response_blobs
+
+    async def run(self, function: Callable[..., Any], *args, bounded: bool = True) -> Any:
+        """Run a blocking function on the pool's threads.
+
+        The wait is capped at the per-query timeout unless ``bounded`` is
+        False, which long multi-query jobs such as a full sync use.
+        """
+        future = asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+        return await asyncio.wait_for(future, self.query_timeout if bounded else None)
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": self.size, "open": self._created, "idle": self._idle.qsize(), "reconnects": self.reconnects}
+
+    def close(self):
+        """Close idle connectors and stop the worker threads."""
+        self.executor.shutdown(wait=False)
+        while True:
+            try:
+                connector, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(connector)
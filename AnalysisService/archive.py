@@ -0,0 +1,229 @@
+from typing import Any, Dict, List, Optional, Tuple
+from contextlib import contextmanager
+import fcntl
+import logging
+import os
+import uuid
+import yaml
+from datetime import datetime, timezone
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+# Load configuration
+config_path = os.path.join(os.path.dirname(__file__), "config.yaml")
+with open(config_path, "r") as f:
+    config = yaml.safe_load(f)
+
+# One row per generated trend, with the metadata of the analysis it came from
+TREND_FIELDS = [
+    ("name", pa.string()),
+    ("description", pa.string()),
+    ("Year_2025", pa.int32()),
+    ("Year_2026", pa.int32()),
+    ("Year_2027", pa.int32()),
+    ("Year_2028", pa.int32()),
+    ("Year_2029", pa.int32()),
+    ("Year_2030", pa.int32()),
+    ("Startup_Name", pa.string()),
+    ("Startup_Opportunity", pa.string()),
+    ("Growth_rate_WoW", pa.float64()),
+    ("YC_chances", pa.float64()),
+    ("Related_trends", pa.string()),
+    ("Trend_id", pa.string()),
+    ("Corpus_similarity", pa.float64()),
+    ("Idea_similarity", pa.float64()),
+    ("Is_unique", pa.bool_()),
+    ("Compounded_growth", pa.float64()),
+    ("Score", pa.float64()),
+]
+SCHEMA = pa.schema([
+    ("analysis_id", pa.string()),
+    ("created_at", pa.timestamp("us", tz="UTC")),
+    ("user_input", pa.string()),
+    ("k", pa.int32()),
+    ("generate_novel_ideas", pa.bool_()),
+    ("execution_time", pa.float64()),
+    ("trend_rank", pa.int32()),
+    *TREND_FIELDS,
+])
+PARTITIONING = ds.partitioning(pa.schema([("date", pa.string())]), flavor="hive")
+DATASET_SCHEMA = SCHEMA.append(pa.field("date", pa.string()))
+COLUMNS = DATASET_SCHEMA.names
+
+FILTER_OPS = {
+    "==": lambda field, value: field == value,
+    "!=": lambda field, value: field != value,
+    "<": lambda field, value: field < value,
+    "<=": lambda field, value: field <= value,
+    ">": lambda field, value: field > value,
+    ">=": lambda field, value: field >= value,
+    "in": lambda field, value: field.isin(value),
+    "contains": lambda field, value: pc.match_substring(field, value, ignore_case=True),
+}
+AGGREGATIONS = ["count", "count_distinct", "sum", "mean", "min", "max"]
+
+class AnalysisArchive:
+    """Append-only Parquet archive of completed analyses, partitioned by day.
+
+    Each analysis is written as its own small file under
+    ``date=YYYY-MM-DD/``, so workers never contend on a writer; once a
+    day's partition holds ``compact_min_files`` files they are merged into
+    one. Queries go through a pyarrow dataset, so filters on the date
+    partition prune whole directories and other filters are pushed down to
+    Parquet row-group statistics. Queries hold a shared lock on the archive
+    while they list and scan files, and compaction swaps a merged file in
+    for its sources under the exclusive lock, so a scan never misses a file
+    or sees rows twice.
+    """
+
+    def __init__(self, path: str, compact_min_files: int):
+        self.path = path
+        self.compact_min_files = compact_min_files
+        os.makedirs(path, exist_ok=True)
+
+    @contextmanager
+    def _lock(self, operation: int):
+        with open(os.path.join(self.path, "_archive.lock"), "ab") as lock:
+            fcntl.flock(lock, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _partition(self, date: str) -> str:
+        return os.path.join(self.path, f"date={date}")
+
+    def append(self, analysis_id: str, query: Any, final_result: Any, execution_time: float,
+               created_at: Optional[datetime] = None) -> int:
+        """Write one row per trend of an analysis and return the number of rows."""
+        trends = final_result.trends if final_result is not None else []
+        if not trends:
+            return 0
+        created_at = created_at or datetime.now(timezone.utc)
+        metadata = {
+            "analysis_id": analysis_id,
+            "created_at": created_at,
+            "user_input": query.user_input,
+            "k": query.k,
+            "generate_novel_ideas": query.generate_novel_ideas,
+            "execution_time": execution_time,
+        }
+        rows = [{**metadata, "trend_rank": rank, **trend.model_dump()} for rank, trend in enumerate(trends, start=1)]
+        table = pa.Table.from_pylist(rows, schema=SCHEMA)
+        date = created_at.astimezone(timezone.utc).strftime("%Y-%m-%d")
+        partition = self._partition(date)
+        os.makedirs(partition, exist_ok=True)
+        # Files starting with "_" are ignored by readers until they are complete
+        tmp_path = os.path.join(partition, f"_{uuid.uuid4().hex}.tmp")
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, os.path.join(partition, f"{uuid.uuid4().hex}.parquet"))
+        if len(self._files(partition)) >= self.compact_min_files:
+            self.compact(date)
+        return len(rows)
+
+    def _files(self, partition: str) -> List[str]:
+        return sorted(
+            os.path.join(partition, name) for name in os.listdir(partition)
+            if name.endswith(".parquet") and not name.startswith("_")
+        )
+
+    def compact(self, date: str) -> int:
+        """Merge a day's files into one, sorted by creation time. Returns the number of files merged."""
+        partition = self._partition(date)
+        with open(os.path.join(partition, "_compact.lock"), "ab") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another worker is compacting this partition
+                return 0
+            try:
+                files = self._files(partition)
+                if len(files) < 2:
+                    return 0
+                table = pq.ParquetDataset(files, schema=SCHEMA).read().sort_by([("created_at", "ascending"), ("trend_rank", "ascending")])
+                tmp_path = os.path.join(partition, f"_{uuid.uuid4().hex}.tmp")
+                pq.write_table(table, tmp_path, row_group_size=64 * 1024)
+                # Waits for in-flight queries, which may have listed the source files
+                with self._lock(fcntl.LOCK_EX):
+                    os.replace(tmp_path, os.path.join(partition, f"{uuid.uuid4().hex}.parquet"))
+                    for path in files:
+                        os.remove(path)
+                logger.info(f"Compacted {len(files)} archive files for {date}")
+                return len(files)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def dataset(self) -> ds.Dataset:
+        return ds.dataset(self.path, schema=DATASET_SCHEMA, format="parquet", partitioning=PARTITIONING)
+
+    def query(
+        self,
+        filters: Optional[List[Tuple[str, str, Any]]] = None,
+        columns: Optional[List[str]] = None,
+        group_by: Optional[List[str]] = None,
+        aggregations: Optional[List[Tuple[str, str]]] = None,
+        order_by: Optional[str] = None,
+        descending: bool = True,
+        limit: Optional[int] = 100,
+        since: Optional[str] = None,
+        until: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """Filter, optionally group and aggregate, and sort the archived trend rows.
+
+        ``filters`` are (column, op, value) triples ANDed together;
+        ``since``/``until`` are inclusive YYYY-MM-DD dates. Aggregated
+        columns are named ``<column>_<function>``.
+        """
+        group_by = group_by or []
+        aggregations = aggregations or []
+        for column in [column for column, _, _ in filters or []] + (columns or []) + group_by + [column for column, _ in aggregations]:
+            if column not in COLUMNS:
+                raise ValueError(f"Unknown archive column {column!r}")
+        for column, function in aggregations:
+            if function not in AGGREGATIONS:
+                raise ValueError(f"Unknown aggregation {function!r}; expected one of {AGGREGATIONS}")
+
+        expression = None
+        conditions = [(column, op, value) for column, op, value in filters or []]
+        if since:
+            conditions.append(("date", ">=", since))
+        if until:
+            conditions.append(("date", "<=", until))
+        for column, op, value in conditions:
+            if op not in FILTER_OPS:
+                raise ValueError(f"Unknown filter operator {op!r}; expected one of {list(FILTER_OPS)}")
+            condition = FILTER_OPS[op](pc.field(column), value)
+            expression = condition if expression is None else expression & condition
+
+        if aggregations:
+            needed = list(dict.fromkeys(group_by + [column for column, _ in aggregations]))
+        else:
+            needed = columns or COLUMNS
+        with self._lock(fcntl.LOCK_SH):
+            table = self.dataset().to_table(columns=needed, filter=expression)
+        if aggregations:
+            table = table.group_by(group_by).aggregate(list(aggregations))
+        if order_by:
+            if order_by not in table.column_names:
+                raise ValueError(f"Cannot order by {order_by!r}; result columns are {table.column_names}")
+            table = table.sort_by([(order_by, "descending" if descending else "ascending")])
+        if limit is not None:
+            table = table.slice(0, limit)
+        return table.to_pylist()
+
+_analysis_archive: Optional[AnalysisArchive] = None
+
+def get_analysis_archive() -> AnalysisArchive:
+    """Get the process-wide analysis archive configured in config.yaml."""
+    global _analysis_archive
+    if _analysis_archive is None:
+        archive_config = config["archive"]
+        _analysis_archive = AnalysisArchive(
+            os.path.join(os.path.dirname(__file__), archive_config["path"]),
+            compact_min_files=archive_config["compact_min_files"]
+        )
+    return _analysis_archive
@@ -0,0 +1,147 @@
+from typing import Any, Callable, Dict, List, Optional
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import yaml
+
+logger = logging.getLogger(__name__)
+
+# Load configuration
+config_path = os.path.join(os.path.dirname(__file__), "config.yaml")
+with open(config_path, "r") as f:
+    config = yaml.safe_load(f)
+
+MODES = ("off", "record", "replay")
+LATENCIES = ("zero", "recorded")
+
+class CassetteMissError(Exception):
+    """Raised in replay mode when a request was never recorded."""
+
+class Cassette:
+    """Records external call request/response pairs to disk and replays them offline.
+
+    Entries are stored as gzip-compressed JSON lines keyed by a hash of the
+    request. Identical requests recorded several times are replayed in the
+    order they were recorded, so refinement loops replay deterministically.
+    """
+
+    def __init__(self, path: str, mode: str = "off", latency: str = "zero"):
+        if mode not in MODES:
+            raise ValueError(f"Invalid cassette mode: {mode}")
+        if latency not in LATENCIES:
+            raise ValueError(f"Invalid cassette latency: {latency}")
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self.entries: Dict[str, List[Dict[str, Any]]] = {}
+        self.positions: Dict[str, int] = {}
+        self.recorded_time = 0.0
+        self.calls = 0
+        self._lock = threading.Lock()
+        if mode == "replay":
+            self._load()
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    def _load(self):
+        """Load recorded entries from disk."""
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f"Cassette not found: {self.path}")
+        with gzip.open(self.path, "rt") as f:
+            for line in f:
+                entry = json.loads(line)
+                self.entries.setdefault(entry["key"], []).append(entry)
+        logger.info(f"Loaded {sum(len(v) for v in self.entries.values())} cassette entries from {self.path}")
+
+    @staticmethod
+    def key(kind: str, payload: Any) -> str:
+        """Hash a request payload into a cassette key."""
+        encoded = json.dumps({"kind": kind, "payload": payload}, sort_keys=True, default=str)
+        return hashlib.sha256(encoded.encode()).hexdigest()
+
+    def _next_entry(self, key: str, kind: str) -> Dict[str, Any]:
+        """Return the next recorded entry for a key, cycling through repeats."""
+        with self._lock:
+            recorded = self.entries.get(key)
+            if not recorded:
+                raise CassetteMissError(f"No recorded {kind} response for key {key[:12]}")
+            position = self.positions.get(key, 0)
+            self.positions[key] = position + 1
+            entry = recorded[position % len(recorded)]
+            self.recorded_time += entry["elapsed"]
+            self.calls += 1
+            return entry
+
+    def _record(self, key: str, kind: str, elapsed: float, response: Any):
+        """Append an entry to the cassette file."""
+        entry = {"key": key, "kind": kind, "elapsed": round(elapsed, 6), "response": response}
+        with self._lock:
+            self.recorded_time += elapsed
+            self.calls += 1
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with gzip.open(self.path, "at") as f:
+                f.write(json.dumps(entry, default=str) + "\n")
+
+    def call(self, kind: str, payload: Any, fn: Callable[[], Any]) -> Any:
+        """Run a blocking call through the cassette. The response must be JSON serializable."""
+        if not self.enabled:
+            return fn()
+        key = self.key(kind, payload)
+        if self.mode == "replay":
+            entry = self._next_entry(key, kind)
+            if self.latency == "recorded":
+                time.sleep(entry["elapsed"])
+            return entry["response"]
+        start = time.perf_counter()
+        response = fn()
+        self._record(key, kind, time.perf_counter() - start, response)
+        return response
+
+    async def acall(self, kind: str, payload: Any, fn: Callable[[], Any]) -> Any:
+        """Run an async call through the cassette. The response must be JSON serializable."""
+        if not self.enabled:
+            return await fn()
+        key = self.key(kind, payload)
+        if self.mode == "replay":
+            entry = self._next_entry(key, kind)
+            if self.latency == "recorded":
+                await asyncio.sleep(entry["elapsed"])
+            return entry["response"]
+        start = time.perf_counter()
+        response = await fn()
+        self._record(key, kind, time.perf_counter() - start, response)
+        return response
+
+    def reset_stats(self):
+        """Reset the counters and replay positions, e.g. between benchmark runs."""
+        with self._lock:
+            self.recorded_time = 0.0
+            self.calls = 0
+            self.positions.clear()
+
+_cassette: Optional[Cassette] = None
+
+def get_cassette() -> Cassette:
+    """Get the process-wide cassette configured in config.yaml or the environment."""
+    global _cassette
+    if _cassette is None:
+        cassette_config = config["cassette"]
+        path = os.environ.get("SPYGLASS_CASSETTE_PATH", cassette_config["path"])
+        _cassette = Cassette(
+            path=os.path.join(os.path.dirname(__file__), path),
+            mode=os.environ.get("SPYGLASS_CASSETTE_MODE", cassette_config["mode"]),
+            latency=os.environ.get("SPYGLASS_CASSETTE_LATENCY", cassette_config["latency"])
+        )
+    return _cassette
+
+def set_cassette(cassette: Optional[Cassette]):
+    """Replace the process-wide cassette, e.g. from a benchmark script."""
+    global _cassette
+    _cassette = cassette
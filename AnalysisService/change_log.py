@@ -0,0 +1,71 @@
+from typing import List, Optional, Tuple
+import fcntl
+import os
+
+Watermark = Tuple[int, int]  # (inode, byte offset) of the log
+
+class ChangeLog:
+    """Append-only log of passage ids added to and deleted from a descriptor set, shared by every worker.
+
+    Writers append one ``+id`` or ``-id`` line per change under an
+    exclusive lock. Readers keep a watermark of the inode and offset they
+    have read up to and pull only the lines after it. Once the log grows
+    past ``max_bytes`` it is swapped for an empty file; a reader whose
+    watermark points at the old inode is told to do a full resync.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.lock_path = path + ".lock"
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def append(self, added: Optional[List[str]] = None, removed: Optional[List[str]] = None):
+        lines = [f"+{unique_id}\n" for unique_id in added or []] + [f"-{unique_id}\n" for unique_id in removed or []]
+        if not lines:
+            return
+        with open(self.lock_path, "ab") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                try:
+                    if os.path.getsize(self.path) > self.max_bytes:
+                        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                        open(tmp_path, "wb").close()
+                        os.replace(tmp_path, self.path)
+                except FileNotFoundError:
+                    pass
+                with open(self.path, "ab") as f:
+                    f.write("".join(lines).encode())
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def position(self) -> Watermark:
+        """Watermark of the end of the log as it is now."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return 0, 0
+        return stat.st_ino, stat.st_size
+
+    def read_since(self, watermark: Optional[Watermark]) -> Tuple[Optional[List[Tuple[str, str]]], Watermark]:
+        """Return the ("+" | "-", id) changes after a watermark and the new watermark.
+
+        The changes are None when they cannot be replayed from the
+        watermark (none yet, or the log was swapped since), in which case
+        the caller must resync in full; the returned watermark is taken
+        before that resync, so changes made during it are pulled next time.
+        """
+        try:
+            with open(self.path, "rb") as f:
+                inode = os.fstat(f.fileno()).st_ino
+                if watermark is None or watermark[0] != inode:
+                    f.seek(0, os.SEEK_END)
+                    return None, (inode, f.tell())
+                f.seek(watermark[1])
+                data = f.read()
+        except FileNotFoundError:
+            return ([] if watermark == (0, 0) else None), (0, 0)
+        # A line still being appended is read on the next call
+        complete = data[:data.rfind(b"\n") + 1]
+        changes = [(line[:1], line[1:]) for line in complete.decode().splitlines() if line]
+        return changes, (inode, watermark[1] + len(complete))
@@ -0,0 +1,39 @@
+import fcntl
+import os
+import struct
+
+class CorpusGeneration:
+    """Corpus version counter shared by every worker through a small file.
+
+    Writers bump it after changing the descriptor set; caches put the
+    current value in their keys, so entries computed against an older
+    corpus simply stop being looked up and age out on their own.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock_path = path + ".lock"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def current(self) -> int:
+        """Read the current generation, 0 if nothing has been written yet."""
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read(8)
+        except FileNotFoundError:
+            return 0
+        return struct.unpack("<Q", data)[0] if len(data) == 8 else 0
+
+    def bump(self) -> int:
+        """Increment the generation atomically across processes and return the new value."""
+        with open(self.lock_path, "ab") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                generation = self.current() + 1
+                tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(struct.pack("<Q", generation))
+                os.replace(tmp_path, self.path)
+                return generation
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
@@ -0,0 +1,231 @@
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import fcntl
+import hashlib
+import logging
+import os
+import threading
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+INDEX_DTYPE = np.dtype([("key", "S16"), ("row", "<i8")])
+
+def embedding_key(model: str, text: str) -> bytes:
+    """Hash (model, text) into a 16-byte cache key."""
+    return hashlib.blake2b(f"{model}\0{text}".encode(), digest_size=16).digest()
+
+# Vector and index file names per storage precision; changing precision starts a fresh cache
+CACHE_FILES = {
+    "float32": ("vectors.f32", "index.bin"),
+    "float16": ("vectors.f16", "index.f16.bin"),
+}
+
+class EmbeddingCache:
+    """Append-only, memory-mapped store of vectors keyed by content hash.
+
+    Vectors live in ``vectors.f32`` and (key, row) records in ``index.bin``
+    (``vectors.f16``/``index.f16.bin`` when stored as float16, which halves
+    disk and page cache use; hits are returned as float32 either way).
+    Both files are only ever appended to, under an exclusive file lock, so
+    every uvicorn worker can map the same pages read-only and pick up rows
+    written by other workers. Compaction rewrites both files and swaps them
+    in atomically; readers notice the new inode and reload. Lookups hold a
+    shared lock while they check the index inode and read rows, so they
+    never read a row number against a vector file compacted under them.
+    """
+
+    def __init__(self, path: str, dimensions: int, max_entries: int, compact_to: float = 0.8, precision: str = "float32"):
+        if precision not in CACHE_FILES:
+            raise ValueError(f"Embedding cache precision must be one of {list(CACHE_FILES)}, got {precision!r}")
+        self.path = path
+        self.dimensions = dimensions
+        self.max_entries = max_entries
+        self.compact_to = compact_to
+        self.dtype = np.dtype(precision)
+        self.row_bytes = dimensions * self.dtype.itemsize
+        vectors_file, index_file = CACHE_FILES[precision]
+        self.vectors_path = os.path.join(path, vectors_file)
+        self.index_path = os.path.join(path, index_file)
+        self.lock_path = os.path.join(path, "cache.lock")
+        self.hits = 0
+        self.misses = 0
+        self._index: Dict[bytes, int] = {}
+        self._index_offset = 0
+        self._index_inode: Optional[int] = None
+        self._vectors: Optional[np.memmap] = None
+        self._thread_lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        for file_path in (self.vectors_path, self.index_path):
+            open(file_path, "ab").close()
+        # Kept open for the shared lock taken by every lookup
+        self._read_lock = open(self.lock_path, "ab")
+        self._refresh()
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def _refresh(self):
+        """Read index records appended since the last refresh, reloading after compaction."""
+        stat = os.stat(self.index_path)
+        if stat.st_ino != self._index_inode:
+            self._index = {}
+            self._index_offset = 0
+            self._index_inode = stat.st_ino
+            self._vectors = None
+        if stat.st_size <= self._index_offset:
+            return
+        with open(self.index_path, "rb") as f:
+            f.seek(self._index_offset)
+            data = f.read(stat.st_size - self._index_offset)
+        usable = len(data) - len(data) % INDEX_DTYPE.itemsize
+        records = np.frombuffer(data[:usable], dtype=INDEX_DTYPE)
+        self._index.update(zip(records["key"].tolist(), records["row"].tolist()))
+        self._index_offset += usable
+
+    def _rows(self, rows: List[int]) -> np.ndarray:
+        """Read rows from the vector file, remapping it if it has grown."""
+        if self._vectors is None or max(rows) >= self._vectors.shape[0]:
+            count = os.path.getsize(self.vectors_path) // self.row_bytes
+            self._vectors = np.memmap(self.vectors_path, dtype=self.dtype, mode="r", shape=(count, self.dimensions))
+        return np.asarray(self._vectors[rows], dtype=np.float32)
+
+    def get_many(self, keys: List[bytes]) -> List[Optional[np.ndarray]]:
+        """Look up vectors by key, returning None for misses."""
+        with self._thread_lock:
+            fcntl.flock(self._read_lock, fcntl.LOCK_SH)
+            try:
+                # Always refresh: a one-stat inode check catches a compaction by another worker
+                # even when every key hits, before its row numbers are used
+                self._refresh()
+                found = [(i, self._index[key]) for i, key in enumerate(keys) if key in self._index]
+                results: List[Optional[np.ndarray]] = [None] * len(keys)
+                if found:
+                    vectors = self._rows([row for _, row in found])
+                    for (i, _), vector in zip(found, vectors):
+                        results[i] = vector
+            finally:
+                fcntl.flock(self._read_lock, fcntl.LOCK_UN)
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+            return results
+
+    def put_many(self, items: List[Tuple[bytes, List[float]]]):
+        """Append vectors for keys that are not cached yet, compacting when over the size cap."""
+        with self._thread_lock, open(self.lock_path, "ab") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self._refresh()
+                new_items = {key: vector for key, vector in items if key not in self._index}
+                if not new_items:
+                    return
+                vectors = np.asarray(list(new_items.values()), dtype=self.dtype)
+                if vectors.shape[1] != self.dimensions:
+                    logger.warning(f"Not caching {vectors.shape[1]}-dimensional vectors in a {self.dimensions}-dimensional cache")
+                    return
+                with open(self.vectors_path, "ab") as f:
+                    first_row = f.tell() // self.row_bytes
+                    f.write(vectors.tobytes())
+                records = np.empty(len(new_items), dtype=INDEX_DTYPE)
+                records["key"] = list(new_items.keys())
+                records["row"] = np.arange(first_row, first_row + len(new_items))
+                # Vectors are flushed before their index records, so readers never see a dangling row
+                with open(self.index_path, "ab") as f:
+                    f.write(records.tobytes())
+                self._refresh()
+                if len(self._index) > self.max_entries:
+                    self._compact()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def compact(self):
+        """Rewrite the cache keeping only the newest entries."""
+        with self._thread_lock, open(self.lock_path, "ab") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self._refresh()
+                self._compact()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _compact(self):
+        """Keep the newest ``compact_to * max_entries`` entries. Caller holds the file lock."""
+        keep = int(self.max_entries * self.compact_to)
+        newest = sorted(self._index.items(), key=lambda item: item[1])[-keep:] if keep else []
+        vectors = self._rows([row for _, row in newest]) if newest else np.empty((0, self.dimensions), dtype=np.float32)
+        records = np.empty(len(newest), dtype=INDEX_DTYPE)
+        records["key"] = [key for key, _ in newest]
+        records["row"] = np.arange(len(newest))
+        with open(self.vectors_path + ".tmp", "wb") as f:
+            f.write(vectors.astype(self.dtype).tobytes())
+        with open(self.index_path + ".tmp", "wb") as f:
+            f.write(records.tobytes())
+        os.replace(self.vectors_path + ".tmp", self.vectors_path)
+        os.replace(self.index_path + ".tmp", self.index_path)
+        logger.info(f"Compacted embedding cache from {len(self._index)} to {len(newest)} entries")
+        self._refresh()
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._index), "hits": self.hits, "misses": self.misses}
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that serves repeated texts from an EmbeddingCache."""
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache, model: str):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model = model
+
+    async def _alookup(self, texts: List[str]) -> Tuple[List[Optional[np.ndarray]], List[str]]:
+        # Lookups can wait on another worker's compaction, so keep them off the event loop
+        return await asyncio.to_thread(self._lookup, texts)
+
+    async def _aput(self, missing: List[str], computed: List[List[float]]):
+        if missing:
+            items = [(embedding_key(self.model, text), vector) for text, vector in zip(missing, computed)]
+            await asyncio.to_thread(self.cache.put_many, items)
+
+    def _lookup(self, texts: List[str]) -> Tuple[List[Optional[np.ndarray]], List[str]]:
+        cached = self.cache.get_many([embedding_key(self.model, text) for text in texts])
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, cached) if vector is None))
+        return cached, missing
+
+    def _merge(self, texts: List[str], cached: List[Optional[np.ndarray]],
+               missing: List[str], computed: List[List[float]]) -> List[List[float]]:
+        fresh = dict(zip(missing, computed))
+        return [vector.tolist() if vector is not None else list(fresh[text]) for text, vector in zip(texts, cached)]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Generate embeddings for a list of documents, embedding only uncached texts."""
+        cached, missing = self._lookup(texts)
+        computed = self.embeddings.embed_documents(missing) if missing else []
+        if missing:
+            self.cache.put_many([(embedding_key(self.model, text), vector) for text, vector in zip(missing, computed)])
+        return self._merge(texts, cached, missing, computed)
+
+    def embed_query(self, text: str) -> List[float]:
+        """Generate embedding for a single query."""
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Generate embeddings for a list of documents asynchronously, embedding only uncached texts."""
+        cached, missing = await self._alookup(texts)
+        computed = await self.embeddings.aembed_documents(missing) if missing else []
+        await self._aput(missing, computed)
+        return self._merge(texts, cached, missing, computed)
+
+    async def aembed_documents_array(self, texts: List[str]) -> np.ndarray:
+        """Embed documents into a float32 (len(texts), dimensions) array without building float lists for hits."""
+        cached, missing = await self._alookup(texts)
+        computed = await self.embeddings.aembed_documents(missing) if missing else []
+        await self._aput(missing, computed)
+        fresh = dict(zip(missing, computed))
+        out = np.empty((len(texts), self.cache.dimensions), dtype=np.float32)
+        for i, (text, vector) in enumerate(zip(texts, cached)):
+            out[i] = vector if vector is not None else fresh[text]
+        return out
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """Generate embedding for a single query asynchronously."""
+        return (await self.aembed_documents([text]))[0]
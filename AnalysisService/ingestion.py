@@ -0,0 +1,495 @@
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Set, Tuple
+import asyncio
+import codecs
+import fcntl
+import hashlib
+import logging
+import os
+import time
+import uuid
+import yaml
+import zlib
+from datetime import datetime
+import numpy as np
+from langchain_core.documents import Document
+from models import IngestionJob, IngestionStats
+from tools import CONTENT_HASH_KEY, DOCUMENT_HASH_KEY, INGESTION_JOB_KEY, aget_aperture_tools, content_hash
+
+logger = logging.getLogger(__name__)
+
+# Load configuration
+config_path = os.path.join(os.path.dirname(__file__), "config.yaml")
+with open(config_path, "r") as f:
+    config = yaml.safe_load(f)
+
+# A whitespace is a content-defined boundary when the text just before it hashes to 0 mod ANCHOR_MODULUS
+ANCHOR_CONTEXT_CHARS = 8
+ANCHOR_MODULUS = 16
+
+class PassageSplitter:
+    """Incrementally splits streamed text into overlapping passages.
+
+    Passages end at the first content-defined boundary in the second half
+    of the window, so after an edit the cuts fall back into step with the
+    previous version of the document within a passage or two and later
+    passages hash the same. Without such a boundary they end at the last
+    whitespace in the final fifth of the window when there is one, so words
+    are not cut in half.
+    """
+
+    def __init__(self, chunk_size: int, overlap: int):
+        if overlap * 2 >= chunk_size:
+            raise ValueError("Chunk overlap must be less than half the chunk size")
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self.buffer = ""
+
+    def _cut(self) -> int:
+        window = self.buffer[:self.chunk_size]
+        for i in range(max(self.chunk_size // 2, ANCHOR_CONTEXT_CHARS), len(window)):
+            if window[i] in " \n" and zlib.crc32(window[i - ANCHOR_CONTEXT_CHARS:i].encode()) % ANCHOR_MODULUS == 0:
+                return i + 1
+        boundary = max(window.rfind(" "), window.rfind("\n"))
+        if boundary >= self.chunk_size * 0.8:
+            return boundary + 1
+        return self.chunk_size
+
+    def feed(self, text: str) -> Iterator[str]:
+        """Add text and yield every passage that is complete."""
+        self.buffer += text
+        while len(self.buffer) > self.chunk_size:
+            cut = self._cut()
+            passage = self.buffer[:cut].strip()
+            self.buffer = self.buffer[cut - self.overlap:]
+            if passage:
+                yield passage
+
+    def finish(self) -> Iterator[str]:
+        """Yield whatever is left once the stream has ended."""
+        passage = self.buffer.strip()
+        self.buffer = ""
+        if passage:
+            yield passage
+
+async def iter_passages(read: Callable[[int], Awaitable[bytes]], stats: IngestionStats):
+    """Read a byte stream in bounded steps, decode it as UTF-8 and yield passages."""
+    ingestion_config = config["ingestion"]
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    splitter = PassageSplitter(ingestion_config["chunk_size_chars"], ingestion_config["chunk_overlap_chars"])
+    while True:
+        data = await read(ingestion_config["read_size_bytes"])
+        if not data:
+            break
+        stats.bytes_read += len(data)
+        for passage in splitter.feed(decoder.decode(data)):
+            yield passage
+    for passage in splitter.feed(decoder.decode(b"", final=True)):
+        yield passage
+    for passage in splitter.finish():
+        yield passage
+
+async def ingest_stream(
+    tools: Any,
+    read: Callable[[int], Awaitable[bytes]],
+    metadata: Dict[str, Any],
+    skip_batches: Optional[Set[int]] = None,
+    on_progress: Optional[Callable[[str, int, List[str]], None]] = None,
+    known_hashes: Optional[Dict[str, str]] = None
+) -> Tuple[List[str], IngestionStats]:
+    """Split a stream into passages, embed them in concurrent batches and write each batch in one transaction.
+
+    At most ``max_concurrent_batches`` batches are in flight, so reading waits
+    for the slowest batch and memory stays bounded regardless of file size.
+    Batches listed in ``skip_batches`` were written by an earlier attempt and
+    are passed over. Passages whose content hash is in ``known_hashes``
+    (hash to id of a passage this file already owns) or repeated within the
+    stream reuse that passage. Passages already stored for another file get
+    a passage of their own, so deleting or replacing either file never
+    removes the other's content, but their stored vector is copied instead
+    of embedding them again. ``on_progress`` is called with ("skipped" |
+    "embedded", batch index, passage ids) and then ("written", batch index,
+    every passage id of the batch) once every passage of the batch is
+    stored, including ones written by other batches.
+    """
+    skip_batches = skip_batches or set()
+    ingestion_config = config["ingestion"]
+    batch_size = ingestion_config["batch_size"]
+    semaphore = asyncio.Semaphore(ingestion_config["max_concurrent_batches"])
+    stats = IngestionStats()
+    start_time = time.perf_counter()
+    batch_ids: Dict[int, List[str]] = {}
+    tasks: List[asyncio.Task] = []
+    failure: List[BaseException] = []
+    # Hash to passage id for every passage stored or being stored for this stream
+    claimed: Dict[str, str] = dict(known_hashes or {})
+    # Passages claimed in this stream are set once their batch's write finishes; written holds the ones that succeeded
+    claim_done: Dict[str, asyncio.Event] = {}
+    written: Set[str] = set(claimed.values())
+
+    async def process(batch_index: int, first_chunk: int, passages: List[str]):
+        own: List[str] = []
+        try:
+            hashes = [content_hash(passage) for passage in passages]
+            stored = await tools.find_content_hashes([digest for digest in hashes if digest not in claimed])
+            # No awaits between checking and claiming, so concurrent batches never claim the same hash
+            ids: List[str] = []
+            documents: List[Document] = []
+            copy_from: Dict[str, str] = {}  # new passage id to the other file's passage whose vector it reuses
+            for i, (passage, digest) in enumerate(zip(passages, hashes)):
+                if digest not in claimed:
+                    claimed[digest] = str(uuid.uuid4())
+                    claim_done[claimed[digest]] = asyncio.Event()
+                    own.append(claimed[digest])
+                    documents.append(Document(
+                        page_content=passage,
+                        metadata={**metadata, "chunk_index": first_chunk + i, CONTENT_HASH_KEY: digest},
+                        id=claimed[digest]
+                    ))
+                    if digest in stored:
+                        copy_from[claimed[digest]] = stored[digest]
+                ids.append(claimed[digest])
+            vectors = await tools.get_vectors(list(copy_from.values()))
+            to_embed = [doc for doc in documents if vectors.get(copy_from.get(doc.id)) is None]
+            embed_ids = {doc.id for doc in to_embed}
+            skipped = [unique_id for unique_id in ids if unique_id not in embed_ids]
+            stats.chunks_skipped += len(skipped)
+            if on_progress and skipped:
+                on_progress("skipped", batch_index, skipped)
+            if documents:
+                embeddings = np.empty((len(documents), tools.dimensions), dtype=np.float32)
+                embedded: Dict[str, np.ndarray] = {}
+                if to_embed:
+                    embed_start = time.perf_counter()
+                    embedded = dict(zip(
+                        [doc.id for doc in to_embed],
+                        await tools.embeddings.aembed_documents_array([doc.page_content for doc in to_embed])
+                    ))
+                    stats.embed_seconds += time.perf_counter() - embed_start
+                    if on_progress:
+                        on_progress("embedded", batch_index, [doc.id for doc in to_embed])
+                for row, doc in enumerate(documents):
+                    copied = vectors.get(copy_from.get(doc.id))
+                    embeddings[row] = copied if copied is not None else embedded[doc.id]
+                write_start = time.perf_counter()
+                await tools.write_documents(documents, embeddings)
+                stats.write_seconds += time.perf_counter() - write_start
+                written.update(own)
+            # Passages claimed by another batch of this stream only count once that batch has written them
+            for unique_id in dict.fromkeys(ids):
+                if unique_id in claim_done and unique_id not in own:
+                    await claim_done[unique_id].wait()
+                if unique_id not in written:
+                    raise RuntimeError(f"Passage {unique_id} was not written by the batch that claimed it")
+            batch_ids[batch_index] = ids
+            if on_progress:
+                on_progress("written", batch_index, ids)
+        except BaseException as e:
+            failure.append(e)
+            raise
+        finally:
+            for unique_id in own:
+                claim_done[unique_id].set()
+            semaphore.release()
+
+    async def submit(passages: List[str]):
+        if stats.batches in skip_batches:
+            stats.batches += 1
+            return
+        await semaphore.acquire()
+        if failure:
+            semaphore.release()
+            raise failure[0]
+        tasks.append(asyncio.create_task(process(stats.batches, stats.chunks - len(passages), passages)))
+        stats.batches += 1
+
+    try:
+        batch: List[str] = []
+        async for passage in iter_passages(read, stats):
+            batch.append(passage)
+            stats.chunks += 1
+            if len(batch) == batch_size:
+                await submit(batch)
+                batch = []
+        if batch:
+            await submit(batch)
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+    stats.elapsed_seconds = time.perf_counter() - start_time
+    chunk_ids = [chunk_id for index in sorted(batch_ids) for chunk_id in batch_ids[index]]
+    logger.info(
+        f"Ingested {stats.chunks} chunks ({stats.bytes_read} bytes, {stats.chunks_skipped} already stored) "
+        f"in {stats.batches} batches in {stats.elapsed_seconds:.2f}s"
+    )
+    return chunk_ids, stats
+
+class IngestionQueue:
+    """Spool-backed queue of ingestion jobs processed by background workers.
+
+    Each job is an upload file plus a JSON manifest in the spool directory.
+    A worker claims a job by taking a non-blocking flock on its lock file,
+    which the OS releases if the process dies, so queued and interrupted
+    jobs are picked up again by any worker after a restart. Written batches
+    are recorded in the manifest and skipped when a job resumes. Finished
+    manifests move to ``done/`` and their lock files are removed, so polling
+    only ever reads the jobs still waiting.
+    """
+
+    def __init__(self, spool_path: str, workers: int, poll_interval: float, max_attempts: int):
+        self.spool_path = spool_path
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._active: Set[str] = set()
+        self.done_path = os.path.join(spool_path, "done")
+        os.makedirs(self.done_path, exist_ok=True)
+
+    def _path(self, job_id: str, suffix: str) -> str:
+        return os.path.join(self.spool_path, f"{job_id}{suffix}")
+
+    def load_job(self, job_id: str) -> Optional[IngestionJob]:
+        """Read a job manifest, finished or not, or None if the job does not exist."""
+        for path in (self._path(job_id, ".json"), os.path.join(self.done_path, f"{job_id}.json")):
+            try:
+                with open(path, "r") as f:
+                    return IngestionJob.model_validate_json(f.read())
+            except FileNotFoundError:
+                continue
+        return None
+
+    def _archive(self, job_id: str):
+        """Move a finished job's manifest out of the polled directory."""
+        try:
+            os.replace(self._path(job_id, ".json"), os.path.join(self.done_path, f"{job_id}.json"))
+        except FileNotFoundError:
+            pass
+
+    def save_job(self, job: IngestionJob):
+        """Atomically replace a job manifest."""
+        job.updated_at = datetime.now().isoformat()
+        tmp_path = self._path(job.job_id, ".json.tmp")
+        with open(tmp_path, "w") as f:
+            f.write(job.model_dump_json())
+        os.replace(tmp_path, self._path(job.job_id, ".json"))
+
+    async def submit(self, read: Callable[[int], Awaitable[bytes]], filename: Optional[str]) -> IngestionJob:
+        """Spool an upload to disk and queue it for ingestion."""
+        job_id = str(uuid.uuid4())
+        read_size = config["ingestion"]["read_size_bytes"]
+        bytes_total = 0
+        digest = hashlib.sha256()
+        with open(self._path(job_id, ".upload"), "wb") as f:
+            while True:
+                data = await read(read_size)
+                if not data:
+                    break
+                await asyncio.to_thread(f.write, data)
+                digest.update(data)
+                bytes_total += len(data)
+        now = datetime.now().isoformat()
+        job = IngestionJob(
+            job_id=job_id,
+            document_id=str(uuid.uuid4()),
+            filename=filename,
+            created_at=now,
+            updated_at=now,
+            bytes_total=bytes_total,
+            content_hash=digest.hexdigest()
+        )
+        self.save_job(job)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        logger.info(f"Queued ingestion job {job_id} for {filename} ({bytes_total} bytes)")
+        return job
+
+    def start(self):
+        """Start the background workers on the running event loop."""
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Stop the workers; interrupted jobs resume on the next start."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _pending_jobs(self) -> List[str]:
+        """Job ids whose manifests are not finished, oldest first. Blocking; run it in a thread."""
+        manifests = []
+        for entry in os.scandir(self.spool_path):
+            if entry.name.endswith(".json") and entry.name[:-len(".json")] not in self._active:
+                try:
+                    manifests.append((entry.stat().st_mtime, entry.name[:-len(".json")]))
+                except FileNotFoundError:
+                    continue
+        pending = []
+        for _, job_id in sorted(manifests):
+            job = self.load_job(job_id)
+            if job is None:
+                continue
+            if job.status in ("queued", "running"):
+                pending.append(job_id)
+            else:
+                # Finished before manifests were archived, or archived by a worker that died just before
+                self._archive(job_id)
+        return pending
+
+    def _release(self, job_id: str, lock):
+        """Unlock a job, deleting its lock file once the job has finished."""
+        if not os.path.exists(self._path(job_id, ".json")):
+            try:
+                os.remove(self._path(job_id, ".lock"))
+            except FileNotFoundError:
+                pass
+        fcntl.flock(lock, fcntl.LOCK_UN)
+        lock.close()
+
+    def _claim(self, job_id: str):
+        """Take the job's lock without blocking, returning the open lock file or None."""
+        lock = open(self._path(job_id, ".lock"), "ab")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return lock
+        except BlockingIOError:
+            lock.close()
+            return None
+
+    async def _worker(self):
+        while True:
+            try:
+                claimed = None
+                for job_id in await asyncio.to_thread(self._pending_jobs):
+                    lock = self._claim(job_id)
+                    if lock is not None:
+                        claimed = (job_id, lock)
+                        break
+                if claimed is None:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                job_id, lock = claimed
+                self._active.add(job_id)
+                try:
+                    await self._run(job_id)
+                finally:
+                    self._active.discard(job_id)
+                    self._release(job_id, lock)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ingestion worker error: {e}")
+                await asyncio.sleep(self.poll_interval)
+
+    def _is_completed_upload(self, passages: List[Dict[str, Any]], job: IngestionJob) -> bool:
+        """Whether the passages are all of this exact file, written by another job that completed.
+
+        Passages left by an earlier attempt of the same job (or by a job
+        that failed) carry the same document hash but may be partial, so
+        they only seed the resume through ``known_hashes``.
+        """
+        job_ids = {passage[INGESTION_JOB_KEY] for passage in passages}
+        if len(job_ids) != 1 or any(passage[DOCUMENT_HASH_KEY] != job.content_hash for passage in passages):
+            return False
+        owner_id = job_ids.pop()
+        if owner_id is None or owner_id == job.job_id:
+            return False
+        owner = self.load_job(owner_id)
+        return owner is not None and owner.status == "completed"
+
+    async def _run(self, job_id: str):
+        """Process one claimed job, resuming after any batches already written."""
+        job = self.load_job(job_id)
+        if job is None or job.status not in ("queued", "running"):
+            return
+        job.status = "running"
+        job.attempts += 1
+        # Counts from batches an earlier attempt did not finish are dropped; those batches run again
+        job.chunks_embedded = job.chunks_written = sum(len(ids) for ids in job.completed_batches.values())
+        job.chunks_skipped = sum(job.skipped_batches.values())
+        self.save_job(job)
+        last_save = time.monotonic()
+        attempt_skipped: Dict[int, int] = {}
+
+        def on_progress(event: str, batch_index: int, chunk_ids: List[str]):
+            nonlocal last_save
+            if event == "skipped":
+                job.chunks_skipped += len(chunk_ids)
+                attempt_skipped[batch_index] = attempt_skipped.get(batch_index, 0) + len(chunk_ids)
+            elif event == "embedded":
+                job.chunks_embedded += len(chunk_ids)
+            else:
+                job.chunks_written += len(chunk_ids)
+                job.completed_batches[batch_index] = chunk_ids
+                job.skipped_batches[batch_index] = attempt_skipped.pop(batch_index, 0)
+            # Throttle manifest writes; each one rewrites the whole file
+            if time.monotonic() - last_save >= 1.0:
+                self.save_job(job)
+                last_save = time.monotonic()
+
+        try:
+            tools = await aget_aperture_tools()
+            # Uploading a filename again replaces its passages: unchanged ones are kept, the rest rewritten
+            previous = await tools.find_file_passages(job.filename) if job.filename else []
+            if previous and self._is_completed_upload(previous, job):
+                job.chunks_skipped = len(previous)
+                stats = IngestionStats(bytes_read=job.bytes_total, chunks=len(previous), chunks_skipped=len(previous))
+                logger.info(f"Ingestion job {job_id}: {job.filename} is unchanged, nothing to index")
+            else:
+                with open(self._path(job_id, ".upload"), "rb") as f:
+                    chunk_ids, stats = await ingest_stream(
+                        tools,
+                        lambda n: asyncio.to_thread(f.read, n),
+                        metadata={
+                            "filename": job.filename,
+                            "document_id": job.document_id,
+                            "timestamp": job.created_at,
+                            DOCUMENT_HASH_KEY: job.content_hash,
+                            INGESTION_JOB_KEY: job.job_id
+                        },
+                        skip_batches=set(job.completed_batches),
+                        on_progress=on_progress,
+                        known_hashes={passage[CONTENT_HASH_KEY]: passage["id"] for passage in previous if passage[CONTENT_HASH_KEY]}
+                    )
+                kept = {chunk_id for ids in job.completed_batches.values() for chunk_id in ids}
+                stale = [passage["id"] for passage in previous if passage["id"] not in kept]
+                if stale:
+                    await tools.delete_documents(stale)
+                stats.chunks_deleted = len(stale)
+            job.status = "completed"
+            job.stats = stats
+            os.remove(self._path(job_id, ".upload"))
+            logger.info(f"Completed ingestion job {job_id}: {job.chunks_written} chunks written")
+        except asyncio.CancelledError:
+            self.save_job(job)
+            raise
+        except Exception as e:
+            logger.error(f"Ingestion job {job_id} failed on attempt {job.attempts}: {e}")
+            job.errors.append(str(e))
+            job.status = "failed" if job.attempts >= self.max_attempts else "queued"
+        self.save_job(job)
+        if job.status in ("completed", "failed"):
+            self._archive(job_id)
+
+_ingestion_queue: Optional[IngestionQueue] = None
+
+def get_ingestion_queue() -> IngestionQueue:
+    """Get the process-wide ingestion queue configured in config.yaml."""
+    global _ingestion_queue
+    if _ingestion_queue is None:
+        ingestion_config = config["ingestion"]
+        _ingestion_queue = IngestionQueue(
+            spool_path=os.path.join(os.path.dirname(__file__), ingestion_config["spool_path"]),
+            workers=ingestion_config["workers"],
+            poll_interval=ingestion_config["poll_interval_seconds"],
+            max_attempts=ingestion_config["max_attempts"]
+        )
+    return _ingestion_queue
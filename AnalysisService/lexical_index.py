@@ -0,0 +1,292 @@
+from collections import Counter
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import fcntl
+import json
+import logging
+import math
+import os
+import re
+import threading
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase alphanumeric tokens."""
+    return TOKEN_PATTERN.findall(text.lower())
+
+def pack_strings(strings: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Pack strings into one UTF-8 byte array plus offsets, avoiding fixed-width unicode arrays."""
+    encoded = [string.encode() for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(data) for data in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+def unpack_strings(data: np.ndarray, offsets: np.ndarray) -> List[str]:
+    blob = data.tobytes()
+    return [blob[start:end].decode() for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+
+class LexicalIndex:
+    """BM25 inverted index over passage text, shared by workers through files.
+
+    Changes are appended as JSON lines to ``log.jsonl`` under an exclusive
+    file lock, and every worker applies records it has not seen before
+    answering a query, so all workers converge on the same index. Once the
+    log grows past ``compact_after`` records it is folded into
+    ``postings.npz``: per-term posting lists of delta-encoded document rows
+    and term frequencies, compressed, with deleted documents dropped. The
+    log is then swapped for an empty one; workers notice the new inode and
+    reload the snapshot.
+
+    Until a compaction, document frequencies still count deleted
+    documents, which only slightly dampens the idf of their terms.
+    """
+
+    def __init__(self, path: str, k1: float = 1.2, b: float = 0.75, compact_after: int = 10000):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.compact_after = compact_after
+        self.snapshot_path = os.path.join(path, "postings.npz")
+        self.log_path = os.path.join(path, "log.jsonl")
+        self.lock_path = os.path.join(path, "index.lock")
+        self._lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+        open(self.log_path, "ab").close()
+        self._reset()
+        self.refresh()
+
+    def _reset(self):
+        self.ids: List[str] = []
+        self.rows: Dict[str, int] = {}
+        self.texts: List[str] = []
+        self.metadata: List[Dict[str, Any]] = []
+        self.doc_lens = np.empty(0, dtype=np.int32)
+        self.alive = np.empty(0, dtype=bool)
+        self.total_length = 0
+        self._size = 0
+        self._postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._pending: Dict[str, Tuple[List[int], List[int]]] = {}
+        self._log_offset = 0
+        self._log_records = 0
+        self._log_inode: Optional[int] = None
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def _grow(self, extra: int):
+        needed = self._size + extra
+        if needed <= len(self.doc_lens):
+            return
+        capacity = max(needed, 2 * len(self.doc_lens), 1024)
+        doc_lens = np.zeros(capacity, dtype=np.int32)
+        doc_lens[:self._size] = self.doc_lens[:self._size]
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:self._size] = self.alive[:self._size]
+        self.doc_lens, self.alive = doc_lens, alive
+
+    def _apply_add(self, unique_id: str, text: str, metadata: Dict[str, Any]):
+        self._apply_delete([unique_id])
+        counts = Counter(tokenize(text))
+        self._grow(1)
+        row = self._size
+        self._size += 1
+        self.ids.append(unique_id)
+        self.texts.append(text)
+        self.metadata.append(metadata)
+        self.rows[unique_id] = row
+        length = sum(counts.values())
+        self.doc_lens[row] = length
+        self.alive[row] = True
+        self.total_length += length
+        for term, count in counts.items():
+            rows, tfs = self._pending.setdefault(term, ([], []))
+            rows.append(row)
+            tfs.append(min(count, 65535))
+
+    def _apply_delete(self, ids: Sequence[str]):
+        for unique_id in ids:
+            row = self.rows.pop(unique_id, None)
+            if row is not None:
+                self.alive[row] = False
+                self.total_length -= int(self.doc_lens[row])
+                # Drop the body now; the postings go at the next compaction
+                self.texts[row] = ""
+                self.metadata[row] = {}
+
+    def _apply(self, record: Dict[str, Any]):
+        if record["op"] == "add":
+            self._apply_add(record["id"], record["text"], record["metadata"])
+        elif record["op"] == "delete":
+            self._apply_delete(record["ids"])
+
+    def _load_snapshot(self):
+        if not os.path.exists(self.snapshot_path):
+            return
+        with np.load(self.snapshot_path) as data:
+            self.ids = data["ids"].tolist()
+            self.texts = unpack_strings(data["texts"], data["text_offsets"])
+            self.metadata = [json.loads(m) for m in unpack_strings(data["metadata"], data["metadata_offsets"])]
+            self.doc_lens = data["doc_lens"].astype(np.int32)
+            terms, offsets = data["terms"].tolist(), data["offsets"]
+            deltas, tfs = data["deltas"], data["tfs"]
+        self._size = len(self.ids)
+        self.alive = np.ones(self._size, dtype=bool)
+        self.rows = {unique_id: row for row, unique_id in enumerate(self.ids)}
+        self.total_length = int(self.doc_lens.sum())
+        for i, term in enumerate(terms):
+            start, end = offsets[i], offsets[i + 1]
+            self._postings[term] = (np.cumsum(deltas[start:end], dtype=np.int64).astype(np.int32), tfs[start:end])
+
+    def refresh(self):
+        """Apply log records written since the last refresh, reloading after a compaction."""
+        with self._lock:
+            stat = os.stat(self.log_path)
+            if stat.st_ino != self._log_inode:
+                self._reset()
+                self._load_snapshot()
+                self._log_inode = stat.st_ino
+            if stat.st_size <= self._log_offset:
+                return
+            with open(self.log_path, "rb") as f:
+                f.seek(self._log_offset)
+                data = f.read(stat.st_size - self._log_offset)
+            # Only consume complete lines; a writer may be mid-append
+            usable = data.rfind(b"\n") + 1
+            for line in data[:usable].splitlines():
+                if line:
+                    self._apply(json.loads(line))
+                    self._log_records += 1
+            self._log_offset += usable
+
+    def _append(self, records: List[Dict[str, Any]]):
+        with self._lock, open(self.lock_path, "ab") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(self.log_path, "ab") as f:
+                    f.write("".join(json.dumps(record) + "\n" for record in records).encode())
+                self.refresh()
+                if self._log_records >= self.compact_after:
+                    self._compact()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def add(self, documents: Sequence[Tuple[str, str, Dict[str, Any]]]):
+        """Add or replace (id, text, metadata) documents."""
+        if documents:
+            self._append([{"op": "add", "id": unique_id, "text": text, "metadata": metadata}
+                          for unique_id, text, metadata in documents])
+
+    def remove(self, ids: Sequence[str]):
+        """Remove documents by id."""
+        if ids:
+            self._append([{"op": "delete", "ids": list(ids)}])
+
+    def _term_postings(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Posting arrays for a term, merging rows added since it was last queried."""
+        pending = self._pending.pop(term, None)
+        if pending is not None:
+            rows, tfs = np.asarray(pending[0], dtype=np.int32), np.asarray(pending[1], dtype=np.uint16)
+            if term in self._postings:
+                old_rows, old_tfs = self._postings[term]
+                rows, tfs = np.concatenate([old_rows, rows]), np.concatenate([old_tfs, tfs])
+            self._postings[term] = (rows, tfs)
+        return self._postings.get(term)
+
+    def search(self, query: str, k: int) -> List[Tuple[str, float]]:
+        """Return up to k (id, BM25 score) pairs with a positive score, best first."""
+        self.refresh()
+        with self._lock:
+            n = len(self.rows)
+            if n == 0:
+                return []
+            avgdl = max(self.total_length / n, 1.0)
+            scores = np.zeros(self._size, dtype=np.float32)
+            for term, query_count in Counter(tokenize(query)).items():
+                postings = self._term_postings(term)
+                if postings is None:
+                    continue
+                rows, tfs = postings
+                df = len(rows)
+                idf = math.log(1 + max(n - df, 0) / (df + 0.5) + 0.5 / (df + 0.5))
+                tf = tfs.astype(np.float32)
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lens[rows] / avgdl)
+                # Rows are unique within a posting list, so fancy-index accumulation is safe
+                scores[rows] += query_count * idf * tf * (self.k1 + 1) / (tf + norm)
+            scores[~self.alive[:self._size]] = 0
+            hits = np.flatnonzero(scores > 0)
+            if len(hits) > k:
+                hits = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+            hits = hits[np.argsort(-scores[hits], kind="stable")]
+            return [(self.ids[row], float(scores[row])) for row in hits]
+
+    def get(self, unique_id: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """Return the (text, metadata) stored for a document id."""
+        with self._lock:
+            row = self.rows.get(unique_id)
+            return None if row is None else (self.texts[row], self.metadata[row])
+
+    def compact(self):
+        """Fold the log into a new postings snapshot."""
+        with self._lock, open(self.lock_path, "ab") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self.refresh()
+                self._compact()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _compact(self):
+        """Write the snapshot and start an empty log. Caller holds the file lock."""
+        keep = np.flatnonzero(self.alive[:self._size])
+        remap = np.full(self._size, -1, dtype=np.int64)
+        remap[keep] = np.arange(len(keep))
+        for term in list(self._pending):
+            self._term_postings(term)
+        terms, offsets, deltas, tfs = [], [0], [], []
+        for term, (rows, term_tfs) in self._postings.items():
+            live = self.alive[rows]
+            if not live.any():
+                continue
+            new_rows = remap[rows[live]]
+            terms.append(term)
+            deltas.append(np.diff(new_rows, prepend=0).astype(np.uint32))
+            tfs.append(term_tfs[live])
+            offsets.append(offsets[-1] + len(new_rows))
+        texts, text_offsets = pack_strings([self.texts[row] for row in keep])
+        metadata, metadata_offsets = pack_strings([json.dumps(self.metadata[row]) for row in keep])
+        tmp_path = self.snapshot_path + ".tmp.npz"
+        np.savez_compressed(
+            tmp_path,
+            ids=np.array([self.ids[row] for row in keep], dtype=str),
+            texts=texts,
+            text_offsets=text_offsets,
+            metadata=metadata,
+            metadata_offsets=metadata_offsets,
+            doc_lens=self.doc_lens[keep],
+            terms=np.array(terms, dtype=str),
+            offsets=np.array(offsets, dtype=np.int64),
+            deltas=np.concatenate(deltas) if deltas else np.empty(0, dtype=np.uint32),
+            tfs=np.concatenate(tfs) if tfs else np.empty(0, dtype=np.uint16)
+        )
+        # The snapshot lands before the log is swapped, so a reader that sees the new log sees it too
+        os.replace(tmp_path, self.snapshot_path)
+        open(self.log_path + ".tmp", "wb").close()
+        os.replace(self.log_path + ".tmp", self.log_path)
+        logger.info(f"Compacted lexical index to {len(keep)} documents and {len(terms)} terms")
+        self.refresh()
+
+def is_keyword_query(query: str, max_terms: int) -> bool:
+    """Whether a query looks like a keyword lookup (a name or ticker) rather than a description."""
+    terms = tokenize(query)
+    return 0 < len(terms) <= max_terms and not query.rstrip().endswith("?")
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int, constant: int = 60) -> List[Tuple[str, float]]:
+    """Fuse ranked id lists by summing 1 / (constant + rank), returning the top k (id, score) pairs."""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, unique_id in enumerate(ranking, start=1):
+            scores[unique_id] = scores.get(unique_id, 0.0) + 1.0 / (constant + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
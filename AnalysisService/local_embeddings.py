@@ -0,0 +1,109 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+import asyncio
+import logging
+import os
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+class LocalEmbeddings(Embeddings):
+    """Embeddings computed in-process with a sentence-transformers model loaded from disk.
+
+    Inputs are sorted by length and grouped so each batch pads to roughly
+    ``max_batch_chars`` characters, then the batches run in parallel on a
+    pool of ``workers`` threads, each with an even share of the CPU cores.
+    With ``onnx`` the model runs on ONNX Runtime, optionally from an int8
+    quantized ``onnx_file`` inside the model directory.
+    """
+
+    def __init__(self, model_path: str, device: str = "cpu", workers: int = 2, max_batch_chars: int = 32000,
+                 normalize: bool = True, onnx: bool = False, onnx_file: Optional[str] = None):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise ImportError(
+                "sentence-transformers is not installed. Please install it using "
+                "'pip install sentence-transformers'"
+            )
+        kwargs = {}
+        if onnx:
+            kwargs["backend"] = "onnx"
+            if onnx_file:
+                kwargs["model_kwargs"] = {"file_name": onnx_file}
+        self.model = SentenceTransformer(model_path, device=device, **kwargs)
+        if not onnx:
+            import torch
+            # Split the cores between workers instead of letting every batch oversubscribe them
+            torch.set_num_threads(max(1, (os.cpu_count() or 1) // workers))
+        self.model_path = model_path
+        self.normalize = normalize
+        self.max_batch_chars = max_batch_chars
+        self.dimensions = self.model.get_sentence_embedding_dimension()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="embeddings")
+        # Pay for lazy initialization now rather than on the first query
+        self._encode(["warm up"])
+        logger.info(f"Loaded local embedding model from {model_path} ({self.dimensions} dimensions, {workers} workers)")
+
+    def _batches(self, texts: List[str]) -> List[List[int]]:
+        """Group text indices into batches of similar length whose padded size stays under max_batch_chars."""
+        batches: List[List[int]] = []
+        batch: List[int] = []
+        longest = 0
+        for i in sorted(range(len(texts)), key=lambda i: len(texts[i])):
+            length = max(len(texts[i]), 1)
+            if batch and max(longest, length) * (len(batch) + 1) > self.max_batch_chars:
+                batches.append(batch)
+                batch, longest = [], 0
+            batch.append(i)
+            longest = max(longest, length)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        return self.model.encode(
+            texts,
+            batch_size=len(texts),
+            convert_to_numpy=True,
+            normalize_embeddings=self.normalize,
+            show_progress_bar=False
+        ).astype(np.float32, copy=False)
+
+    def embed_array(self, texts: List[str]) -> np.ndarray:
+        """Embed texts into a float32 (len(texts), dimensions) array, blocking the calling thread."""
+        out = np.empty((len(texts), self.dimensions), dtype=np.float32)
+        batches = self._batches(texts)
+        for batch, vectors in zip(batches, self.executor.map(lambda batch: self._encode([texts[i] for i in batch]), batches)):
+            out[batch] = vectors
+        return out
+
+    async def aembed_documents_array(self, texts: List[str]) -> np.ndarray:
+        """Embed texts into a float32 (len(texts), dimensions) array without blocking the event loop."""
+        out = np.empty((len(texts), self.dimensions), dtype=np.float32)
+        batches = self._batches(texts)
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(*[
+            loop.run_in_executor(self.executor, self._encode, [texts[i] for i in batch]) for batch in batches
+        ])
+        for batch, vectors in zip(batches, results):
+            out[batch] = vectors
+        return out
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Generate embeddings for a list of documents."""
+        return self.embed_array(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        """Generate embedding for a single query."""
+        return self._encode([text])[0].tolist()
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Generate embeddings for a list of documents asynchronously."""
+        return (await self.aembed_documents_array(texts)).tolist()
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """Generate embedding for a single query asynchronously."""
+        vectors = await asyncio.get_running_loop().run_in_executor(self.executor, self._encode, [text])
+        return vectors[0].tolist()
@@ -1,6 +1,8 @@
-from typing import Dict, Any, List, Optional
-from fastapi import FastAPI, HTTPException, UploadFile, File, Depends
+from typing import Awaitable, Callable, Dict, Any, List, Literal, Optional
+from fastapi import FastAPI, HTTPException, UploadFile, File, Depends, Header, Request
+from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+import asyncio
 import logging
 import os
 import yaml
@@ -14,6 +16,12 @@ from fastapi_cache.backends.inmemory import InMemoryBackend
 from fastapi_cache.decorator import cache
 from fastapi_cache.coder import JsonCoder
 import hashlib
+import csv
+import io
+import random
+import secrets
+import threading
+import time
 from contextlib import asynccontextmanager
 
 from models import (
@@ -21,9 +29,19 @@ from models import (
     StartupAnalysisResponse,
     IntermediateResults,
     AnalysisOutput,
-    FileUploadResponse
+    FileUploadResponse,
+    IngestionJob,
+    BatchSearchInput,
+    RankInput,
+    ArchiveQuery,
+    UsageStats
 )
-from agent import run_analysis
+from agent import apply_ranking, run_analysis
+from tools import aget_aperture_tools, close_aperture_tools, close_http_clients, corpus_generation, run_ann_sync
+from ingestion import get_ingestion_queue
+from archive import get_analysis_archive
+from usage import USAGE_FIELDS, get_usage_ledger
+from profiler import SamplingProfiler, get_profile_store
 
 # Load environment variables
 load_dotenv()
@@ -55,8 +73,18 @@ async def lifespan(app: FastAPI):
     backend = InMemoryBackend()
     FastAPICache.init(backend, prefix="spyglass-cache:", coder=JsonCoder)
     logger.info("Cache initialized")
+    # Start the background ingestion workers, resuming any spooled jobs
+    ingestion_queue = get_ingestion_queue()
+    ingestion_queue.start()
+    # Keep the local ANN index in sync with other workers
+    ann_sync_task = asyncio.create_task(run_ann_sync()) if config["ann_index"]["enabled"] else None
     yield
-    # Shutdown: Nothing to clean up for in-memory cache
+    # Shutdown: Stop the background tasks and close the pooled embedding HTTP clients and ApertureDB connections
+    if ann_sync_task is not None:
+        ann_sync_task.cancel()
+    await ingestion_queue.stop()
+    await close_http_clients()
+    close_aperture_tools()
 
 app = FastAPI(
     title="SpyGlass API",
@@ -84,6 +112,38 @@ app.add_middleware(
     max_age=86400,  # Cache preflight requests for 24 hours
 )
 
+def is_admin(token: Optional[str]) -> bool:
+    """Whether a token matches SPYGLASS_ADMIN_TOKEN; always false when it is unset."""
+    admin_token = os.environ.get("SPYGLASS_ADMIN_TOKEN")
+    return bool(admin_token and token and secrets.compare_digest(token, admin_token))
+
+def require_admin(x_admin_token: Optional[str] = Header(default=None)):
+    """Dependency that rejects requests without the admin token."""
+    if not is_admin(x_admin_token):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+@app.middleware("http")
+async def profile_requests(request: Request, call_next):
+    """Sample the event loop's stack during opted-in or randomly sampled requests and save the profile."""
+    profiling_config = config["profiling"]
+    if request.url.path not in profiling_config["paths"]:
+        return await call_next(request)
+    requested = request.headers.get("x-profile") == "1" and is_admin(request.headers.get("x-admin-token"))
+    if not requested and random.random() >= profiling_config["sample_rate"]:
+        return await call_next(request)
+    profiler = SamplingProfiler(threading.get_ident(), profiling_config["interval_seconds"])
+    profiler.start()
+    try:
+        response = await call_next(request)
+    finally:
+        profiler.stop()
+    try:
+        profile_id = await asyncio.to_thread(get_profile_store().save, profiler, f"{request.method} {request.url.path}")
+        response.headers["X-Profile-Id"] = profile_id
+    except Exception as e:
+        logger.warning(f"Failed to save profile: {str(e)}")
+    return response
+
 def get_cache_key(query: AnalysisInput) -> str:
     """Generate a deterministic cache key from the query."""
     # Create a string with all relevant query parameters
@@ -107,6 +167,19 @@ async def cached_analysis(query: AnalysisInput) -> AnalysisOutput:
         
         logger.info(f"Analysis computation completed in {results.execution_time:.2f} seconds")
         
+        # Keep the trends for analytics beyond the lifetime of the cache entry
+        if config["archive"]["enabled"]:
+            try:
+                await asyncio.to_thread(
+                    get_analysis_archive().append,
+                    get_cache_key(query).split(":", 1)[1],
+                    query,
+                    results.final_result,
+                    results.execution_time
+                )
+            except Exception as e:
+                logger.warning(f"Failed to archive analysis: {str(e)}")
+        
         # Return the results
         return AnalysisOutput(
             status="success",
@@ -116,7 +189,8 @@ async def cached_analysis(query: AnalysisInput) -> AnalysisOutput:
                 "competitor_analysis": results.competitor_analysis.model_dump() if results.competitor_analysis else None,
                 "final_result": results.final_result.model_dump() if results.final_result else None,
                 "execution_time": results.execution_time,
-                "refinement_steps": [step.model_dump() for step in results.refinement_steps] if results.refinement_steps else []
+                "refinement_steps": [step.model_dump() for step in results.refinement_steps] if results.refinement_steps else [],
+                "usage": results.usage.model_dump() if results.usage else None
             }
         )
     except Exception as e:
@@ -128,9 +202,26 @@ async def cached_analysis(query: AnalysisInput) -> AnalysisOutput:
             error=str(e)
         )
 
+async def record_usage(user: str, query: AnalysisInput, cache_key: str, data: Dict[str, Any]):
+    """Append the usage of an /analyze request to the ledger."""
+    usage = data.get("usage")
+    if not usage:
+        return
+    # A result-cache hit carries the cached run's step usage, which this request did not incur
+    steps = {} if usage.get("cache") == "hit" else {
+        step: data[step]["usage"]
+        for step in ("trend_analysis", "opportunity_analysis", "competitor_analysis")
+        if data.get(step) and data[step].get("usage")
+    }
+    try:
+        await asyncio.to_thread(get_usage_ledger().record, user, query.user_input, cache_key.split(":", 1)[1], usage, steps)
+    except Exception as e:
+        logger.warning(f"Failed to record usage: {str(e)}")
+
 @weave.op()
-async def analyze_business_opportunity(query: AnalysisInput) -> AnalysisOutput:
+async def analyze_business_opportunity(query: AnalysisInput, user: str = "anonymous") -> AnalysisOutput:
     """Analyze a business opportunity and return trend analysis with intermediate steps."""
+    start = time.perf_counter()
     # Map user_query to user_input if needed
     if hasattr(query, 'user_query') and not hasattr(query, 'user_input'):
         query.user_input = query.user_query
@@ -145,7 +236,12 @@ async def analyze_business_opportunity(query: AnalysisInput) -> AnalysisOutput:
         cached_result = await backend.get(cache_key)
         if cached_result is not None:
             logger.info(f"Cache hit for: {query.user_input}")
-            return JsonCoder.decode(cached_result)
+            result = JsonCoder.decode(cached_result)
+            # The cached steps keep the usage of the run that computed them; this request cost nothing
+            if result.get("data"):
+                result["data"]["usage"] = UsageStats(cache="hit", queue_seconds=time.perf_counter() - start).model_dump()
+                await record_usage(user, query, cache_key, result["data"])
+            return result
     except Exception as e:
         logger.warning(f"Cache check failed: {str(e)}")
     
@@ -156,14 +252,15 @@ async def analyze_business_opportunity(query: AnalysisInput) -> AnalysisOutput:
         await backend.set(cache_key, JsonCoder.encode(result), expire=30 * 24 * 60 * 60)  # 30 days
     except Exception as e:
         logger.warning(f"Failed to store in cache: {str(e)}")
+    await record_usage(user, query, cache_key, result.data)
     
     return result
 
 @app.post("/analyze", response_model=AnalysisOutput)
-async def analyze(query: AnalysisInput) -> AnalysisOutput:
+async def analyze(query: AnalysisInput, x_user_id: Optional[str] = Header(default=None)) -> AnalysisOutput:
     """Analyze a business opportunity and return trend analysis with all intermediate steps."""
     try:
-        return await analyze_business_opportunity(query)
+        return await analyze_business_opportunity(query, x_user_id or "anonymous")
     except Exception as e:
         logger.error(f"Error in analyze endpoint: {str(e)}")
         return AnalysisOutput(
@@ -174,35 +271,16 @@ async def analyze(query: AnalysisInput) -> AnalysisOutput:
 
 @app.post("/index", response_model=FileUploadResponse)
 async def index(file: UploadFile = File(...)) -> FileUploadResponse:
-    """Index a file for analysis."""
+    """Spool a file and queue it for background indexing."""
     try:
         logger.info(f"Received document indexing request: {file.filename}")
         
-        # Create a temporary file to store the uploaded content
-        with tempfile.NamedTemporaryFile(delete=False) as tmp:
-            content = await file.read()
-            tmp.write(content)
-            tmp_path = tmp.name
-
-        # Read the temporary file and index it
-        with open(tmp_path, 'r') as f:
-            content = f.read()
-            document = Document(
-                page_content=content,
-                metadata={
-                    "filename": file.filename,
-                    "timestamp": datetime.now().isoformat()
-                }
-            )
-            await aperture_tools.add_document(document)
-        
-        # Clean up the temporary file
-        Path(tmp_path).unlink()
+        job = await get_ingestion_queue().submit(file.read, file.filename)
         
-        logger.info(f"Successfully indexed document: {file.filename}")
         return FileUploadResponse(
-            status="success",
-            file_id="temp_id"
+            status="queued",
+            file_id=job.document_id,
+            job_id=job.job_id
         )
     except Exception as e:
         logger.error(f"Error in file upload: {str(e)}")
@@ -211,24 +289,225 @@ async def index(file: UploadFile = File(...)) -> FileUploadResponse:
             error=str(e)
         )
 
+@app.get("/index/{job_id}", response_model=IngestionJob)
+async def index_status(job_id: str) -> IngestionJob:
+    """Get the progress of a background indexing job."""
+    job = get_ingestion_queue().load_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Ingestion job not found: {job_id}")
+    return job
+
+def normalize_query(query: str) -> str:
+    """Collapse whitespace so trivially different spellings of a query share a cache entry."""
+    return " ".join(query.split())
+
+async def cached_search(params: Dict[str, Any], compute: Callable[[], Awaitable[Any]]) -> Any:
+    """Serve search results from the cache, keyed by the parameters and the current corpus generation."""
+    key_str = json.dumps(params, sort_keys=True)
+    cache_key = f"search:{corpus_generation.current()}:{hashlib.md5(key_str.encode()).hexdigest()}"
+    try:
+        backend = FastAPICache.get_backend()
+        cached_result = await backend.get(cache_key)
+        if cached_result is not None:
+            logger.info(f"Search cache hit for: {key_str}")
+            return JsonCoder.decode(cached_result)
+    except Exception as e:
+        logger.warning(f"Search cache check failed: {str(e)}")
+    
+    result = await compute()
+    try:
+        backend = FastAPICache.get_backend()
+        await backend.set(cache_key, JsonCoder.encode(result), expire=config["search"]["cache_ttl_seconds"])
+    except Exception as e:
+        logger.warning(f"Failed to store search results in cache: {str(e)}")
+    return result
+
+def search_hits(results: List[Any]) -> List[Dict[str, Any]]:
+    """Turn (document, score) pairs, live or decoded from the cache, into response objects."""
+    return [{"document": document, "score": score} for document, score in results]
+
 @app.get("/search")
-async def search(query: str, limit: int = 5) -> List[Dict[str, Any]]:
+async def search(
+    query: str,
+    limit: int = 5,
+    search_type: Literal["similarity", "mmr"] = "similarity",
+    fetch_k: Optional[int] = None,
+    lambda_mult: Optional[float] = None,
+    mode: Optional[Literal["auto", "vector", "lexical", "hybrid"]] = None
+) -> List[Dict[str, Any]]:
     """
     API endpoint to search for documents.
+
+    With search_type=mmr, fetch_k candidates are re-ranked for diversity
+    using lambda_mult (defaults from config.yaml). Similarity searches go
+    through the query router; mode overrides lexical.router.
     """
     try:
-        logger.info(f"Received search request: query='{query}', limit={limit}")
+        logger.info(f"Received search request: query='{query}', limit={limit}, search_type={search_type}")
+        
+        query = normalize_query(query)
+        if search_type == "mmr":
+            fetch_k = fetch_k or max(config["search"]["fetch_k"], limit)
+            lambda_mult = config["search"]["lambda_mult"] if lambda_mult is None else lambda_mult
         
-        # Search documents
-        results = await aperture_tools.search_similar_documents(query, k=limit)
+        async def compute():
+            aperture_tools = await aget_aperture_tools()
+            if search_type == "mmr":
+                return await aperture_tools.mmr_search(query, k=limit, fetch_k=fetch_k, lambda_mult=lambda_mult)
+            return await aperture_tools.routed_search(query, k=limit, mode=mode)
+        
+        # Search documents, reusing results computed against the same corpus
+        params = {"query": query, "limit": limit, "search_type": search_type}
+        if search_type == "mmr":
+            params.update(fetch_k=fetch_k, lambda_mult=lambda_mult)
+        else:
+            params.update(mode=mode or config["lexical"]["router"])
+        results = await cached_search(params, compute)
         
         logger.info(f"Found {len(results)} matching documents")
-        return results
+        return search_hits(results)
     except Exception as e:
         logger.error(f"Error searching documents: {str(e)}")
         logger.error(f"Traceback: {traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/search/batch")
+async def search_batch(request: BatchSearchInput) -> List[Dict[str, Any]]:
+    """
+    API endpoint to search for several queries at once.
+
+    All queries are embedded in one call and looked up in one ApertureDB
+    transaction; results are returned per query in request order.
+    """
+    try:
+        logger.info(f"Received batch search request: {len(request.queries)} queries, limit={request.limit}")
+        
+        queries = [normalize_query(query) for query in request.queries]
+        
+        async def compute():
+            aperture_tools = await aget_aperture_tools()
+            return await aperture_tools.search_batch(queries, k=request.limit)
+        
+        results = await cached_search({"queries": queries, "limit": request.limit}, compute)
+        
+        return [{"query": query, "results": search_hits(query_results)} for query, query_results in zip(request.queries, results)]
+    except Exception as e:
+        logger.error(f"Error in batch search: {str(e)}")
+        logger.error(f"Traceback: {traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/rank", response_model=StartupAnalysisResponse)
+async def rank(request: RankInput) -> StartupAnalysisResponse:
+    """
+    API endpoint to re-rank trends with custom weights.
+
+    Scores are computed from the trends' own fields, so any weighting can
+    be tried on a finished analysis without another model call.
+    """
+    try:
+        weights = request.weights or config["ranking"]["weights"]
+        return StartupAnalysisResponse(trends=apply_ranking(request.trends, weights, request.k))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/archive/query")
+async def archive_query(request: ArchiveQuery) -> List[Dict[str, Any]]:
+    """
+    API endpoint to filter and aggregate the trends of all archived analyses.
+
+    Date bounds prune whole day partitions and filters are pushed down to
+    the Parquet files, so only matching row groups are read.
+    """
+    if not config["archive"]["enabled"]:
+        raise HTTPException(status_code=404, detail="The analysis archive is disabled")
+    try:
+        return await asyncio.to_thread(
+            get_analysis_archive().query,
+            filters=[(f.column, f.op, f.value) for f in request.filters],
+            columns=request.columns,
+            group_by=request.group_by,
+            aggregations=[(a.column, a.function) for a in request.aggregations],
+            order_by=request.order_by,
+            descending=request.descending,
+            limit=request.limit,
+            since=request.since,
+            until=request.until
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error in archive query: {str(e)}")
+        logger.error(f"Traceback: {traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/usage", dependencies=[Depends(require_admin)])
+async def usage(
+    group_by: Literal["user", "query", "day"] = "user",
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    order_by: Literal["estimated_cost_usd", "prompt_tokens", "completion_tokens", "llm_seconds", "max_llm_seconds", "requests"] = "estimated_cost_usd",
+    limit: int = 20
+) -> List[Dict[str, Any]]:
+    """
+    API endpoint to total /analyze usage per user, query or day.
+
+    since and until are inclusive YYYY-MM-DD dates (UTC); groups are
+    returned largest first by order_by, so cost and latency outliers
+    come first.
+    """
+    try:
+        return await asyncio.to_thread(get_usage_ledger().aggregate, group_by, since, until, order_by, limit)
+    except Exception as e:
+        logger.error(f"Error in usage: {str(e)}")
+        logger.error(f"Traceback: {traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/usage/export", dependencies=[Depends(require_admin)])
+async def usage_export(
+    format: Literal["jsonl", "csv"] = "jsonl",
+    since: Optional[str] = None,
+    until: Optional[str] = None
+) -> StreamingResponse:
+    """API endpoint to download the usage ledger, one record per /analyze request."""
+    entries = get_usage_ledger().entries(since, until)
+    if format == "jsonl":
+        return StreamingResponse((json.dumps(entry) + "\n" for entry in entries), media_type="application/x-ndjson")
+
+    columns = ["timestamp", "user", "query", "analysis_id", "cache", *USAGE_FIELDS]
+    steps = ("trend_analysis", "opportunity_analysis", "competitor_analysis")
+    step_columns = [f"{step}_{field}" for step in steps for field in ("prompt_tokens", "completion_tokens", "llm_seconds")]
+
+    def rows():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns + step_columns)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        for entry in entries:
+            writer.writerow(
+                [entry.get(column) for column in columns]
+                + [entry["steps"].get(step, {}).get(field) for step in steps for field in ("prompt_tokens", "completion_tokens", "llm_seconds")]
+            )
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    return StreamingResponse(rows(), media_type="text/csv", headers={"Content-Disposition": "attachment; filename=usage.csv"})
+
+@app.get("/profiles", dependencies=[Depends(require_admin)])
+async def list_profiles() -> List[Dict[str, Any]]:
+    """API endpoint to list saved request profiles, newest first."""
+    return await asyncio.to_thread(get_profile_store().list)
+
+@app.get("/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+async def download_profile(profile_id: str, format: Literal["speedscope", "collapsed"] = "speedscope") -> FileResponse:
+    """API endpoint to download a profile for speedscope.app or as collapsed stacks for flame graph tools."""
+    path = get_profile_store().file(profile_id, format)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, filename=os.path.basename(path))
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
@@ -1,10 +1,12 @@
-from typing import List, Dict, Any, Optional, Union
+from typing import List, Dict, Any, Literal, Optional, Union
 from pydantic import BaseModel, Field, field_validator
+from pydantic.json_schema import SkipJsonSchema
 
 class TrendOp(BaseModel):
     """Model for a trend operation analysis."""
     name: str = Field(description="Name of the trend/domain that the startup is related to")
-    description: str = Field(description="Description of the trend and its impact on the market")
+    # May be left out for a known trend referenced by Trend_id; the registry fills it in
+    description: str = Field(default="", description="Description of the trend and its impact on the market")
     Year_2025: int = Field(description="Annual growth/adoption rate for 2025 as integer percentage (1-100)", gt=0)
     Year_2026: int = Field(description="Annual growth/adoption rate for 2026 as integer percentage (1-100)", gt=0)
     Year_2027: int = Field(description="Annual growth/adoption rate for 2027 as integer percentage (1-100)", gt=0)
@@ -16,6 +18,14 @@ class TrendOp(BaseModel):
     Growth_rate_WoW: float = Field(description="Percentage of Week-over-week growth between 0 and 100 (>50 for YC qualification)", ge=0)
     YC_chances: float = Field(description="Percentage of probability of YC acceptance based on uniqueness and growth potential of the start-up in percentage between 0 to 100", ge=0.0, le=100.0)
     Related_trends: str = Field(description="Comma-separated list of related trends that the startup leverages")
+    Trend_id: Optional[str] = Field(default=None, description="Id of the known trend this trend is, if it is one of the known trends listed")
+    # Filled in after generation (similarities by the uniqueness stage, Compounded_growth and Score by the
+    # rank stage), so they are left out of the format instructions
+    Corpus_similarity: SkipJsonSchema[Optional[float]] = Field(default=None, description="Highest cosine similarity of the opportunity to a stored passage")
+    Idea_similarity: SkipJsonSchema[Optional[float]] = Field(default=None, description="Highest cosine similarity of the opportunity to another generated one")
+    Is_unique: SkipJsonSchema[Optional[bool]] = Field(default=None, description="Whether both similarities are below the uniqueness threshold")
+    Compounded_growth: SkipJsonSchema[Optional[float]] = Field(default=None, description="Total growth implied by the 2025-2030 rates, prod(1 + rate / 100) - 1")
+    Score: SkipJsonSchema[Optional[float]] = Field(default=None, description="Composite ranking score computed by the service")
 
     @field_validator('Year_2025', 'Year_2026', 'Year_2027', 'Year_2028', 'Year_2029', 'Year_2030')
     @classmethod
@@ -84,6 +94,16 @@ class StartupAnalysisResponse(BaseModel):
         }
     }
 
+class UsageStats(BaseModel):
+    """Model for the LLM usage, latency and estimated cost of a step or a whole analysis."""
+    llm_calls: int = Field(default=0, description="Number of chat model calls")
+    prompt_tokens: int = Field(default=0, description="Prompt tokens reported by the model provider")
+    completion_tokens: int = Field(default=0, description="Completion tokens reported by the model provider")
+    llm_seconds: float = Field(default=0.0, description="Wall time spent in chat model calls")
+    queue_seconds: float = Field(default=0.0, description="Time spent waiting (for retrieval, clients or the result cache) before the first model call")
+    cache: str = Field(default="miss", description="Where the result came from: miss (model called), cassette (replayed recording) or hit (result cache)")
+    estimated_cost_usd: float = Field(default=0.0, description="Token cost at the prices in config.yaml")
+
 class IntermediateStep(BaseModel):
     """Model for intermediate analysis steps."""
     step_name: str = Field(description="Name of the analysis step")
@@ -91,6 +111,7 @@ class IntermediateStep(BaseModel):
     timestamp: str = Field(description="ISO format timestamp of when the step was completed")
     is_refined: bool = Field(default=False, description="Whether this step was refined due to quality check")
     refinement_count: int = Field(default=0, description="Number of times this step was refined")
+    usage: Optional[UsageStats] = Field(default=None, description="Token, latency and cost accounting of the step")
 
 class IntermediateResults(BaseModel):
     """Model for storing all intermediate results during analysis."""
@@ -100,6 +121,7 @@ class IntermediateResults(BaseModel):
     final_result: Optional[StartupAnalysisResponse] = Field(default=None, description="Final parsed results")
     execution_time: float = Field(default=0.0, description="Total execution time in seconds")
     refinement_steps: List[IntermediateStep] = Field(default_factory=list, description="List of any refinement steps performed")
+    usage: Optional[UsageStats] = Field(default=None, description="Token, latency and cost accounting of the whole analysis, refinements included")
 
     model_config = {
         'json_schema_extra': {
@@ -143,18 +165,119 @@ class AnalysisOutput(BaseModel):
         }
     }
 
+class IngestionStats(BaseModel):
+    """Model for statistics of a document ingestion."""
+    bytes_read: int = Field(default=0, description="Number of bytes read from the upload")
+    chunks: int = Field(default=0, description="Number of passages the document was split into")
+    batches: int = Field(default=0, description="Number of embedding/write batches")
+    chunks_skipped: int = Field(default=0, description="Number of passages already stored, reused without embedding")
+    chunks_deleted: int = Field(default=0, description="Number of passages of an earlier upload of the file that were removed")
+    embed_seconds: float = Field(default=0.0, description="Total time spent embedding batches")
+    write_seconds: float = Field(default=0.0, description="Total time spent writing batches to ApertureDB")
+    elapsed_seconds: float = Field(default=0.0, description="Wall-clock time of the ingestion")
+
+class IngestionJob(BaseModel):
+    """Model for a background ingestion job and its progress."""
+    job_id: str = Field(description="ID of the ingestion job")
+    document_id: str = Field(description="ID shared by all passages of the document")
+    filename: Optional[str] = Field(default=None, description="Name of the uploaded file")
+    status: str = Field(default="queued", description="Status of the job (queued/running/completed/failed)")
+    created_at: str = Field(description="ISO format timestamp of when the job was submitted")
+    updated_at: str = Field(description="ISO format timestamp of the last progress update")
+    attempts: int = Field(default=0, description="Number of times a worker has started the job")
+    bytes_total: int = Field(default=0, description="Size of the spooled upload in bytes")
+    content_hash: Optional[str] = Field(default=None, description="SHA-256 of the uploaded file")
+    chunks_embedded: int = Field(default=0, description="Number of passages embedded so far")
+    chunks_written: int = Field(default=0, description="Number of passages stored for the document so far, including reused ones")
+    chunks_skipped: int = Field(default=0, description="Number of passages already stored, reused without embedding")
+    errors: List[str] = Field(default_factory=list, description="Errors raised by failed attempts")
+    completed_batches: Dict[int, List[str]] = Field(default_factory=dict, description="Passage ids of each written batch, used to resume")
+    skipped_batches: Dict[int, int] = Field(default_factory=dict, description="Passages reused without embedding in each written batch")
+    stats: Optional[IngestionStats] = Field(default=None, description="Statistics of the last attempt")
+
 class FileUploadResponse(BaseModel):
     """Model for file upload response."""
     status: str = Field(description="Status of the upload (success/error)")
     file_id: Optional[str] = Field(default=None, description="ID of the uploaded file")
+    job_id: Optional[str] = Field(default=None, description="ID of the background ingestion job")
+    chunk_ids: List[str] = Field(default_factory=list, description="IDs of the indexed passages")
+    stats: Optional[IngestionStats] = Field(default=None, description="Ingestion statistics")
     error: Optional[str] = Field(default=None, description="Error message if any")
 
     model_config = {
         'json_schema_extra': {
             'examples': [{
-                'status': 'success',
+                'status': 'queued',
                 'file_id': 'abc123',
+                'job_id': 'f4e2c1d0-...',
+                'chunk_ids': [],
+                'stats': None,
                 'error': None
             }]
         }
     }
+
+class BatchSearchInput(BaseModel):
+    """Input model for batched search requests."""
+    queries: List[str] = Field(min_length=1, max_length=100, description="Queries to search for")
+    limit: int = Field(default=5, ge=1, le=50, description="Maximum number of results per query")
+
+    model_config = {
+        'json_schema_extra': {
+            'examples': [{
+                'queries': ['Remote Work Tools', 'Carbon Capture'],
+                'limit': 5
+            }]
+        }
+    }
+
+class RankInput(BaseModel):
+    """Input model for re-ranking trends with custom weights."""
+    trends: List[TrendOp] = Field(min_length=1, description="Trends to rank, e.g. final_result.trends of an analysis")
+    weights: Optional[Dict[str, float]] = Field(default=None, description="Feature weights of the composite score; defaults to ranking.weights in config.yaml")
+    k: Optional[int] = Field(default=None, ge=1, description="Number of top trends to return; all when omitted")
+
+    model_config = {
+        'json_schema_extra': {
+            'examples': [{
+                'trends': [],  # Will be populated with TrendOp examples
+                'weights': {'growth_x_yc': 1.0, 'compounded_growth': 10.0},
+                'k': 5
+            }]
+        }
+    }
+
+class ArchiveFilter(BaseModel):
+    """A condition on an archive column."""
+    column: str = Field(description="Archive column, e.g. Year_2030 or user_input")
+    op: Literal["==", "!=", "<", "<=", ">", ">=", "in", "contains"] = Field(description="Comparison operator; contains is a case-insensitive substring match")
+    value: Any = Field(description="Value to compare with; a list for in")
+
+class ArchiveAggregation(BaseModel):
+    """An aggregate computed over an archive column."""
+    column: str = Field(description="Archive column to aggregate")
+    function: Literal["count", "count_distinct", "sum", "mean", "min", "max"] = Field(description="Aggregate function")
+
+class ArchiveQuery(BaseModel):
+    """Input model for analytics queries over archived analyses."""
+    filters: List[ArchiveFilter] = Field(default_factory=list, description="Conditions that rows must all meet")
+    columns: Optional[List[str]] = Field(default=None, description="Columns to return when not aggregating; all when omitted")
+    group_by: List[str] = Field(default_factory=list, description="Columns to group by when aggregating")
+    aggregations: List[ArchiveAggregation] = Field(default_factory=list, description="Aggregates to compute, named <column>_<function>")
+    order_by: Optional[str] = Field(default=None, description="Result column to sort by")
+    descending: bool = Field(default=True, description="Sort in descending order")
+    limit: int = Field(default=100, ge=1, le=10000, description="Maximum number of rows returned")
+    since: Optional[str] = Field(default=None, pattern=r"^\d{4}-\d{2}-\d{2}$", description="First day included (YYYY-MM-DD, UTC)")
+    until: Optional[str] = Field(default=None, pattern=r"^\d{4}-\d{2}-\d{2}$", description="Last day included (YYYY-MM-DD, UTC)")
+
+    model_config = {
+        'json_schema_extra': {
+            'examples': [{
+                'group_by': ['name'],
+                'aggregations': [{'column': 'Year_2030', 'function': 'mean'}, {'column': 'analysis_id', 'function': 'count_distinct'}],
+                'order_by': 'Year_2030_mean',
+                'limit': 10,
+                'since': '2026-10-01'
+            }]
+        }
+    }
@@ -0,0 +1,166 @@
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+import yaml
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# Load configuration
+config_path = os.path.join(os.path.dirname(__file__), "config.yaml")
+with open(config_path, "r") as f:
+    config = yaml.safe_load(f)
+
+Frame = Tuple[str, str, int]  # (qualified name, file, first line)
+
+class SamplingProfiler:
+    """Samples the Python stack of one thread at a fixed interval from a background thread.
+
+    The profiled thread runs untouched; each sample costs the sampler one
+    ``sys._current_frames()`` call and a walk up the stack, so the overhead
+    stays low even at a few hundred samples per second. In the service the
+    profiled thread is the event loop, so samples also include other
+    requests that happened to run concurrently.
+    """
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self.started_at = 0.0
+        self.elapsed = 0.0
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack: List[Frame] = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((getattr(code, "co_qualname", code.co_name), code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            if stack:
+                self.samples[tuple(reversed(stack))] += 1
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        self._thread.join()
+        self.elapsed = time.perf_counter() - self.started_at
+        return self.samples
+
+def frame_label(frame: Frame) -> str:
+    name, filename, line = frame
+    return f"{name} ({os.path.basename(filename)}:{line})".replace(";", ",")
+
+def to_collapsed(samples: Counter) -> str:
+    """Brendan Gregg's collapsed stack format, readable by flamegraph.pl, speedscope and most flame graph tools."""
+    return "".join(f"{';'.join(frame_label(frame) for frame in stack)} {count}\n" for stack, count in samples.most_common())
+
+def to_speedscope(samples: Counter, name: str, duration: float) -> Dict[str, Any]:
+    """A speedscope sampled profile spreading the measured duration over the samples, in milliseconds.
+
+    Samples arrive less often than the interval while the profiled thread
+    holds the GIL, so weighting by wall time keeps the totals honest.
+    """
+    frames: Dict[Frame, int] = {}
+    stacks, weights = [], []
+    sample_ms = duration * 1000 / max(1, sum(samples.values()))
+    for stack, count in samples.items():
+        stacks.append([frames.setdefault(frame, len(frames)) for frame in stack])
+        weights.append(count * sample_ms)
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "shared": {"frames": [{"name": frame[0], "file": frame[1], "line": frame[2]} for frame in frames]},
+        "profiles": [{
+            "type": "sampled",
+            "name": name,
+            "unit": "milliseconds",
+            "startValue": 0,
+            "endValue": sum(weights),
+            "samples": stacks,
+            "weights": weights
+        }],
+        "name": name,
+        "exporter": "spyglass-profiler"
+    }
+
+PROFILE_FORMATS = {"speedscope": ".speedscope.json", "collapsed": ".collapsed.txt"}
+
+class ProfileStore:
+    """Directory of saved profiles, each as speedscope and collapsed-stack files plus a metadata file."""
+
+    def __init__(self, path: str, max_profiles: int):
+        self.path = path
+        self.max_profiles = max_profiles
+        os.makedirs(path, exist_ok=True)
+
+    def save(self, profiler: SamplingProfiler, request: str) -> str:
+        """Write a finished profile and return its id, pruning the oldest profiles beyond max_profiles."""
+        created_at = datetime.now(timezone.utc)
+        profile_id = f"{created_at:%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+        base = os.path.join(self.path, profile_id)
+        with open(base + PROFILE_FORMATS["collapsed"], "w") as f:
+            f.write(to_collapsed(profiler.samples))
+        with open(base + PROFILE_FORMATS["speedscope"], "w") as f:
+            json.dump(to_speedscope(profiler.samples, request, profiler.elapsed), f)
+        metadata = {
+            "profile_id": profile_id,
+            "request": request,
+            "created_at": created_at.isoformat(),
+            "duration_seconds": profiler.elapsed,
+            "samples": sum(profiler.samples.values()),
+            "interval_seconds": profiler.interval
+        }
+        # Written last, so a listed profile always has both files
+        with open(base + ".json", "w") as f:
+            json.dump(metadata, f)
+        self._prune()
+        return profile_id
+
+    def list(self) -> List[Dict[str, Any]]:
+        """Metadata of the saved profiles, newest first."""
+        profiles = []
+        for name in sorted(os.listdir(self.path), reverse=True):
+            if name.endswith(".json") and not name.endswith(PROFILE_FORMATS["speedscope"]):
+                with open(os.path.join(self.path, name), "r") as f:
+                    profiles.append(json.load(f))
+        return profiles
+
+    def file(self, profile_id: str, format: str) -> Optional[str]:
+        """Path of a saved profile in a format, or None if there is no such profile."""
+        if os.path.basename(profile_id) != profile_id or format not in PROFILE_FORMATS:
+            return None
+        path = os.path.join(self.path, profile_id + PROFILE_FORMATS[format])
+        return path if os.path.exists(path) else None
+
+    def _prune(self):
+        for profile in self.list()[self.max_profiles:]:
+            for suffix in [".json", *PROFILE_FORMATS.values()]:
+                try:
+                    os.remove(os.path.join(self.path, profile["profile_id"] + suffix))
+                except FileNotFoundError:
+                    pass
+
+_profile_store: Optional[ProfileStore] = None
+
+def get_profile_store() -> ProfileStore:
+    """Get the process-wide profile store configured in config.yaml."""
+    global _profile_store
+    if _profile_store is None:
+        profiling_config = config["profiling"]
+        _profile_store = ProfileStore(
+            os.path.join(os.path.dirname(__file__), profiling_config["path"]),
+            max_profiles=profiling_config["max_profiles"]
+        )
+    return _profile_store
@@ -0,0 +1,50 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+
+YEAR_FIELDS = ["Year_2025", "Year_2026", "Year_2027", "Year_2028", "Year_2029", "Year_2030"]
+
+# Features a composite score can weight, all computed per trend
+FEATURES = ["compounded_growth", "growth_x_yc", "Growth_rate_WoW", "YC_chances", "Year_2030"]
+
+def trend_features(trends: Sequence) -> Dict[str, np.ndarray]:
+    """Compute every ranking feature for a list of TrendOp in vectorized form.
+
+    ``compounded_growth`` is the total growth implied by the yearly rates,
+    prod(1 + rate / 100) - 1 over 2025-2030; ``growth_x_yc`` is
+    Growth_rate_WoW * YC_chances, the ordering the trend prompt asks for.
+    """
+    years = np.array([[getattr(trend, field) for field in YEAR_FIELDS] for trend in trends], dtype=np.float64).reshape(-1, len(YEAR_FIELDS))
+    growth = np.array([trend.Growth_rate_WoW for trend in trends], dtype=np.float64)
+    yc_chances = np.array([trend.YC_chances for trend in trends], dtype=np.float64)
+    return {
+        "compounded_growth": np.prod(1 + years / 100, axis=1) - 1,
+        "growth_x_yc": growth * yc_chances,
+        "Growth_rate_WoW": growth,
+        "YC_chances": yc_chances,
+        "Year_2030": years[:, -1]
+    }
+
+def composite_scores(features: Dict[str, np.ndarray], weights: Dict[str, float]) -> np.ndarray:
+    """Weighted sum of raw feature values."""
+    unknown = set(weights) - set(FEATURES)
+    if unknown:
+        raise ValueError(f"Unknown ranking features {sorted(unknown)}; expected some of {FEATURES}")
+    n = len(next(iter(features.values())))
+    scores = np.zeros(n, dtype=np.float64)
+    for name, weight in weights.items():
+        scores += weight * features[name]
+    return scores
+
+def rank_trends(trends: Sequence, weights: Dict[str, float], k: Optional[int] = None) -> Tuple[List[int], np.ndarray, Dict[str, np.ndarray]]:
+    """Order trends by composite score, best first, keeping at most k.
+
+    The sort is stable, so ties keep the order the model produced and the
+    same trends and weights always give the same ranking. Returns the
+    selected indices, the scores of all trends and their features.
+    """
+    features = trend_features(trends)
+    scores = composite_scores(features, weights)
+    order = np.argsort(-scores, kind="stable")
+    if k is not None:
+        order = order[:k]
+    return order.tolist(), scores, features
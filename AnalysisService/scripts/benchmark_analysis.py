@@ -0,0 +1,65 @@
+import argparse
+import asyncio
+import cProfile
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cassette import Cassette, set_cassette
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Record or replay run_analysis to measure pipeline overhead.")
+    parser.add_argument("--mode", choices=["record", "replay"], default="replay")
+    parser.add_argument("--cassette", default=os.path.join("cassettes", "analysis.jsonl.gz"))
+    parser.add_argument("--latency", choices=["zero", "recorded"], default="zero")
+    parser.add_argument("--query", default="Make San Francisco carbon neutral")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--profile", help="Write a cProfile of the replayed runs to this path")
+    return parser.parse_args()
+
+async def benchmark(args, cassette: Cassette):
+    """Run the analysis repeatedly and report wall time versus recorded external time."""
+    from agent import run_analysis
+    from models import AnalysisInput
+
+    query = AnalysisInput(user_input=args.query, k=args.k)
+    runs = 1 if args.mode == "record" else args.runs
+    wall_times, overheads = [], []
+    for i in range(runs):
+        cassette.reset_stats()
+        start = time.perf_counter()
+        await run_analysis(query)
+        wall = time.perf_counter() - start
+        external = cassette.recorded_time if args.latency == "recorded" or args.mode == "record" else 0.0
+        wall_times.append(wall)
+        overheads.append(wall - external)
+        print(f"run {i + 1}: wall={wall:.3f}s external={cassette.recorded_time:.3f}s "
+              f"calls={cassette.calls} overhead={wall - external:.3f}s")
+
+    if runs > 1:
+        print(f"wall: mean={statistics.mean(wall_times):.3f}s median={statistics.median(wall_times):.3f}s")
+        print(f"overhead: mean={statistics.mean(overheads):.3f}s median={statistics.median(overheads):.3f}s")
+
+def main():
+    args = parse_args()
+    if args.mode == "replay":
+        # Replay never reaches the API, but the model client still requires a key
+        os.environ.setdefault("TOGETHERAI_API_KEY", "replay")
+    cassette = Cassette(args.cassette, mode=args.mode, latency=args.latency)
+    set_cassette(cassette)
+
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
+    asyncio.run(benchmark(args, cassette))
+    if profiler:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+        print(f"Profile written to {args.profile}")
+
+if __name__ == "__main__":
+    main()
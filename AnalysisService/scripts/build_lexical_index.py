@@ -0,0 +1,35 @@
+import argparse
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Backfill the lexical index from the active descriptor set.")
+    parser.add_argument("--page-size", type=int, default=500)
+    return parser.parse_args()
+
+def main():
+    """Page through every stored passage and add it to the lexical index, then compact it."""
+    args = parse_args()
+    load_dotenv()
+    from tools import get_aperture_tools
+
+    tools = get_aperture_tools()
+    if tools.lexical_index is None:
+        raise SystemExit("lexical.enabled is false in config.yaml")
+    start = time.perf_counter()
+    added = 0
+    for entities, _ in tools.iter_descriptors(args.page_size):
+        documents = [tools.vectorstore._descriptor_to_document(entity) for entity in entities]
+        tools.lexical_index.add([(doc.id, doc.page_content, doc.metadata) for doc in documents])
+        added += len(documents)
+        print(f"{added} passages indexed")
+    tools.lexical_index.compact()
+    print(f"Indexed {added} passages in {time.perf_counter() - start:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,342 @@
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Set in each worker process by init_worker
+_embeddings = None
+_splitter = None
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Bulk load CSV or JSONL corpora into the active descriptor set.")
+    parser.add_argument("paths", nargs="+", help="CSV (.csv) or JSON Lines (.jsonl, .ndjson) files")
+    parser.add_argument("--text-field", default="text", help="Column or key holding the passage text")
+    parser.add_argument("--metadata-fields", help="Comma-separated fields stored as metadata (default: every other scalar field)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processes chunking and embedding rows")
+    parser.add_argument("--rows-per-task", type=int, default=256, help="Rows handed to a worker at a time")
+    parser.add_argument("--write-batch-size", type=int, default=256, help="Passages per AddDescriptor transaction")
+    parser.add_argument("--write-retries", type=int, default=2, help="Retries of a failed transaction before it is split to isolate bad passages")
+    parser.add_argument("--rejects", help="JSON Lines file receiving rows that could not be loaded (default: <first path>.rejects.jsonl)")
+    return parser.parse_args()
+
+def metadata_key(field: str) -> str:
+    """Turn a column name into a valid descriptor property name."""
+    return re.sub(r"\W+", "_", field.strip()).strip("_") or "field"
+
+def read_rows(path: str) -> Iterator[Tuple[int, Optional[Dict[str, Any]], Optional[str]]]:
+    """Stream (row number, row, error) from a CSV or JSONL file; unparseable rows come with an error instead."""
+    if path.endswith(".csv"):
+        csv.field_size_limit(sys.maxsize)
+        with open(path, "r", newline="", encoding="utf-8", errors="replace") as f:
+            reader = csv.DictReader(f)
+            for row_number, row in enumerate(reader, start=1):
+                if None in row or None in row.values():
+                    yield row_number, None, f"expected {len(reader.fieldnames)} columns"
+                else:
+                    yield row_number, row, None
+    else:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            for row_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield row_number, None, f"invalid JSON: {e}"
+                    continue
+                if isinstance(row, dict):
+                    yield row_number, row, None
+                else:
+                    yield row_number, None, "not a JSON object"
+
+def init_worker(embedding_settings: Dict[str, Any], chunk_size: int, overlap: int):
+    """Build the embedding backend and splitter once per worker process."""
+    global _embeddings, _splitter
+    from ingestion import PassageSplitter
+    from tools import create_embeddings
+
+    if embedding_settings["backend"] == "local":
+        # The process pool provides the parallelism, so each model runs single-threaded
+        embedding_settings = {**embedding_settings, "local": {**embedding_settings["local"], "workers": 1}}
+    _embeddings = create_embeddings(embedding_settings)
+    _splitter = PassageSplitter(chunk_size, overlap)
+
+def chunk_row(source: str, row_number: int, row: Dict[str, Any], text_field: str,
+              metadata_fields: Optional[List[str]]) -> List[Tuple[str, Dict[str, Any]]]:
+    """Split one row into (passage, metadata) pairs; raises ValueError for rows without text."""
+    from tools import CONTENT_HASH_KEY, content_hash
+
+    text = row.get(text_field)
+    if not isinstance(text, str) or not text.strip():
+        raise ValueError(f"missing {text_field!r}")
+    fields = metadata_fields if metadata_fields is not None else [field for field in row if field != text_field]
+    metadata = {
+        metadata_key(field): row[field] for field in fields
+        if isinstance(row.get(field), (str, int, float, bool)) and row[field] != ""
+    }
+    metadata.update({"source_file": source, "source_row": row_number})
+    passages = list(_splitter.feed(text)) + list(_splitter.finish())
+    return [
+        (passage, {**metadata, "chunk_index": i, CONTENT_HASH_KEY: content_hash(passage)})
+        for i, passage in enumerate(passages)
+    ]
+
+def embed_rows(source: str, rows: List[Tuple[int, Dict[str, Any]]], text_field: str, metadata_fields: Optional[List[str]]):
+    """Chunk and embed a task's rows in a worker process.
+
+    Returns (passages, embeddings, rejects). If embedding the whole task
+    fails, rows are retried one at a time so a single bad row is rejected
+    on its own.
+    """
+    chunked: List[Tuple[int, List[Tuple[str, Dict[str, Any]]]]] = []
+    rejects: List[Tuple[int, str]] = []
+    for row_number, row in rows:
+        try:
+            chunked.append((row_number, chunk_row(source, row_number, row, text_field, metadata_fields)))
+        except Exception as e:
+            rejects.append((row_number, str(e)))
+    passages = [passage for _, row_passages in chunked for passage in row_passages]
+    if not passages:
+        return [], np.empty((0, 0), dtype=np.float32), rejects
+    try:
+        return passages, embed([text for text, _ in passages]), rejects
+    except Exception:
+        pass
+    kept, arrays = [], []
+    for row_number, row_passages in chunked:
+        try:
+            arrays.append(embed([text for text, _ in row_passages]))
+            kept.extend(row_passages)
+        except Exception as e:
+            rejects.append((row_number, f"embedding failed: {e}"))
+    return kept, np.concatenate(arrays) if arrays else np.empty((0, 0), dtype=np.float32), rejects
+
+def embed(texts: List[str]) -> np.ndarray:
+    if hasattr(_embeddings, "embed_array"):
+        return _embeddings.embed_array(texts)
+    return np.asarray(_embeddings.embed_documents(texts), dtype=np.float32)
+
+class WorkerPool:
+    """Process pool that is rebuilt when a worker dies, so a crashing row only costs the tasks in flight."""
+
+    def __init__(self, workers: int, initargs: tuple):
+        self.workers = workers
+        self.initargs = initargs
+        self.executor = self._create()
+
+    def _create(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker, initargs=self.initargs)
+
+    def submit(self, *args):
+        try:
+            return self.executor.submit(embed_rows, *args)
+        except BrokenProcessPool:
+            print("A worker process died; restarting the pool")
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = self._create()
+            return self.executor.submit(embed_rows, *args)
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+class Loader:
+    """Feeds rows to the process pool and writes finished passages to ApertureDB from the main process.
+
+    Failures never stop the load. A task whose worker raised or died is
+    split in half and resubmitted until the row responsible is isolated
+    and rejected, and a write transaction that still fails after retries is
+    bisected the same way down to single passages.
+    """
+
+    def __init__(self, tools, args, rejects_file, pool: WorkerPool):
+        from tools import CONTENT_HASH_KEY
+
+        self.tools = tools
+        self.args = args
+        self.rejects_file = rejects_file
+        self.pool = pool
+        self.pending: Dict[Any, Tuple[str, List[Tuple[int, Dict[str, Any]]]]] = {}
+        self.content_hash_key = CONTENT_HASH_KEY
+        self.metadata_fields = args.metadata_fields.split(",") if args.metadata_fields else None
+        self.seen = set()
+        self.rows = self.rejected = self.written = self.skipped = 0
+        self.start = time.perf_counter()
+        self.last_report = self.start
+
+    def reject(self, source: str, row_number: int, error: str):
+        self.rejected += 1
+        self.rejects_file.write(json.dumps({"file": source, "row": row_number, "error": error}) + "\n")
+
+    def reject_passages(self, passages: List[Tuple[str, Dict[str, Any]]], error: str):
+        """Reject the rows the passages came from, once per row."""
+        for source, row_number in dict.fromkeys((metadata["source_file"], metadata["source_row"]) for _, metadata in passages):
+            self.reject(source, row_number, error)
+
+    def submit(self, source: str, rows: List[Tuple[int, Dict[str, Any]]]):
+        future = self.pool.submit(source, rows, self.args.text_field, self.metadata_fields)
+        self.pending[future] = (source, rows)
+
+    def drain(self, block_until: int):
+        """Collect finished tasks until at most block_until are in flight."""
+        while len(self.pending) > block_until:
+            done, _ = wait(self.pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                self.collect(future, *self.pending.pop(future))
+
+    def write(self, passages: List[Tuple[str, Dict[str, Any]]], embeddings: np.ndarray):
+        """Insert passages not stored yet for their source file, in transactions of write_batch_size descriptors.
+
+        Like /index uploads, each source file owns its passages: text stored
+        for anything else gets a passage of its own, written with the stored
+        vector, so deleting or replacing the other copy never removes it.
+        """
+        for start in range(0, len(passages), self.args.write_batch_size):
+            batch = passages[start:start + self.args.write_batch_size]
+            vectors = embeddings[start:start + self.args.write_batch_size].copy()
+            keys = [(metadata["source_file"], metadata[self.content_hash_key]) for _, metadata in batch]
+            unseen: Dict[str, List[str]] = {}
+            for source, digest in dict.fromkeys(key for key in keys if key not in self.seen):
+                unseen.setdefault(source, []).append(digest)
+            try:
+                owned = {
+                    (source, digest)
+                    for source, digests in unseen.items()
+                    for digest in self.with_retries(self.tools._find_content_hashes, digests, {"source_file": source})
+                }
+                others = [digest for source, digests in unseen.items() for digest in digests if (source, digest) not in owned]
+                stored = self.with_retries(self.tools._find_content_hashes, others) if others else {}
+                stored_vectors = self.with_retries(self.tools._get_vectors, list(stored.values())) if stored else {}
+            except Exception as e:
+                self.reject_passages(batch, f"content hash lookup failed: {e}")
+                continue
+            # Already loaded from the same source, e.g. by an earlier run of the loader
+            self.seen.update(owned)
+            keep, batch_keys = [], set()
+            for i, key in enumerate(keys):
+                if key not in self.seen and key not in batch_keys:
+                    keep.append(i)
+                    stored_vector = stored_vectors.get(stored.get(key[1]))
+                    if stored_vector is not None:
+                        vectors[i] = stored_vector
+                batch_keys.add(key)
+            self.skipped += len(batch) - len(keep)
+            if keep:
+                self.insert([batch[i] for i in keep], vectors[keep])
+
+    def insert(self, passages: List[Tuple[str, Dict[str, Any]]], vectors: np.ndarray, retry: bool = True):
+        """Add passages in one transaction, bisecting a failing one so only passages that cannot be written are rejected."""
+        from langchain_core.documents import Document
+
+        documents = [Document(page_content=text, metadata=metadata, id=str(uuid.uuid4())) for text, metadata in passages]
+        try:
+            if retry:
+                self.with_retries(self.tools._add_embedded, documents, vectors)
+            else:
+                self.tools._add_embedded(documents, vectors)
+        except Exception as e:
+            if len(passages) == 1:
+                self.reject_passages(passages, f"write failed: {e}")
+                return
+            middle = len(passages) // 2
+            # The whole batch already had its retries; the halves are tried once each
+            self.insert(passages[:middle], vectors[:middle], retry=False)
+            self.insert(passages[middle:], vectors[middle:], retry=False)
+            return
+        self.written += len(passages)
+        self.seen.update((metadata["source_file"], metadata[self.content_hash_key]) for _, metadata in passages)
+
+    def with_retries(self, fn, *args):
+        """Call fn, retrying with exponential backoff on errors that may be transient."""
+        for attempt in range(self.args.write_retries + 1):
+            try:
+                return fn(*args)
+            except Exception:
+                if attempt == self.args.write_retries:
+                    raise
+                time.sleep(2 ** attempt)
+
+    def collect(self, future, source: str, rows: List[Tuple[int, Dict[str, Any]]]):
+        try:
+            passages, embeddings, rejects = future.result()
+        except Exception as e:
+            if len(rows) == 1:
+                self.reject(source, rows[0][0], f"worker failed: {e!r}")
+                self.rows += 1
+                self.report()
+                return
+            # Isolate the row that broke the worker; the other rows are resubmitted
+            middle = len(rows) // 2
+            self.submit(source, rows[:middle])
+            self.submit(source, rows[middle:])
+            return
+        for row_number, error in rejects:
+            self.reject(source, row_number, error)
+        if passages:
+            self.write(passages, embeddings)
+        self.rows += len(rows)
+        self.report()
+
+    def report(self, final: bool = False):
+        now = time.perf_counter()
+        if final or now - self.last_report >= 5:
+            elapsed = now - self.start
+            print(f"{self.rows} rows ({self.rows / max(elapsed, 1e-9):.0f} rows/s), {self.written} passages written, "
+                  f"{self.skipped} already stored, {self.rejected} rows rejected, {elapsed:.0f}s elapsed")
+            self.last_report = now
+
+def main():
+    """Stream rows into a process pool for chunking and embedding, and batch the descriptor inserts."""
+    args = parse_args()
+    load_dotenv()
+    from tools import config, corpus_generation, get_aperture_tools
+
+    tools = get_aperture_tools()
+    ingestion_config = config["ingestion"]
+    rejects_path = args.rejects or f"{args.paths[0]}.rejects.jsonl"
+    max_pending = 2 * args.workers
+    pool = WorkerPool(args.workers, (tools.embedding_settings, ingestion_config["chunk_size_chars"], ingestion_config["chunk_overlap_chars"]))
+    try:
+        with open(rejects_path, "a") as rejects_file:
+            loader = Loader(tools, args, rejects_file, pool)
+            for path in args.paths:
+                source = os.path.basename(path)
+                rows: List[Tuple[int, Dict[str, Any]]] = []
+                for row_number, row, error in read_rows(path):
+                    if error:
+                        loader.reject(source, row_number, error)
+                        loader.rows += 1
+                        continue
+                    rows.append((row_number, row))
+                    if len(rows) == args.rows_per_task:
+                        loader.drain(max_pending - 1)
+                        loader.submit(source, rows)
+                        rows = []
+                if rows:
+                    loader.drain(max_pending - 1)
+                    loader.submit(source, rows)
+            loader.drain(0)
+    finally:
+        pool.shutdown()
+
+    if loader.written:
+        corpus_generation.bump()
+    if tools.lexical_index is not None:
+        tools.lexical_index.compact()
+    loader.report(final=True)
+    if loader.rejected:
+        print(f"Rejected rows were recorded in {rejects_path}")
+
+if __name__ == "__main__":
+    main()
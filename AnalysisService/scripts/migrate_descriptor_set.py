@@ -0,0 +1,181 @@
+import argparse
+import asyncio
+import copy
+import json
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+from langchain_community.vectorstores.aperturedb import UNIQUEID_PROPERTY
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Re-embed the active descriptor set into a new one with another model, then switch to it."
+    )
+    parser.add_argument("--target", required=True, help="Name of the descriptor set to create or resume")
+    parser.add_argument("--backend", choices=["together", "local"], help="Embeddings backend for the target (default: unchanged)")
+    parser.add_argument("--model", help="Together AI embedding model for the target")
+    parser.add_argument("--model-path", help="Local model directory for the target, relative to the service directory")
+    parser.add_argument("--dimensions", type=int, help="Embedding dimensions of the target model")
+    parser.add_argument("--page-size", type=int, default=500, help="Descriptors read from the source per query")
+    parser.add_argument("--batch-size", type=int, default=64, help="Passages per embedding call and write transaction")
+    parser.add_argument("--concurrency", type=int, default=4, help="Batches embedded and written at once")
+    parser.add_argument("--max-docs-per-second", type=float, default=0, help="Throughput cap so the live service keeps headroom; 0 disables")
+    parser.add_argument("--checkpoint", help="Progress file (default: data/migrations/<target>.json)")
+    parser.add_argument("--no-switch", action="store_true", help="Copy and catch up, but leave the active set alone")
+    parser.add_argument("--grace-seconds", type=float, default=30, help="Wait after switching before the final catch-up")
+    return parser.parse_args()
+
+class RateLimiter:
+    """Spaces out batches so at most rate documents per second are started."""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.next_start = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, count: int):
+        if self.rate <= 0:
+            return
+        async with self.lock:
+            now = time.monotonic()
+            wait = self.next_start - now
+            self.next_start = max(now, self.next_start) + count / self.rate
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+class Checkpoint:
+    """Last source id copied, saved atomically after every page so a restart resumes after it."""
+
+    def __init__(self, path: str, source: str, target: str):
+        self.path = path
+        self.state = {"source": source, "target": target, "after": None, "copied": 0}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                state = json.load(f)
+            if state["source"] != source or state["target"] != target:
+                raise SystemExit(f"{path} belongs to a migration from {state['source']} to {state['target']}")
+            self.state = state
+
+    def save(self, after: str, copied: int):
+        self.state["after"] = after
+        self.state["copied"] += copied
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.path)
+
+def target_settings(active_embeddings: dict, args) -> dict:
+    """Apply the command line overrides to the active embeddings config."""
+    settings = copy.deepcopy(active_embeddings)
+    if args.backend:
+        settings["backend"] = args.backend
+    if args.model:
+        settings["model"] = args.model
+    if args.model_path:
+        settings["local"]["model_path"] = args.model_path
+    if args.dimensions:
+        settings["dimensions"] = args.dimensions
+    return settings
+
+async def copy_documents(target, documents, args, semaphore: asyncio.Semaphore, limiter: RateLimiter) -> int:
+    """Re-embed documents with the target model and write them under their existing ids."""
+    async def copy_batch(batch):
+        async with semaphore:
+            await limiter.acquire(len(batch))
+            embeddings = await target.embeddings.aembed_documents_array([doc.page_content for doc in batch])
+            await target.pool.run(target._add_embedded, batch, embeddings)
+
+    batches = [documents[i:i + args.batch_size] for i in range(0, len(documents), args.batch_size)]
+    await asyncio.gather(*[copy_batch(batch) for batch in batches])
+    return len(documents)
+
+async def list_ids(tools, page_size: int) -> set:
+    """All unique ids in a descriptor set."""
+    def collect():
+        return {entity[UNIQUEID_PROPERTY] for entities, _ in tools.iter_descriptors(page_size, properties=[]) for entity in entities}
+    return await tools.pool.run(collect, bounded=False)
+
+async def catch_up(source, target, args, semaphore, limiter, delete_extra: bool = True):
+    """Copy passages added to the source since they were streamed and, unless told not to, drop the ones deleted from it.
+
+    Only the migration writes to the target before the switch, so passages
+    it holds that the source lacks were deleted from the source. After the
+    switch workers write to the target too, and those passages must stay.
+    """
+    source_ids, target_ids = await asyncio.gather(list_ids(source, args.page_size), list_ids(target, args.page_size))
+    missing = sorted(source_ids - target_ids)
+    extra = sorted(target_ids - source_ids) if delete_extra else []
+    copied = 0
+    for start in range(0, len(missing), args.page_size):
+        documents = await source.pool.run(source._get_documents, missing[start:start + args.page_size])
+        copied += await copy_documents(target, list(documents.values()), args, semaphore, limiter)
+    if extra:
+        await target.pool.run(target._delete, extra)
+    print(f"Catch-up: {copied} copied, {len(extra)} deleted")
+
+async def migrate(args):
+    """Stream the active set page by page into the target, then catch up and switch."""
+    from tools import ApertureTools, active_descriptor_set, corpus_generation
+
+    active = active_descriptor_set.read()
+    if active["descriptor_set"] == args.target:
+        raise SystemExit(f"{args.target} is already the active descriptor set")
+    settings = target_settings(active["embeddings"], args)
+    source = ApertureTools(active["descriptor_set"], active["embeddings"], local_indexes=False)
+    target = ApertureTools(args.target, settings)
+    checkpoint = Checkpoint(
+        args.checkpoint or os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "migrations", f"{args.target}.json"),
+        source=active["descriptor_set"],
+        target=args.target
+    )
+    semaphore = asyncio.Semaphore(args.concurrency)
+    limiter = RateLimiter(args.max_docs_per_second)
+
+    print(f"Migrating {active['descriptor_set']} -> {args.target}, resuming after {checkpoint.state['after']!r}")
+    start = time.perf_counter()
+    pages = source.iter_descriptors(args.page_size, after=checkpoint.state["after"])
+    while True:
+        page = await asyncio.to_thread(next, pages, None)
+        if page is None:
+            break
+        entities, _ = page
+        documents = [source.vectorstore._descriptor_to_document(entity) for entity in entities]
+        # A crash between a write and its checkpoint leaves passages that are already copied
+        existing = await target.pool.run(target.existing_ids, [doc.id for doc in documents])
+        copied = await copy_documents(target, [doc for doc in documents if doc.id not in existing], args, semaphore, limiter)
+        checkpoint.save(documents[-1].id, copied)
+        elapsed = time.perf_counter() - start
+        print(f"{checkpoint.state['copied']} passages copied, {elapsed:.0f}s elapsed")
+
+    await catch_up(source, target, args, semaphore, limiter)
+    if target.ann_index is not None:
+        target.ann_index.save(target.ann_index_path())
+    if target.lexical_index is not None:
+        target.lexical_index.compact()
+    if args.no_switch:
+        print(f"Copied into {args.target}; active set left at {active['descriptor_set']}")
+        return
+
+    active_descriptor_set.switch(args.target, settings)
+    corpus_generation.bump()
+    print(f"Switched the active descriptor set to {args.target}; waiting {args.grace_seconds:.0f}s for workers to follow")
+    # Workers pick up the switch on their next request; writes that reached the old set meanwhile are copied over
+    await asyncio.sleep(args.grace_seconds)
+    # Copy only: the target is live now, so deleting what the source lacks would drop new writes
+    await catch_up(source, target, args, semaphore, limiter, delete_extra=False)
+    corpus_generation.bump()
+    os.remove(checkpoint.path)
+    print(f"Migration finished in {time.perf_counter() - start:.0f}s; {active['descriptor_set']} can be deleted once it is no longer needed")
+
+def main():
+    args = parse_args()
+    load_dotenv()
+    asyncio.run(migrate(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ann_index import LocalANNIndex
+from embedding_cache import CACHE_FILES
+from vectors import PRECISIONS, normalize, rerank
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Report recall versus memory for each local vector precision.")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--embedding-cache", help="Embedding cache directory to read vectors from")
+    source.add_argument("--ann-index", help="Saved local ANN index (.npz) to read vectors from")
+    parser.add_argument("--synthetic", type=int, default=20000, help="Number of random vectors when no source is given")
+    parser.add_argument("--dimensions", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--rerank-factors", default="1,4", help="Comma-separated rerank factors to try")
+    parser.add_argument("--n-probe", type=int, default=8)
+    parser.add_argument("--nlist", type=int, default=0)
+    parser.add_argument("--min-train-size", type=int, default=2048)
+    return parser.parse_args()
+
+def load_vectors(args) -> np.ndarray:
+    """Load the vectors to evaluate as a float32 matrix."""
+    if args.embedding_cache:
+        for precision, (vectors_file, _) in CACHE_FILES.items():
+            path = os.path.join(args.embedding_cache, vectors_file)
+            if os.path.exists(path) and os.path.getsize(path):
+                return np.fromfile(path, dtype=precision).reshape(-1, args.dimensions).astype(np.float32)
+        raise SystemExit(f"No cached vectors found in {args.embedding_cache}")
+    if args.ann_index:
+        index = LocalANNIndex.load(args.ann_index, args.dimensions)
+        if index.codec.precision != "float32":
+            print(f"warning: {args.ann_index} is stored as {index.codec.precision}; recall is measured against its decoded vectors")
+        return index.get_vectors(index.ids)
+    # Clustered rather than uniform, so neighbors are meaningful like real embeddings
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(max(1, args.synthetic // 100), args.dimensions))
+    return (centers[rng.integers(len(centers), size=args.synthetic)] + 0.5 * rng.normal(size=(args.synthetic, args.dimensions))).astype(np.float32)
+
+def evaluate(vectors: np.ndarray, queries: np.ndarray, truth: np.ndarray, precision: str, rerank_factor: int, args):
+    """Build an index at one precision and measure its recall@k, memory and query latency."""
+    index = LocalANNIndex(args.dimensions, n_probe=args.n_probe, nlist=args.nlist,
+                          min_train_size=args.min_train_size, precision=precision)
+    ids = [str(i) for i in range(len(vectors))]
+    index.add(ids, vectors)
+    index.train()
+    found, elapsed = 0, 0.0
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        hits = [int(unique_id) for unique_id, _ in index.search(query, args.k * rerank_factor)]
+        if rerank_factor > 1 and hits:
+            # The service re-scores with exact vectors fetched from ApertureDB
+            order, _ = rerank(query, vectors[hits], args.k)
+            hits = [hits[i] for i in order]
+        elapsed += time.perf_counter() - start
+        found += len(set(hits[:args.k]) & set(expected.tolist()))
+    return found / truth.size, index.nbytes, elapsed / len(queries)
+
+def main():
+    args = parse_args()
+    vectors = normalize(load_vectors(args))
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.choice(len(vectors), size=min(args.queries, len(vectors)), replace=False)]
+    queries = normalize(queries + 0.05 * rng.normal(size=queries.shape).astype(np.float32))
+    truth = np.argsort(-(queries @ vectors.T), axis=1)[:, :args.k]
+    float_list_bytes = len(vectors) * args.dimensions * 32  # 24-byte float object plus an 8-byte list slot
+    print(f"{len(vectors)} vectors x {args.dimensions} dims, {len(queries)} queries, k={args.k}")
+    print(f"as Python float lists: {float_list_bytes / 2**20:.1f} MiB")
+    print(f"{'precision':<10} {'rerank':>6} {'recall@k':>9} {'memory MiB':>11} {'ms/query':>9}")
+    for precision in PRECISIONS:
+        for rerank_factor in sorted({int(f) for f in args.rerank_factors.split(",")}):
+            if precision == "float32" and rerank_factor > 1:
+                continue
+            recall, nbytes, latency = evaluate(vectors, queries, truth, precision, rerank_factor, args)
+            print(f"{precision:<10} {rerank_factor:>6} {recall:>9.4f} {nbytes / 2**20:>11.1f} {latency * 1000:>9.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,178 @@
-from typing import List, Dict, Optional, Any
+from typing import Awaitable, Callable, List, Dict, Optional, Any, Tuple
+import asyncio
+import hashlib
 import json
+import logging
 import os
-from langchain_community.vectorstores.aperturedb import ApertureDB
+import random
+import re
+import threading
+import time
+import uuid
+import yaml
+import httpx
+from langchain_community.vectorstores.aperturedb import ApertureDB, PROPERTY_PREFIX, TEXT_PROPERTY, UNIQUEID_PROPERTY
 from langchain_core.embeddings import Embeddings
 import requests
 import numpy as np
 from langchain_openai import OpenAIEmbeddings
 from langchain.tools.retriever import create_retriever_tool
 from langchain_core.documents import Document
+from langchain_core.tools import StructuredTool
+from pydantic import BaseModel, Field, create_model
+from cassette import get_cassette
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+from local_embeddings import LocalEmbeddings
+from ann_index import LocalANNIndex
+from aperture_pool import ApertureConnectionPool
+from corpus_generation import CorpusGeneration
+from change_log import ChangeLog
+from active_set import ActiveDescriptorSet
+from lexical_index import LexicalIndex, is_keyword_query, reciprocal_rank_fusion
+from aperturedb.CommonLibrary import create_connector
+from vectors import maximal_marginal_relevance, pairwise_similarity, rerank
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+
+logger = logging.getLogger(__name__)
+
+# Load configuration
+config_path = os.path.join(os.path.dirname(__file__), "config.yaml")
+with open(config_path, "r") as f:
+    config = yaml.safe_load(f)
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+_http_session: Optional[requests.Session] = None
+_async_client: Optional[httpx.AsyncClient] = None
+_async_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def get_http_session() -> requests.Session:
+    """Get the shared keep-alive session used for blocking embedding calls."""
+    global _http_session
+    if _http_session is None:
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=config["embeddings"]["max_connections"])
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        _http_session = session
+    return _http_session
+
+def get_async_client() -> httpx.AsyncClient:
+    """Get the shared pooled async client for the running event loop."""
+    global _async_client, _async_client_loop
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_client_loop is not loop:
+        embeddings_config = config["embeddings"]
+        _async_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=embeddings_config["max_connections"],
+                max_keepalive_connections=embeddings_config["max_keepalive_connections"]
+            ),
+            timeout=httpx.Timeout(
+                embeddings_config["timeout_seconds"],
+                connect=embeddings_config["connect_timeout_seconds"]
+            )
+        )
+        _async_client_loop = loop
+    return _async_client
+
+async def close_http_clients():
+    """Close the shared HTTP clients on shutdown."""
+    global _http_session, _async_client, _async_client_loop
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+        _async_client_loop = None
+    if _http_session is not None:
+        _http_session.close()
+        _http_session = None
+
+def retry_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """Exponential backoff with full jitter, honouring a Retry-After header when present."""
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return random.uniform(0, config["embeddings"]["retry_base_delay_seconds"] * 2 ** attempt)
+
+class EmbeddingBatcher:
+    """Coalesces concurrent embedding calls into batched requests.
+
+    Callers are queued for up to ``window_seconds`` (or until ``max_batch_size``
+    texts are waiting), identical texts are embedded once, and the vectors are
+    fanned back out to the waiting callers.
+    """
+
+    def __init__(self, embed_batch: Callable[[List[str]], Awaitable[List[List[float]]]], window_seconds: float, max_batch_size: int):
+        self.embed_batch = embed_batch
+        self.window_seconds = window_seconds
+        self.max_batch_size = max_batch_size
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.loop_thread: Optional[int] = None
+        self.requests_sent = 0
+        self.texts_requested = 0
+        self._pending: List[Tuple[List[str], asyncio.Future]] = []
+        self._pending_count = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def _bind_loop(self):
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.loop = loop
+            self.loop_thread = threading.get_ident()
+            self._pending = []
+            self._pending_count = 0
+            self._timer = None
+
+    def can_join_from_thread(self) -> bool:
+        """Whether a blocking caller on another thread can hand its texts to the event loop."""
+        return (
+            self.loop is not None
+            and self.loop.is_running()
+            and self.loop_thread != threading.get_ident()
+        )
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        """Queue texts for the next batch and wait for their vectors."""
+        self._bind_loop()
+        future = self.loop.create_future()
+        self._pending.append((texts, future))
+        self._pending_count += len(texts)
+        self.texts_requested += len(texts)
+        if self._pending_count >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = self.loop.call_later(self.window_seconds, self._flush)
+        return await future
+
+    def _flush(self):
+        """Send everything that is waiting as one or more batched requests."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending, self._pending_count = self._pending, [], 0
+        if pending:
+            self.loop.create_task(self._dispatch(pending))
+
+    async def _dispatch(self, pending: List[Tuple[List[str], asyncio.Future]]):
+        unique_texts = list(dict.fromkeys(text for texts, _ in pending for text in texts))
+        batches = [unique_texts[i:i + self.max_batch_size] for i in range(0, len(unique_texts), self.max_batch_size)]
+        self.requests_sent += len(batches)
+        try:
+            results = await asyncio.gather(*(self.embed_batch(batch) for batch in batches))
+        except Exception as e:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        vectors = {}
+        for batch, embeddings in zip(batches, results):
+            vectors.update(zip(batch, embeddings))
+        for texts, future in pending:
+            if not future.done():
+                future.set_result([vectors[text] for text in texts])
 
 class TogetherEmbeddings(Embeddings):
     def __init__(self, api_key: str, model: str = "togethercomputer/m2-bert-80M-8k-retrieval"):
@@ -17,22 +182,80 @@ class TogetherEmbeddings(Embeddings):
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
-        self.base_url = "https://api.together.xyz/v1/embeddings"
+        self.base_url = config["embeddings"]["base_url"]
+        self.max_retries = config["embeddings"]["max_retries"]
+        self.timeout = (config["embeddings"]["connect_timeout_seconds"], config["embeddings"]["timeout_seconds"])
+        self.batcher = None
+        if config["embeddings"]["batching_enabled"]:
+            self.batcher = EmbeddingBatcher(
+                lambda texts: self._apost(self._payload(texts)),
+                window_seconds=config["embeddings"]["batch_window_ms"] / 1000,
+                max_batch_size=config["embeddings"]["max_batch_size"]
+            )
+
+    def _payload(self, texts: List[str]) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "input": texts
+        }
+
+    def _post(self, payload: Dict[str, Any]) -> List[List[float]]:
+        """POST a batch to the embeddings endpoint on the pooled session, retrying transient failures."""
+        session = get_http_session()
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = session.post(self.base_url, headers=self.headers, json=payload, timeout=self.timeout)
+                if response.status_code in RETRYABLE_STATUS_CODES and attempt < self.max_retries:
+                    time.sleep(retry_delay(attempt, response.headers.get("Retry-After")))
+                    continue
+                response.raise_for_status()
+                return [item["embedding"] for item in response.json()["data"]]
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(retry_delay(attempt))
+
+    async def _apost(self, payload: Dict[str, Any]) -> List[List[float]]:
+        """POST a batch to the embeddings endpoint on the pooled async client, retrying transient failures."""
+        client = get_async_client()
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await client.post(self.base_url, headers=self.headers, json=payload)
+                if response.status_code in RETRYABLE_STATUS_CODES and attempt < self.max_retries:
+                    await asyncio.sleep(retry_delay(attempt, response.headers.get("Retry-After")))
+                    continue
+                response.raise_for_status()
+                return [item["embedding"] for item in response.json()["data"]]
+            except httpx.TransportError:
+                if attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(retry_delay(attempt))
+
+    def _dispatch(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts from a blocking caller, joining the event loop's batches when possible."""
+        if self.batcher is not None and self.batcher.can_join_from_thread():
+            future = asyncio.run_coroutine_threadsafe(self.batcher.embed(texts), self.batcher.loop)
+            return future.result()
+        return self._post(self._payload(texts))
+
+    async def _adispatch(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts on the event loop, through the batcher when enabled."""
+        if self.batcher is not None:
+            return await self.batcher.embed(texts)
+        return await self._apost(self._payload(texts))
+
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        """Embed a batch of texts, blocking the calling thread."""
+        return get_cassette().call("embedding", self._payload(texts), lambda: self._dispatch(texts))
+
+    async def _aembed(self, texts: List[str]) -> List[List[float]]:
+        """Embed a batch of texts without blocking the event loop."""
+        return await get_cassette().acall("embedding", self._payload(texts), lambda: self._adispatch(texts))
 
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
         """Generate embeddings for a list of documents."""
         try:
-            response = requests.post(
-                self.base_url,
-                headers=self.headers,
-                json={
-                    "model": self.model,
-                    "input": texts
-                }
-            )
-            response.raise_for_status()
-            data = response.json()
-            return [item["embedding"] for item in data["data"]]
+            return self._embed(texts)
         except Exception as e:
             print(f"Error in embed_documents: {str(e)}")
             raise
@@ -40,47 +263,221 @@ class TogetherEmbeddings(Embeddings):
     def embed_query(self, text: str) -> List[float]:
         """Generate embedding for a single query."""
         try:
-            response = requests.post(
-                self.base_url,
-                headers=self.headers,
-                json={
-                    "model": self.model,
-                    "input": [text]
-                }
-            )
-            response.raise_for_status()
-            data = response.json()
-            return data["data"][0]["embedding"]
+            return self._embed([text])[0]
         except Exception as e:
             print(f"Error in embed_query: {str(e)}")
             raise
 
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Generate embeddings for a list of documents asynchronously."""
+        try:
+            return await self._aembed(texts)
+        except Exception as e:
+            print(f"Error in aembed_documents: {str(e)}")
+            raise
+
+    async def aembed_documents_array(self, texts: List[str]) -> np.ndarray:
+        """Embed documents into a float32 (len(texts), dimensions) array."""
+        return np.asarray(await self.aembed_documents(texts), dtype=np.float32)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """Generate embedding for a single query asynchronously."""
+        try:
+            return (await self._aembed([text]))[0]
+        except Exception as e:
+            print(f"Error in aembed_query: {str(e)}")
+            raise
+
+class TTLCache:
+    """In-process cache whose entries expire a fixed number of seconds after being set."""
+
+    def __init__(self, ttl_seconds: float, max_entries: int = 1024):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: Dict[Any, tuple] = {}
+
+    def get(self, key: Any) -> Optional[Any]:
+        """Return the cached value, or None if it is missing or expired."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        return value
+
+    def set(self, key: Any, value: Any):
+        """Store a value, evicting the oldest entry when full."""
+        if key not in self._entries and len(self._entries) >= self.max_entries:
+            del self._entries[next(iter(self._entries))]
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+
+JSON_SCHEMA_TYPES = {"string": str, "integer": int, "number": float, "boolean": bool}
+
+# Metadata keys used to deduplicate passages; stored as lc_content_hash / lc_document_hash properties
+CONTENT_HASH_KEY = "content_hash"
+DOCUMENT_HASH_KEY = "document_hash"
+# Ingestion job that wrote a passage, so a partial earlier attempt is not mistaken for a finished upload
+INGESTION_JOB_KEY = "ingestion_job_id"
+
+def content_hash(text: str) -> str:
+    """Hash passage text for deduplication."""
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+def args_schema_from_config(function: Dict[str, Any]) -> type[BaseModel]:
+    """Build a pydantic args schema from a config.yaml function definition."""
+    parameters = function.get("parameters", {})
+    required = set(parameters.get("required", []))
+    fields = {}
+    for name, spec in parameters.get("properties", {}).items():
+        default = ... if name in required or "default" not in spec else spec["default"]
+        fields[name] = (JSON_SCHEMA_TYPES[spec["type"]], Field(default=default, description=spec.get("description")))
+    return create_model(f"{function['name']}_args", **fields)
+
+class ApertureMMRRetriever(BaseRetriever):
+    """Retriever that runs ApertureTools' native MMR search."""
+    tools: Any
+    k: int = 5
+    fetch_k: int = 20
+    lambda_mult: float = 0.7
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        embedding = self.tools.embeddings.embed_query(query)
+        results = self.tools._mmr_search_by_vector(embedding, self.k, self.fetch_k, self.lambda_mult)
+        return [doc for doc, _ in results]
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        results = await self.tools.mmr_search(query, self.k, self.fetch_k, self.lambda_mult)
+        return [doc for doc, _ in results]
+
+def embedding_model_id(settings: Dict[str, Any]) -> str:
+    """Identify the model an embeddings config produces vectors with."""
+    if settings["backend"] == "local":
+        return f"local:{settings['local']['model_path']}"
+    return settings["model"]
+
+def embedding_cache_path(base: str, settings: Dict[str, Any]) -> str:
+    """Cache directory for one model and dimension count, so a migration never shares rows with the live model."""
+    model = re.sub(r"[^A-Za-z0-9._-]+", "_", embedding_model_id(settings)).strip("_")
+    return os.path.join(os.path.dirname(__file__), base, f"{model}-{settings['dimensions']}d")
+
+def create_embeddings(settings: Dict[str, Any]) -> Embeddings:
+    """Build the embedding backend described by an embeddings config section, behind the cache if enabled."""
+    if settings["backend"] == "local":
+        local_config = settings["local"]
+        embeddings = LocalEmbeddings(
+            model_path=os.path.join(os.path.dirname(__file__), local_config["model_path"]),
+            device=local_config["device"],
+            workers=local_config["workers"],
+            max_batch_chars=local_config["max_batch_chars"],
+            normalize=local_config["normalize"],
+            onnx=local_config["onnx"],
+            onnx_file=local_config["onnx_file"]
+        )
+        if embeddings.dimensions != settings["dimensions"]:
+            raise ValueError(f"Local model outputs {embeddings.dimensions} dimensions but embeddings.dimensions is {settings['dimensions']}")
+    elif settings["backend"] == "together":
+        embeddings = TogetherEmbeddings(
+            api_key=os.environ['TOGETHERAI_API_KEY'],
+            model=settings["model"]  # Together AI's embedding model
+        )
+    else:
+        raise ValueError(f"Unknown embeddings backend {settings['backend']!r}")
+    # A cache hit while recording would leave no cassette entry for replay to find
+    if config["embedding_cache"]["enabled"] and not get_cassette().enabled:
+        cache_config = config["embedding_cache"]
+        embeddings = CachedEmbeddings(
+            embeddings,
+            EmbeddingCache(
+                path=embedding_cache_path(cache_config["path"], settings),
+                dimensions=settings["dimensions"],
+                max_entries=cache_config["max_entries"],
+                compact_to=cache_config["compact_to"],
+                precision=cache_config["precision"]
+            ),
+            model=embedding_model_id(settings)
+        )
+    return embeddings
+
 class ApertureTools:
-    def __init__(self):
+    def __init__(self, descriptor_set: Optional[str] = None, embedding_settings: Optional[Dict[str, Any]] = None,
+                 local_indexes: bool = True):
         # Parse ApertureDB configuration from environment
         aperturedb_config = json.loads(os.environ['APERTUREDB_JSON'])
         
-        # Initialize Together AI embeddings
-        self.embeddings = TogetherEmbeddings(
-            api_key=os.environ['TOGETHERAI_API_KEY'],
-            model="togethercomputer/m2-bert-80M-8k-retrieval"  # Together AI's embedding model
-        )
+        # Default to the active descriptor set and the embeddings config its vectors were made with
+        active = active_descriptor_set.read()
+        descriptor_set = descriptor_set or active["descriptor_set"]
+        embedding_settings = embedding_settings or active["embeddings"]
+        
+        # The configured embedding backend (Together AI or a local model), shared with the agent
+        self.embedding_settings = embedding_settings
+        self.dimensions = embedding_settings["dimensions"]
+        self.embeddings = shared_embeddings(embedding_settings)
         
         # Initialize ApertureDB vector store
         self.vectorstore = ApertureDB(
             embeddings=self.embeddings,
-            descriptor_set="spy_glass",
-            dimensions=768  # m2-bert-80M-8k-retrieval outputs 768-dimensional embeddings
+            descriptor_set=descriptor_set,
+            dimensions=self.dimensions
         )
+
+        # Connectors are not thread safe, so concurrent queries each check one out of a pool
+        pool_config = config["aperturedb"]["pool"]
+        self.pool = ApertureConnectionPool(
+            create_connector,
+            size=pool_config["size"],
+            query_timeout=pool_config["query_timeout_seconds"],
+            health_check_interval=pool_config["health_check_interval_seconds"],
+            acquire_timeout=pool_config["acquire_timeout_seconds"]
+        )
+
+        # Optional local mirror of the descriptor set, queried before ApertureDB and kept
+        # in step with other workers (and scripts) through the set's change log
+        self.ann_index: Optional[LocalANNIndex] = None
+        self.change_log: Optional[ChangeLog] = None
+        self._last_full_sync = time.monotonic()
+        if config["ann_index"]["enabled"]:
+            self.change_log = ChangeLog(
+                os.path.join(os.path.dirname(__file__), config["ann_index"]["change_log_path"].format(descriptor_set=descriptor_set)),
+                max_bytes=config["ann_index"]["change_log_max_bytes"]
+            )
+        if config["ann_index"]["enabled"] and local_indexes:
+            ann_config = config["ann_index"]
+            self.ann_index = LocalANNIndex.load(
+                self.ann_index_path(),
+                dimensions=self.dimensions,
+                n_probe=ann_config["n_probe"],
+                nlist=ann_config["nlist"],
+                min_train_size=ann_config["min_train_size"],
+                precision=ann_config["precision"]
+            )
+        
+        # Deduplication looks passages up by content hash and filename, so index both properties
+        for key in (CONTENT_HASH_KEY, "filename"):
+            try:
+                self.vectorstore.utils.create_entity_index("_Descriptor", PROPERTY_PREFIX + key)
+            except Exception as e:
+                logger.warning(f"Could not create descriptor index on {key}: {e}")
+        
+        # Optional BM25 index over ingested passages, used to answer keyword queries without embedding them
+        self.lexical_index: Optional[LexicalIndex] = None
+        if config["lexical"]["enabled"] and local_indexes:
+            lexical_config = config["lexical"]
+            self.lexical_index = LexicalIndex(
+                os.path.join(os.path.dirname(__file__), lexical_config["path"].format(descriptor_set=descriptor_set)),
+                k1=lexical_config["k1"],
+                b=lexical_config["b"],
+                compact_after=lexical_config["compact_after_ops"]
+            )
         
         # Create the retriever tool with MMR search
-        self.retriever = self.vectorstore.as_retriever(
-            search_type="mmr",  # Use Maximum Marginal Relevance
-            search_kwargs={
-                "k": 5,
-                "fetch_k": 20,  # Fetch more documents for diversity
-                "lambda_mult": 0.7  # Balance between relevance and diversity
-            }
+        self.retriever = ApertureMMRRetriever(
+            tools=self,
+            k=config["search"]["k"],
+            fetch_k=config["search"]["fetch_k"],  # Fetch more documents for diversity
+            lambda_mult=config["search"]["lambda_mult"]  # Balance between relevance and diversity
         )
         
         # Create the LangChain tool
@@ -90,30 +487,487 @@ class ApertureTools:
             description="Search for relevant business reports and market analysis. Use this for finding information about market trends, competitor analysis, and business opportunities."
         )
 
+    def ann_index_path(self) -> str:
+        """Where the local ANN mirror of this descriptor set is persisted."""
+        path = config["ann_index"]["path"].format(descriptor_set=self.vectorstore.descriptor_set)
+        return os.path.join(os.path.dirname(__file__), path)
+
+    def existing_ids(self, ids: List[str]) -> set:
+        """Return the subset of ids stored in this descriptor set."""
+        if not ids:
+            return set()
+        response, _ = self._query([{
+            "FindDescriptor": {
+                "set": self.vectorstore.descriptor_set,
+                "constraints": {UNIQUEID_PROPERTY: ["in", ids]},
+                "results": {"list": [UNIQUEID_PROPERTY]}
+            }
+        }])
+        return {entity[UNIQUEID_PROPERTY] for entity in response[0]["FindDescriptor"].get("entities", [])}
+
     def get_tool(self):
         """Get the LangChain retriever tool."""
         return self.tool
 
+    @staticmethod
+    def _format_documents(documents: List[Document]) -> str:
+        """Format documents as text for a tool response."""
+        if not documents:
+            return "No matching documents found."
+        return "\n\n".join(
+            f"[{i}] ({doc.metadata.get('filename', 'unknown source')}) {doc.page_content}"
+            for i, doc in enumerate(documents, start=1)
+        )
+
+    async def search_similar_companies(self, description: str, limit: int = 5) -> str:
+        """Find companies similar to a company or product description."""
+        try:
+            results = await self.search_similar_documents(description, k=limit)
+            return self._format_documents([doc for doc, _ in results])
+        except Exception as e:
+            raise Exception(f"Failed to search similar companies: {str(e)}")
+
+    async def search_market_data(self, keywords: str, limit: int = 5) -> str:
+        """Find market data and trends matching keywords."""
+        try:
+            results = await self.search_similar_documents(f"market data and trends: {keywords}", k=limit)
+            return self._format_documents([doc for doc, _ in results])
+        except Exception as e:
+            raise Exception(f"Failed to search market data: {str(e)}")
+
+    def _query(self, query: List[Dict[str, Any]], blobs: Optional[List[bytes]] = None) -> Tuple[List[Dict[str, Any]], List[bytes]]:
+        """Run a blocking ApertureDB query on a pooled connector and check it succeeded."""
+        return self.pool.query(query, blobs)
+
+    def _decode_vectors(self, response_blobs: List[bytes], count: int) -> np.ndarray:
+        """Turn the descriptor blobs of a response into a (count, dimensions) float32 array."""
+        if not count:
+            return np.empty((0, self.dimensions), dtype=np.float32)
+        return np.frombuffer(b"".join(response_blobs), dtype=np.float32).reshape(count, self.dimensions)
+
+    def _get_documents(self, ids: List[str], blobs: bool = False) -> Dict[str, Any]:
+        """Fetch documents by unique id.
+
+        With ``blobs`` each value is a (document, float32 vector) pair, so
+        callers can re-score at full precision in the same round trip.
+        """
+        response, response_blobs = self._query([{
+            "FindDescriptor": {
+                "set": self.vectorstore.descriptor_set,
+                "constraints": {UNIQUEID_PROPERTY: ["in", ids]},
+                "blobs": blobs,
+                "results": {"all_properties": True}
+            }
+        }])
+        entities = response[0]["FindDescriptor"].get("entities", [])
+        documents = [self.vectorstore._descriptor_to_document(entity) for entity in entities]
+        if blobs:
+            vectors = self._decode_vectors(response_blobs, len(entities))
+            return {entity[UNIQUEID_PROPERTY]: (doc, vector) for entity, doc, vector in zip(entities, documents, vectors)}
+        return {entity[UNIQUEID_PROPERTY]: doc for entity, doc in zip(entities, documents)}
+
+    def iter_descriptors(self, page_size: int, properties: Optional[List[str]] = None, blobs: bool = False, after: Optional[str] = None):
+        """Page through the descriptor set in unique id order, yielding (entities, vectors) per page.
+
+        Pages are keyed on the last unique id seen rather than an offset, so
+        concurrent writes do not shift later pages.
+        """
+        while True:
+            results = {"sort": {"key": UNIQUEID_PROPERTY, "order": "ascending"}, "limit": page_size}
+            if properties is None:
+                results["all_properties"] = True
+            else:
+                results["list"] = [UNIQUEID_PROPERTY, *properties]
+            command = {
+                "set": self.vectorstore.descriptor_set,
+                "blobs": blobs,
+                "results": results
+            }
+            if after is not None:
+                command["constraints"] = {UNIQUEID_PROPERTY: [">", after]}
+            response, response_blobs = self._query([{"FindDescriptor": command}])
+            entities = response[0]["FindDescriptor"].get("entities", [])
+            if not entities:
+                return
+            vectors = self._decode_vectors(response_blobs, len(entities)) if blobs else None
+            yield entities, vectors
+            if len(entities) < page_size:
+                return
+            after = entities[-1][UNIQUEID_PROPERTY]
+
+    def _sync_ann_index(self) -> bool:
+        """Pull ids added or deleted by other workers into the local index. Returns whether it changed.
+
+        Normally only the change log entries after the index's watermark are
+        read. The whole id list is compared instead on the first sync, after
+        the log was swapped, and every full_sync_interval_seconds to pick up
+        writes that bypassed the log.
+        """
+        ann_config = config["ann_index"]
+        page_size = ann_config["fetch_batch_size"]
+        changes, watermark = self.change_log.read_since(self.ann_index.watermark)
+        full_interval = ann_config["full_sync_interval_seconds"]
+        if changes is None or (full_interval and time.monotonic() - self._last_full_sync >= full_interval):
+            watermark = self.change_log.position()
+            remote_ids = set()
+            for entities, _ in self.iter_descriptors(page_size, properties=[]):
+                remote_ids.update(entity[UNIQUEID_PROPERTY] for entity in entities)
+            removed = [unique_id for unique_id in self.ann_index.snapshot_ids() if unique_id not in remote_ids]
+            added = [unique_id for unique_id in remote_ids if unique_id not in self.ann_index]
+            self._last_full_sync = time.monotonic()
+        else:
+            # Replay in order, keeping each id's last change; ids this worker wrote itself are already applied
+            last_change = dict((unique_id, op) for op, unique_id in changes)
+            removed = [unique_id for unique_id, op in last_change.items() if op == "-" and unique_id in self.ann_index]
+            added = [unique_id for unique_id, op in last_change.items() if op == "+" and unique_id not in self.ann_index]
+        self.ann_index.remove(removed)
+        added_count = 0
+        for start in range(0, len(added), page_size):
+            batch = added[start:start + page_size]
+            response, response_blobs = self._query([{
+                "FindDescriptor": {
+                    "set": self.vectorstore.descriptor_set,
+                    "constraints": {UNIQUEID_PROPERTY: ["in", batch]},
+                    "blobs": True,
+                    "results": {"list": [UNIQUEID_PROPERTY]}
+                }
+            }])
+            entities = response[0]["FindDescriptor"].get("entities", [])
+            # Ids logged as added may have been deleted since
+            if entities:
+                self.ann_index.add([entity[UNIQUEID_PROPERTY] for entity in entities], self._decode_vectors(response_blobs, len(entities)))
+                added_count += len(entities)
+        # Advanced only once everything up to it is applied, so a failed fetch is retried next time
+        self.ann_index.watermark = watermark
+        if removed or added_count:
+            logger.info(f"Synced local ANN index: {added_count} added, {len(removed)} removed, {len(self.ann_index)} total")
+        return bool(removed or added_count)
+
+    async def sync_ann_index(self):
+        """Synchronize the local ANN index with ApertureDB and persist it if it changed."""
+        if self.ann_index is None:
+            return
+        changed = await self.pool.run(self._sync_ann_index, bounded=False)
+        if changed:
+            path = self.ann_index_path()
+            await asyncio.to_thread(self.ann_index.save, path)
+
+    def _add_embedded(self, documents: List[Document], embeddings: np.ndarray) -> List[str]:
+        """Write documents with precomputed embeddings to the descriptor set in one transaction."""
+        ids = [doc.id or str(uuid.uuid4()) for doc in documents]
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        query, blobs = [], []
+        for doc, embedding, unique_id in zip(documents, embeddings, ids):
+            properties = {PROPERTY_PREFIX + k: v for k, v in doc.metadata.items()}
+            properties[TEXT_PROPERTY] = doc.page_content
+            properties[UNIQUEID_PROPERTY] = unique_id
+            query.append({
+                "AddDescriptor": {
+                    "set": self.vectorstore.descriptor_set,
+                    "properties": properties
+                }
+            })
+            blobs.append(embedding.tobytes())
+        self._query(query, blobs)
+        if self.change_log is not None:
+            self.change_log.append(added=ids)
+        if self.ann_index is not None:
+            self.ann_index.add(ids, embeddings)
+        if self.lexical_index is not None:
+            self.lexical_index.add([(unique_id, doc.page_content, doc.metadata) for unique_id, doc in zip(ids, documents)])
+        return ids
+
+    async def write_documents(self, documents: List[Document], embeddings: np.ndarray) -> List[str]:
+        """Write documents with precomputed embeddings in one transaction, off the event loop."""
+        ids = await self.pool.run(self._add_embedded, documents, embeddings)
+        corpus_generation.bump()
+        return ids
+
+    def _find_content_hashes(self, hashes: List[str], metadata: Optional[Dict[str, Any]] = None) -> Dict[str, str]:
+        """Map content hashes that are already stored to the id of a passage holding them.
+
+        ``metadata`` restricts the match to passages with those metadata values.
+        """
+        constraints = {PROPERTY_PREFIX + key: ["==", value] for key, value in (metadata or {}).items()}
+        constraints[PROPERTY_PREFIX + CONTENT_HASH_KEY] = ["in", hashes]
+        response, _ = self._query([{
+            "FindDescriptor": {
+                "set": self.vectorstore.descriptor_set,
+                "constraints": constraints,
+                "results": {"list": [UNIQUEID_PROPERTY, PROPERTY_PREFIX + CONTENT_HASH_KEY]}
+            }
+        }])
+        entities = response[0]["FindDescriptor"].get("entities", [])
+        return {entity[PROPERTY_PREFIX + CONTENT_HASH_KEY]: entity[UNIQUEID_PROPERTY] for entity in entities}
+
+    async def find_content_hashes(self, hashes: List[str]) -> Dict[str, str]:
+        """Map content hashes that are already stored to the id of a passage holding them."""
+        if not hashes:
+            return {}
+        return await self.pool.run(self._find_content_hashes, list(dict.fromkeys(hashes)))
+
+    def _get_vectors(self, ids: List[str]) -> Dict[str, np.ndarray]:
+        if not ids:
+            return {}
+        documents = self._get_documents(list(dict.fromkeys(ids)), True)
+        return {unique_id: vector for unique_id, (_, vector) in documents.items()}
+
+    async def get_vectors(self, ids: List[str]) -> Dict[str, np.ndarray]:
+        """Fetch the stored vectors of passages by unique id; missing ids are left out."""
+        if not ids:
+            return {}
+        return await self.pool.run(self._get_vectors, ids)
+
+    def _find_file_passages(self, filename: str) -> List[Dict[str, Any]]:
+        response, _ = self._query([{
+            "FindDescriptor": {
+                "set": self.vectorstore.descriptor_set,
+                "constraints": {PROPERTY_PREFIX + "filename": ["==", filename]},
+                "results": {"list": [
+                    UNIQUEID_PROPERTY,
+                    PROPERTY_PREFIX + CONTENT_HASH_KEY,
+                    PROPERTY_PREFIX + DOCUMENT_HASH_KEY,
+                    PROPERTY_PREFIX + INGESTION_JOB_KEY
+                ]}
+            }
+        }])
+        return [
+            {
+                "id": entity[UNIQUEID_PROPERTY],
+                CONTENT_HASH_KEY: entity.get(PROPERTY_PREFIX + CONTENT_HASH_KEY),
+                DOCUMENT_HASH_KEY: entity.get(PROPERTY_PREFIX + DOCUMENT_HASH_KEY),
+                INGESTION_JOB_KEY: entity.get(PROPERTY_PREFIX + INGESTION_JOB_KEY)
+            }
+            for entity in response[0]["FindDescriptor"].get("entities", [])
+        ]
+
+    async def find_file_passages(self, filename: str) -> List[Dict[str, Any]]:
+        """List the id, content hash, document hash and ingestion job of every passage stored for a filename."""
+        return await self.pool.run(self._find_file_passages, filename)
+
+    async def add_documents(self, documents: List[Document]) -> List[str]:
+        """Embed and add documents whose content is not stored yet, returning an id for every document.
+
+        Documents already stored (by content hash) are neither embedded nor
+        written again; their existing ids are returned instead.
+        """
+        hashes = [doc.metadata.get(CONTENT_HASH_KEY) or content_hash(doc.page_content) for doc in documents]
+        existing = await self.find_content_hashes(hashes)
+        new_documents: Dict[str, Document] = {}
+        for doc, digest in zip(documents, hashes):
+            if digest not in existing and digest not in new_documents:
+                new_documents[digest] = Document(
+                    page_content=doc.page_content,
+                    metadata={**doc.metadata, CONTENT_HASH_KEY: digest},
+                    id=doc.id
+                )
+        if new_documents:
+            documents_to_write = list(new_documents.values())
+            embeddings = await self.embeddings.aembed_documents_array([doc.page_content for doc in documents_to_write])
+            ids = await self.write_documents(documents_to_write, embeddings)
+            existing.update(zip(new_documents, ids))
+        return [existing[digest] for digest in hashes]
+
     async def add_document(self, document: Document):
         """Add a new document to the vector store using async method."""
         try:
-            await self.vectorstore.aadd_documents([document])
+            await self.add_documents([document])
             return True
         except Exception as e:
             raise Exception(f"Failed to add document: {str(e)}")
 
+    async def retrieve(self, query: str) -> List[Document]:
+        """Retrieve documents for a query through the MMR retriever."""
+        try:
+            return await self.retriever.ainvoke(query)
+        except Exception as e:
+            raise Exception(f"Failed to retrieve documents: {str(e)}")
+
+    def _search_by_vectors(self, embeddings: List[List[float]], k: int) -> List[List[tuple]]:
+        """Run blocking similarity searches for several embeddings in one transaction."""
+        response, _ = self._query([{
+            "FindDescriptor": {
+                "set": self.vectorstore.descriptor_set,
+                "k_neighbors": k,
+                "distances": True,
+                "results": {"all_properties": True}
+            }
+        } for _ in embeddings], [np.array(embedding, dtype=np.float32).tobytes() for embedding in embeddings])
+        return [
+            [(self.vectorstore._descriptor_to_document(entity), entity["_distance"]) for entity in command["FindDescriptor"].get("entities", [])]
+            for command in response
+        ]
+
+    def _search_by_vector(self, embedding: List[float], k: int) -> List[tuple]:
+        """Run a blocking similarity search for an embedding, returning (document, score) pairs."""
+        return self._search_by_vectors([embedding], k)[0]
+
+    def _search_local_batch(self, embeddings: List[List[float]], k: int) -> List[List[tuple]]:
+        """Search the local ANN index for several embeddings and fetch bodies for all hits in one query.
+
+        A quantized index over-fetches ``rerank_factor * k`` candidates and
+        re-scores them with the exact vectors returned alongside the bodies.
+        """
+        rerank_factor = config["ann_index"]["rerank_factor"]
+        exact = self.ann_index.codec.precision == "float32" or rerank_factor <= 1
+        hits = [self.ann_index.search(embedding, k if exact else k * rerank_factor) for embedding in embeddings]
+        ids = list(dict.fromkeys(unique_id for query_hits in hits for unique_id, _ in query_hits))
+        found = self._get_documents(ids, blobs=not exact) if ids else {}
+        results = []
+        for embedding, query_hits in zip(embeddings, hits):
+            if exact:
+                results.append([(found[unique_id], score) for unique_id, score in query_hits if unique_id in found])
+                continue
+            candidates = [found[unique_id] for unique_id, _ in query_hits if unique_id in found]
+            if not candidates:
+                results.append([])
+                continue
+            documents, vectors = zip(*candidates)
+            order, scores = rerank(embedding, np.stack(vectors), k)
+            results.append([(documents[i], float(scores[i])) for i in order])
+        return results
+
+    def _search_local(self, embedding: List[float], k: int) -> List[tuple]:
+        """Search the local ANN index and fetch bodies for the top k only."""
+        return self._search_local_batch([embedding], k)[0]
+
+    def _fetch_candidates(self, embedding: List[float], fetch_k: int) -> Tuple[List[Any], np.ndarray]:
+        """Fetch the fetch_k nearest candidates with their vectors in one round trip.
+
+        Returns document ids when the local ANN index answers (bodies are
+        fetched later for the selected few) and Documents otherwise.
+        """
+        if self.ann_index is not None and len(self.ann_index):
+            ids = [unique_id for unique_id, _ in self.ann_index.search(embedding, fetch_k)]
+            return ids, self.ann_index.get_vectors(ids)
+        response, response_blobs = self._query([{
+            "FindDescriptor": {
+                "set": self.vectorstore.descriptor_set,
+                "k_neighbors": fetch_k,
+                "blobs": True,
+                "results": {"all_properties": True}
+            }
+        }], [np.array(embedding, dtype=np.float32).tobytes()])
+        entities = response[0]["FindDescriptor"].get("entities", [])
+        vectors = self._decode_vectors(response_blobs, len(entities))
+        return [self.vectorstore._descriptor_to_document(entity) for entity in entities], vectors
+
+    def _mmr_search_by_vector(self, embedding: List[float], k: int, fetch_k: int, lambda_mult: float) -> List[tuple]:
+        """Blocking MMR search returning (document, relevance) pairs in selection order."""
+        candidates, vectors = self._fetch_candidates(embedding, fetch_k)
+        selected, relevance = maximal_marginal_relevance(embedding, vectors, k, lambda_mult)
+        if candidates and isinstance(candidates[0], str):
+            documents = self._get_documents([candidates[i] for i in selected])
+            return [(documents[candidates[i]], float(relevance[i])) for i in selected if candidates[i] in documents]
+        return [(candidates[i], float(relevance[i])) for i in selected]
+
+    async def mmr_search(self, query: str, k: int = 5, fetch_k: int = 20, lambda_mult: float = 0.7) -> List[tuple]:
+        """Search for relevant but mutually diverse documents with relevance scores."""
+        try:
+            embedding = await self.embeddings.aembed_query(query)
+            return await self.pool.run(self._mmr_search_by_vector, embedding, k, fetch_k, lambda_mult)
+        except Exception as e:
+            raise Exception(f"Failed to run MMR search: {str(e)}")
+
     async def search_similar_documents(self, query: str, k: int = 5):
         """Search for similar documents with relevance scores."""
         try:
-            docs = await self.vectorstore.asimilarity_search_with_relevance_scores(query, k=k)
-            return docs
+            embedding = await self.embeddings.aembed_query(query)
+            if self.ann_index is not None and len(self.ann_index):
+                return await self.pool.run(self._search_local, embedding, k)
+            return await self.pool.run(self._search_by_vector, embedding, k)
         except Exception as e:
             raise Exception(f"Failed to search documents: {str(e)}")
 
+    def _search_lexical(self, query: str, k: int) -> List[tuple]:
+        """BM25 search over the lexical index, returning (document, score) pairs."""
+        results = []
+        for unique_id, score in self.lexical_index.search(query, k):
+            stored = self.lexical_index.get(unique_id)
+            if stored is not None:
+                results.append((Document(page_content=stored[0], metadata=stored[1], id=unique_id), score))
+        return results
+
+    async def routed_search(self, query: str, k: int = 5, mode: Optional[str] = None) -> List[tuple]:
+        """Search through the query router.
+
+        ``auto`` answers keyword-like queries from the lexical index and
+        falls back to vector search when it has no match; ``hybrid`` runs
+        both and fuses the rankings; ``vector`` and ``lexical`` force one.
+        """
+        lexical_config = config["lexical"]
+        mode = mode or lexical_config["router"]
+        if self.lexical_index is None or mode == "vector":
+            return await self.search_similar_documents(query, k=k)
+        try:
+            if mode == "lexical" or (mode == "auto" and is_keyword_query(query, lexical_config["max_keyword_terms"])):
+                results = await asyncio.to_thread(self._search_lexical, query, k)
+                if results or mode == "lexical":
+                    return results
+            if mode != "hybrid":
+                return await self.search_similar_documents(query, k=k)
+            lexical, vector = await asyncio.gather(
+                asyncio.to_thread(self._search_lexical, query, 2 * k),
+                self.search_similar_documents(query, k=2 * k)
+            )
+        except Exception as e:
+            raise Exception(f"Failed to search documents: {str(e)}")
+        documents = {doc.id: doc for doc, _ in lexical + vector}
+        fused = reciprocal_rank_fusion(
+            [[doc.id for doc, _ in lexical], [doc.id for doc, _ in vector]], k, lexical_config["fusion_k"]
+        )
+        return [(documents[unique_id], score) for unique_id, score in fused]
+
+    async def search_batch(self, queries: List[str], k: int = 5) -> List[List[tuple]]:
+        """Search for several queries with one embedding call and one ApertureDB transaction."""
+        try:
+            embeddings = await self.embeddings.aembed_documents(queries)
+            if self.ann_index is not None and len(self.ann_index):
+                return await self.pool.run(self._search_local_batch, embeddings, k)
+            return await self.pool.run(self._search_by_vectors, embeddings, k)
+        except Exception as e:
+            raise Exception(f"Failed to search documents: {str(e)}")
+
+    async def score_uniqueness(self, texts: List[str]) -> Tuple[List[Optional[float]], np.ndarray]:
+        """Embed texts in one batch and measure how close each is to the corpus and to the others.
+
+        Returns the cosine similarity of each text to its nearest stored
+        passage (None when the corpus is empty) and the pairwise similarity
+        matrix of the texts, whose diagonal is -inf.
+        """
+        try:
+            embeddings = await self.embeddings.aembed_documents_array(texts)
+            if self.ann_index is not None and len(self.ann_index):
+                nearest = await self.pool.run(self._search_local_batch, embeddings.tolist(), 1)
+            else:
+                nearest = await self.pool.run(self._search_by_vectors, embeddings.tolist(), 1)
+            corpus_similarity = [float(hits[0][1]) if hits else None for hits in nearest]
+            return corpus_similarity, pairwise_similarity(embeddings)
+        except Exception as e:
+            raise Exception(f"Failed to score uniqueness: {str(e)}")
+
+    def _delete(self, ids: Optional[List[str]]):
+        if ids is None:
+            raise ValueError("ids must be provided")
+        response, _ = self._query([{
+            "DeleteDescriptor": {
+                "set": self.vectorstore.descriptor_set,
+                "constraints": {UNIQUEID_PROPERTY: ["in", ids]}
+            }
+        }])
+        if self.change_log is not None:
+            self.change_log.append(removed=ids)
+        if self.ann_index is not None:
+            self.ann_index.remove(ids)
+        if self.lexical_index is not None:
+            self.lexical_index.remove(ids)
+        return response
+
     async def delete_documents(self, ids: Optional[List[str]] = None):
         """Delete documents from the vector store."""
         try:
-            await self.vectorstore.adelete(ids=ids)
+            await self.pool.run(self._delete, ids)
+            corpus_generation.bump()
             return True
         except Exception as e:
             raise Exception(f"Failed to delete documents: {str(e)}")
@@ -124,3 +978,115 @@ class ApertureTools:
             return self.tool.invoke(tool_call)
         except Exception as e:
             raise Exception(f"Failed to handle tool call: {str(e)}")
+
+
+_aperture_tools: Optional[ApertureTools] = None
+_aperture_tools_version: Optional[tuple] = None
+_aperture_tools_lock = asyncio.Lock()
+
+def get_aperture_tools() -> ApertureTools:
+    """Get the shared ApertureTools instance, creating it on first use and again after the active set switches."""
+    global _aperture_tools, _aperture_tools_version
+    version = active_descriptor_set.version()
+    if _aperture_tools is None or version != _aperture_tools_version:
+        # The previous instance is not closed: in-flight requests and ingestion jobs may still
+        # hold it, and its connectors and threads are released once they let go
+        _aperture_tools = ApertureTools()
+        _aperture_tools_version = version
+        logger.info(f"Using descriptor set {_aperture_tools.vectorstore.descriptor_set}")
+    return _aperture_tools
+
+async def aget_aperture_tools() -> ApertureTools:
+    """Get the shared ApertureTools instance without blocking the event loop."""
+    if _aperture_tools is not None and active_descriptor_set.version() == _aperture_tools_version:
+        return _aperture_tools
+    async with _aperture_tools_lock:
+        # Connecting to ApertureDB is blocking, so do it off the event loop
+        return await asyncio.to_thread(get_aperture_tools)
+
+_shared_embeddings: Optional[Tuple[Dict[str, Any], Embeddings]] = None
+_shared_embeddings_lock = threading.Lock()
+
+def shared_embeddings(settings: Dict[str, Any]) -> Embeddings:
+    """Get the process-wide embedding backend for an embeddings config, so a local model and its cache are loaded once."""
+    global _shared_embeddings
+    with _shared_embeddings_lock:
+        if _shared_embeddings is None or _shared_embeddings[0] != settings:
+            _shared_embeddings = (settings, create_embeddings(settings))
+        return _shared_embeddings[1]
+
+_active_embedding_settings: Optional[Tuple[Any, Dict[str, Any]]] = None
+
+def get_active_embeddings() -> Tuple[Dict[str, Any], Embeddings]:
+    """Get the embeddings config and backend of the active descriptor set without connecting to ApertureDB."""
+    global _active_embedding_settings
+    version = active_descriptor_set.version()
+    if _active_embedding_settings is None or _active_embedding_settings[0] != version:
+        _active_embedding_settings = (version, active_descriptor_set.read()["embeddings"])
+    settings = _active_embedding_settings[1]
+    return settings, shared_embeddings(settings)
+
+def close_aperture_tools():
+    """Close the pooled ApertureDB connections, if they were ever opened."""
+    if _aperture_tools is not None:
+        _aperture_tools.pool.close()
+
+# Which descriptor set (and embedding model) is live; switched by scripts/migrate_descriptor_set.py
+active_descriptor_set = ActiveDescriptorSet(
+    os.path.join(os.path.dirname(__file__), config["aperturedb"]["active_set_path"]),
+    default_set=config["aperturedb"]["descriptor_set"],
+    default_embeddings=config["embeddings"]
+)
+
+# Bumped on every write or delete so cached search results never outlive the corpus they came from
+corpus_generation = CorpusGeneration(os.path.join(os.path.dirname(__file__), config["search"]["generation_path"]))
+
+# Tool results are shared across requests until they expire or the corpus changes
+tool_cache = TTLCache(ttl_seconds=config["aperturedb"]["tool_cache_ttl_seconds"])
+_config_tools: Optional[List[StructuredTool]] = None
+
+def _cached_tool(name: str):
+    """Create a tool coroutine that memoizes ApertureTools results per (tool, arguments)."""
+    async def run(**kwargs) -> str:
+        key = (corpus_generation.current(), name, json.dumps(kwargs, sort_keys=True))
+        cached = tool_cache.get(key)
+        if cached is not None:
+            logger.info(f"Tool cache hit for {name}")
+            return cached
+        tools = await aget_aperture_tools()
+        result = await getattr(tools, name)(**kwargs)
+        tool_cache.set(key, result)
+        return result
+    return run
+
+def get_config_tools() -> List[StructuredTool]:
+    """Get LangChain tools for the function definitions under aperturedb.tools in config.yaml.
+
+    The ApertureDB connection is only opened when a tool is first called, so
+    the tools can be bound to a model without touching the database.
+    """
+    global _config_tools
+    if _config_tools is None:
+        _config_tools = []
+        for tool_config in config["aperturedb"]["tools"]:
+            function = tool_config["function"]
+            _config_tools.append(StructuredTool.from_function(
+                coroutine=_cached_tool(function["name"]),
+                name=function["name"],
+                description=function["description"],
+                args_schema=args_schema_from_config(function)
+            ))
+    return _config_tools
+
+async def run_ann_sync():
+    """Periodically pull descriptor set changes into the local ANN index."""
+    interval = config["ann_index"]["sync_interval_seconds"]
+    while True:
+        try:
+            tools = await aget_aperture_tools()
+            await tools.sync_ann_index()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Local ANN index sync failed: {e}")
+        await asyncio.sleep(interval)
@@ -0,0 +1,197 @@
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import fcntl
+import io
+import json
+import logging
+import os
+import threading
+import yaml
+from datetime import datetime
+import numpy as np
+from vectors import normalize
+
+logger = logging.getLogger(__name__)
+
+# Load configuration
+config_path = os.path.join(os.path.dirname(__file__), "config.yaml")
+with open(config_path, "r") as f:
+    config = yaml.safe_load(f)
+
+YEAR_FIELDS = ["Year_2025", "Year_2026", "Year_2027", "Year_2028", "Year_2029", "Year_2030"]
+
+def trend_text(trend: Any) -> str:
+    """Text a trend is embedded by when clustering."""
+    return f"{trend.name}: {trend.description}"
+
+class TrendRegistry:
+    """Canonical trends clustered from every analysis, shared by all workers through one file.
+
+    Each canonical trend keeps the unit centroid of the trends assigned to
+    it, its first name and description, and the running mean of their
+    2025-2030 growth series. A new trend joins the nearest canonical trend
+    when their cosine similarity reaches ``threshold`` and founds a new one
+    otherwise; all similarities of a batch come from one matrix multiply.
+    The file records the embedding model, and vectors from another model
+    start a fresh registry.
+    """
+
+    def __init__(self, path: str, dimensions: int, model_id: str, threshold: float):
+        self.path = path
+        self.lock_path = path + ".lock"
+        self.dimensions = dimensions
+        self.model_id = model_id
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._version: Optional[Tuple[int, int]] = None
+        self.centroids = np.empty((0, dimensions), dtype=np.float32)
+        self.trends: List[Dict[str, Any]] = []
+        self.next_id = 1
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def __len__(self) -> int:
+        self.refresh()
+        return len(self.trends)
+
+    def refresh(self):
+        """Reload the registry if another worker has saved it since it was last read."""
+        with self._lock:
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                return
+            version = (stat.st_ino, stat.st_mtime_ns)
+            if version == self._version:
+                return
+            with np.load(self.path) as data:
+                state = json.loads(bytes(data["state"]).decode())
+                centroids = data["centroids"]
+            self._version = version
+            if state["model_id"] != self.model_id or centroids.shape[1] != self.dimensions:
+                logger.warning(f"Trend registry was built with {state['model_id']}; starting over for {self.model_id}")
+                return
+            self.centroids = centroids
+            self.trends = state["trends"]
+            self.next_id = state["next_id"]
+
+    def _save(self):
+        state = json.dumps({"model_id": self.model_id, "next_id": self.next_id, "trends": self.trends}).encode()
+        buffer = io.BytesIO()
+        np.savez(buffer, centroids=self.centroids, state=np.frombuffer(state, dtype=np.uint8))
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(buffer.getvalue())
+        os.replace(tmp_path, self.path)
+        stat = os.stat(self.path)
+        self._version = (stat.st_ino, stat.st_mtime_ns)
+
+    def add(self, trends: Sequence[Any], embeddings: np.ndarray) -> List[str]:
+        """Assign each trend to a canonical trend, creating new ones as needed, and return their ids."""
+        embeddings = normalize(np.asarray(embeddings, dtype=np.float32))
+        now = datetime.now().isoformat()
+        with open(self.lock_path, "ab") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self.refresh()
+                with self._lock:
+                    similarity = embeddings @ self.centroids.T
+                    ids = []
+                    founded = []  # indices of trends in this batch that founded a canonical trend
+                    for i, trend in enumerate(trends):
+                        # Trends founded earlier in the batch are candidates too; they were appended
+                        # in order, so an index into scores is also a row of self.trends
+                        scores = np.concatenate([similarity[i], embeddings[founded] @ embeddings[i]])
+                        best = int(np.argmax(scores)) if len(scores) else -1
+                        if best >= 0 and scores[best] >= self.threshold:
+                            row = best
+                            self._merge(row, trend, embeddings[i], now)
+                        else:
+                            self._found(trend, embeddings[i], now)
+                            founded.append(i)
+                            row = len(self.trends) - 1
+                        ids.append(self.trends[row]["id"])
+                    self._save()
+                    return ids
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _found(self, trend: Any, embedding: np.ndarray, now: str):
+        self.trends.append({
+            "id": f"T{self.next_id}",
+            "name": trend.name,
+            "description": trend.description,
+            "years": [float(getattr(trend, field)) for field in YEAR_FIELDS],
+            "count": 1,
+            "first_seen": now,
+            "last_seen": now
+        })
+        self.next_id += 1
+        self.centroids = np.vstack([self.centroids, embedding[None, :]])
+
+    def _merge(self, row: int, trend: Any, embedding: np.ndarray, now: str):
+        canonical = self.trends[row]
+        count = canonical["count"]
+        canonical["years"] = [
+            (mean * count + getattr(trend, field)) / (count + 1)
+            for mean, field in zip(canonical["years"], YEAR_FIELDS)
+        ]
+        canonical["count"] = count + 1
+        canonical["last_seen"] = now
+        self.centroids[row] = normalize(self.centroids[row] * count + embedding)
+
+    def relevant(self, query_embedding: Sequence[float], n: int, min_count: int) -> List[Dict[str, Any]]:
+        """The n canonical trends seen at least min_count times that are most similar to a query."""
+        self.refresh()
+        with self._lock:
+            if not self.trends:
+                return []
+            scores = self.centroids @ normalize(np.asarray(query_embedding, dtype=np.float32))
+            counts = np.array([trend["count"] for trend in self.trends])
+            scores[counts < min_count] = -np.inf
+            order = np.argsort(-scores, kind="stable")[:n]
+            return [self.trends[i] for i in order if np.isfinite(scores[i])]
+
+    def get(self, trend_id: str) -> Optional[Dict[str, Any]]:
+        self.refresh()
+        with self._lock:
+            for trend in self.trends:
+                if trend["id"] == trend_id:
+                    return trend
+        return None
+
+def format_known_trends(trends: List[Dict[str, Any]]) -> str:
+    """Format canonical trends as compact prompt lines the model can reference by id."""
+    if not trends:
+        return "None yet."
+    return "\n".join(
+        f"{trend['id']} | {trend['name']} | 2025-2030: {', '.join(str(round(rate)) for rate in trend['years'])}"
+        for trend in trends
+    )
+
+def expand_trends(data: Dict[str, Any], registry: TrendRegistry) -> Dict[str, Any]:
+    """Fill in the description and growth series the model omitted for trends it referenced by Trend_id."""
+    for trend in data.get("trends", []):
+        canonical = registry.get(trend.get("Trend_id")) if trend.get("Trend_id") else None
+        if canonical is None:
+            continue
+        trend.setdefault("name", canonical["name"])
+        if not trend.get("description"):
+            trend["description"] = canonical["description"]
+        for field, rate in zip(YEAR_FIELDS, canonical["years"]):
+            if not trend.get(field):
+                trend[field] = max(1, min(100, round(rate)))
+    return data
+
+_trend_registry: Optional[TrendRegistry] = None
+
+def get_trend_registry(dimensions: int, model_id: str) -> TrendRegistry:
+    """Get the process-wide trend registry for the active embedding model."""
+    global _trend_registry
+    if _trend_registry is None or _trend_registry.model_id != model_id or _trend_registry.dimensions != dimensions:
+        registry_config = config["trend_registry"]
+        _trend_registry = TrendRegistry(
+            os.path.join(os.path.dirname(__file__), registry_config["path"]),
+            dimensions=dimensions,
+            model_id=model_id,
+            threshold=registry_config["threshold"]
+        )
+    return _trend_registry
@@ -0,0 +1,148 @@
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import fcntl
+import json
+import logging
+import os
+import time
+import yaml
+from datetime import datetime, timezone
+from models import UsageStats
+
+logger = logging.getLogger(__name__)
+
+# Load configuration
+config_path = os.path.join(os.path.dirname(__file__), "config.yaml")
+with open(config_path, "r") as f:
+    config = yaml.safe_load(f)
+
+USAGE_FIELDS = ["llm_calls", "prompt_tokens", "completion_tokens", "llm_seconds", "queue_seconds", "estimated_cost_usd"]
+
+def token_counts(message: Any) -> Tuple[int, int]:
+    """Prompt and completion tokens reported in a chat model response's metadata."""
+    usage = getattr(message, "usage_metadata", None)
+    if usage:
+        return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    token_usage = (getattr(message, "response_metadata", None) or {}).get("token_usage") or {}
+    return token_usage.get("prompt_tokens", 0), token_usage.get("completion_tokens", 0)
+
+def estimate_cost(prompt_tokens: int, completion_tokens: int) -> float:
+    prices = config["usage"]["price_per_million_tokens"]
+    return (prompt_tokens * prices["prompt"] + completion_tokens * prices["completion"]) / 1_000_000
+
+class UsageRecorder:
+    """Accumulates the model calls made while it is active into a UsageStats."""
+
+    def __init__(self):
+        self.usage = UsageStats()
+        self.start = time.perf_counter()
+        self.first_call: Optional[float] = None
+
+    def record(self, message: Any, started: float, seconds: float, replayed: bool):
+        if self.first_call is None:
+            self.first_call = started
+            self.usage.queue_seconds = started - self.start
+        prompt_tokens, completion_tokens = token_counts(message)
+        self.usage.llm_calls += 1
+        self.usage.prompt_tokens += prompt_tokens
+        self.usage.completion_tokens += completion_tokens
+        self.usage.llm_seconds += seconds
+        self.usage.estimated_cost_usd += estimate_cost(prompt_tokens, completion_tokens)
+        if replayed:
+            self.usage.cache = "cassette"
+
+_step_recorder: ContextVar[Optional[UsageRecorder]] = ContextVar("step_usage_recorder", default=None)
+_request_recorders: ContextVar[Optional[List[UsageRecorder]]] = ContextVar("request_usage_recorders", default=None)
+
+def start_request_usage() -> List[UsageRecorder]:
+    """Collect the recorder of every step started from here on, refinements included, for one analysis."""
+    recorders: List[UsageRecorder] = []
+    _request_recorders.set(recorders)
+    return recorders
+
+def start_step_usage() -> UsageRecorder:
+    """Attribute the model calls made from here on in the current task to a new analysis step."""
+    recorder = UsageRecorder()
+    _step_recorder.set(recorder)
+    recorders = _request_recorders.get()
+    if recorders is not None:
+        recorders.append(recorder)
+    return recorder
+
+def record_llm_call(message: Any, started: float, seconds: float, replayed: bool = False):
+    """Add a chat model call to the usage of the current step, if one is being tracked."""
+    recorder = _step_recorder.get()
+    if recorder is not None:
+        recorder.record(message, started, seconds, replayed)
+
+def total_usage(recorders: List[UsageRecorder]) -> UsageStats:
+    """Sum the usage of every step of an analysis."""
+    total = UsageStats()
+    for recorder in recorders:
+        for field in USAGE_FIELDS:
+            setattr(total, field, getattr(total, field) + getattr(recorder.usage, field))
+        if recorder.usage.cache == "cassette":
+            total.cache = "cassette"
+    return total
+
+class UsageLedger:
+    """Append-only JSON Lines log of the usage of every /analyze request, one file per day.
+
+    Records are small single writes under an exclusive lock, so every
+    worker can append to the same file. Aggregation scans only the days
+    asked for.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock_path = os.path.join(path, "ledger.lock")
+        os.makedirs(path, exist_ok=True)
+
+    def record(self, user: str, query: str, analysis_id: str, usage: Dict[str, Any], steps: Dict[str, Any]):
+        now = datetime.now(timezone.utc)
+        entry = {"timestamp": now.isoformat(), "user": user, "query": query, "analysis_id": analysis_id, **usage, "steps": steps}
+        line = (json.dumps(entry) + "\n").encode()
+        with open(self.lock_path, "ab") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(os.path.join(self.path, f"ledger-{now:%Y-%m-%d}.jsonl"), "ab") as f:
+                    f.write(line)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def entries(self, since: Optional[str] = None, until: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """Yield ledger records between two inclusive YYYY-MM-DD dates."""
+        for name in sorted(os.listdir(self.path)):
+            if not (name.startswith("ledger-") and name.endswith(".jsonl")):
+                continue
+            day = name[len("ledger-"):-len(".jsonl")]
+            if (since and day < since) or (until and day > until):
+                continue
+            with open(os.path.join(self.path, name), "r") as f:
+                for line in f:
+                    if line.endswith("\n"):
+                        yield json.loads(line)
+
+    def aggregate(self, group_by: str, since: Optional[str] = None, until: Optional[str] = None,
+                  order_by: str = "estimated_cost_usd", limit: int = 20) -> List[Dict[str, Any]]:
+        """Total usage per user, query or day, largest first, with the slowest request of each group."""
+        groups: Dict[str, Dict[str, Any]] = {}
+        for entry in self.entries(since, until):
+            key = entry["timestamp"][:10] if group_by == "day" else entry[group_by]
+            group = groups.setdefault(key, {group_by: key, "requests": 0, "cache_hits": 0, **{field: 0 for field in USAGE_FIELDS}, "max_llm_seconds": 0.0})
+            group["requests"] += 1
+            group["cache_hits"] += entry["cache"] == "hit"
+            for field in USAGE_FIELDS:
+                group[field] += entry[field]
+            group["max_llm_seconds"] = max(group["max_llm_seconds"], entry["llm_seconds"])
+        rows = sorted(groups.values(), key=lambda group: group[order_by], reverse=True)
+        return rows[:limit]
+
+_usage_ledger: Optional[UsageLedger] = None
+
+def get_usage_ledger() -> UsageLedger:
+    """Get the process-wide usage ledger configured in config.yaml."""
+    global _usage_ledger
+    if _usage_ledger is None:
+        _usage_ledger = UsageLedger(os.path.join(os.path.dirname(__file__), config["usage"]["ledger_path"]))
+    return _usage_ledger
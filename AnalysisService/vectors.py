@@ -0,0 +1,99 @@
+from typing import List, Optional, Sequence, Tuple
+import numpy as np
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """Scale rows to unit length so dot products are cosine similarities."""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+def maximal_marginal_relevance(
+    query: Sequence[float],
+    candidates: np.ndarray,
+    k: int,
+    lambda_mult: float
+) -> Tuple[List[int], np.ndarray]:
+    """Select k diverse candidates by maximal marginal relevance.
+
+    The candidate-to-candidate similarities come from a single matrix
+    multiply; each greedy step is then an argmax over precomputed arrays,
+    so the cost stays flat as ``fetch_k`` grows into the hundreds.
+
+    Returns the selected candidate indices in selection order and the
+    cosine relevance of every candidate to the query.
+    """
+    candidates = normalize(np.asarray(candidates, dtype=np.float32))
+    relevance = candidates @ normalize(np.asarray(query, dtype=np.float32))
+    if len(candidates) == 0:
+        return [], relevance
+    similarity = candidates @ candidates.T
+    redundancy = np.zeros(len(candidates), dtype=np.float32)
+    available = np.ones(len(candidates), dtype=bool)
+    selected: List[int] = []
+    for _ in range(min(k, len(candidates))):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        # Redundancy is the similarity to the closest already-selected candidate
+        redundancy = np.maximum(redundancy, similarity[best]) if len(selected) > 1 else similarity[best].copy()
+    return selected, relevance
+
+PRECISIONS = ("float32", "float16", "int8")
+
+class VectorCodec:
+    """Store unit vectors as float32, float16 or int8 codes and score queries against them.
+
+    float16 halves memory at a relative error around 1e-3. int8 quarters it
+    with symmetric scalar quantization: each dimension has its own scale,
+    fit so the largest magnitude seen maps to 127, and values outside the
+    fitted range are clipped.
+    """
+
+    def __init__(self, dimensions: int, precision: str = "float32", scale: Optional[np.ndarray] = None):
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown vector precision {precision!r}, expected one of {PRECISIONS}")
+        self.dimensions = dimensions
+        self.precision = precision
+        self.dtype = np.dtype(precision)
+        # Components of a unit vector never exceed 1, so this scale is always safe
+        self.scale = scale if scale is not None else np.full(dimensions, 1 / 127, dtype=np.float32)
+
+    def fit(self, vectors: np.ndarray):
+        """Fit per-dimension int8 scales to a sample of vectors. A no-op for float precisions."""
+        if self.precision == "int8" and len(vectors):
+            self.scale = (np.maximum(np.abs(vectors).max(axis=0), 1e-6) / 127).astype(np.float32)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        if self.precision == "int8":
+            return np.clip(np.rint(vectors / self.scale), -127, 127).astype(np.int8)
+        return np.asarray(vectors, dtype=self.dtype)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        if self.precision == "int8":
+            return codes.astype(np.float32) * self.scale
+        return codes.astype(np.float32)
+
+    def scores(self, codes: np.ndarray, query: np.ndarray, chunk_size: int = 16384) -> np.ndarray:
+        """Dot products of a float32 query with every code row, computed in bounded chunks."""
+        # Folding the scales into the query avoids dequantizing the whole matrix
+        query = (query * self.scale).astype(np.float32) if self.precision == "int8" else query.astype(np.float32)
+        if self.precision == "float32":
+            return codes @ query
+        out = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), chunk_size):
+            out[start:start + chunk_size] = codes[start:start + chunk_size].astype(np.float32) @ query
+        return out
+
+def rerank(query: Sequence[float], vectors: np.ndarray, k: int) -> Tuple[List[int], np.ndarray]:
+    """Order candidates by exact cosine similarity to the query, returning the top k indices and all scores."""
+    scores = normalize(np.asarray(vectors, dtype=np.float32)) @ normalize(np.asarray(query, dtype=np.float32))
+    order = np.argsort(-scores, kind="stable")[:k]
+    return order.tolist(), scores
+
+def pairwise_similarity(vectors: np.ndarray) -> np.ndarray:
+    """Cosine similarity of every row to every other row, with the diagonal set to -inf."""
+    vectors = normalize(np.asarray(vectors, dtype=np.float32))
+    similarity = vectors @ vectors.T
+    np.fill_diagonal(similarity, -np.inf)
+    return similarity